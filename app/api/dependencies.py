@@ -0,0 +1,14 @@
+from typing import Iterator
+
+from fastapi import Request
+
+from app.scheduler.loop import scheduling_loop
+
+write_methods = ("POST", "PUT", "PATCH", "DELETE")
+
+
+def trigger_scheduling(request: Request) -> Iterator[None]:
+    """Trigger scheduling run after successful write"""
+    yield
+    if request.method in write_methods:
+        scheduling_loop.trigger()
@@ -1,20 +1,27 @@
-from fastapi import APIRouter, HTTPException
+from typing import Any, Callable, Optional
 
-from app.models import NodeModel, ServiceInstanceModel
-from app.schemas.events import NodeEvent, ServiceInstanceEvent
-from app.schemas.nodes import NodeStatus
-from app.schemas.responses import EventResponse
-from app.schemas.services import ServiceInstanceStatus
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
 
-router = APIRouter(prefix="/api/events")
+from app.api.dependencies import trigger_scheduling
+from app.api.routes import ConnectionScopedRoute
+from app.database import db
+from app.models import ChangeLogModel, NodeModel, ServiceInstanceModel
+from app.schemas.changes import ChangedObjectType
+from app.schemas.events import EventsBatch, NodeEvent, ServiceInstanceEvent
+from app.schemas.helpers import TrackedModel
+from app.schemas.nodes import Node, NodeStatus
+from app.schemas.responses import EventResponse, EventResult, EventsBatchResponse
+from app.schemas.services import ServiceInstance, ServiceInstanceStatus
 
+router = APIRouter(
+    prefix="/api/events", route_class=ConnectionScopedRoute, dependencies=[Depends(trigger_scheduling)]
+)
 
-@router.post("/nodes/", response_model=EventResponse)
-def on_node_event(event: NodeEvent):
-    try:
-        node = NodeModel.retrieve_schema(str(event.node_id))
-    except ValueError as exc:
-        raise HTTPException(status_code=404, detail=str(exc))
+
+def _apply_node_event(event: NodeEvent, node: Optional[Node]):
+    if node is None:
+        raise HTTPException(status_code=404, detail="Not found")
 
     if node.status == NodeStatus.DELETED:
         raise HTTPException(status_code=403, detail="Event for deleted nodes are not allowed")
@@ -22,16 +29,10 @@ def on_node_event(event: NodeEvent):
     if event.updated_status is not None:
         node.status = event.updated_status
 
-    NodeModel.synchronize_schema(node)
-    return EventResponse(status="OK")
-
 
-@router.post("/service-instances/", response_model=EventResponse)
-def on_service_instance_event(event: ServiceInstanceEvent):
-    try:
-        service_instance = ServiceInstanceModel.retrieve_schema(str(event.instance_id))
-    except ValueError as exc:
-        raise HTTPException(status_code=404, detail=str(exc))
+def _apply_service_instance_event(event: ServiceInstanceEvent, service_instance: Optional[ServiceInstance]):
+    if service_instance is None:
+        raise HTTPException(status_code=404, detail="Not found")
 
     if service_instance.status != ServiceInstanceStatus.PLACED:
         raise HTTPException(status_code=403, detail="Event for not PLACED service instances are forbidden")
@@ -41,5 +42,88 @@ def on_service_instance_event(event: ServiceInstanceEvent):
     if event.resource_status is not None:
         service_instance.resource_status = event.resource_status
 
-    ServiceInstanceModel.synchronize_schema(service_instance)
+
+def _apply_batched_event(
+    apply: Callable[[Any, Optional[TrackedModel]], None], event: BaseModel, obj: Optional[TrackedModel]
+) -> EventResult:
+    try:
+        apply(event, obj)
+    except HTTPException as exc:
+        return EventResult(status_code=exc.status_code, detail=exc.detail)
+    return EventResult()
+
+
+@router.post("/nodes/", response_model=EventResponse)
+def on_node_event(event: NodeEvent):
+    columns = {"status": event.updated_status.value} if event.updated_status is not None else {}
+
+    with db.atomic():
+        updated = NodeModel.update_columns_where(
+            str(event.node_id), columns, NodeModel.status != NodeStatus.DELETED.value
+        )
+        if not updated:
+            if not NodeModel.exists(str(event.node_id)):
+                raise HTTPException(status_code=404, detail="Not found")
+            raise HTTPException(status_code=403, detail="Event for deleted nodes are not allowed")
+        ChangeLogModel.record(ChangedObjectType.NODE, [event.node_id])
     return EventResponse(status="OK")
+
+
+@router.post("/service-instances/", response_model=EventResponse)
+def on_service_instance_event(event: ServiceInstanceEvent):
+    columns = {}
+    if event.execution_status is not None:
+        columns["execution_status"] = event.execution_status.value
+    if event.resource_status is not None:
+        columns["resource_status"] = event.resource_status.value
+
+    with db.atomic():
+        updated = ServiceInstanceModel.update_columns_where(
+            str(event.instance_id), columns, ServiceInstanceModel.status == ServiceInstanceStatus.PLACED.value
+        )
+        if not updated:
+            if not ServiceInstanceModel.exists(str(event.instance_id)):
+                raise HTTPException(status_code=404, detail="Not found")
+            raise HTTPException(status_code=403, detail="Event for not PLACED service instances are forbidden")
+        ChangeLogModel.record(ChangedObjectType.SERVICE_INSTANCE, [event.instance_id])
+    return EventResponse(status="OK")
+
+
+@router.post("/batch/", response_model=EventsBatchResponse)
+def on_events_batch(batch: EventsBatch):
+    """
+    Apply many events at once: referenced objects are loaded with one query per type
+    and all changes are written in one transaction. Result of each event is reported separately.
+    Write lock is taken before loading, so rows can't be changed concurrently between reading and writing them.
+    """
+    node_ids = {str(event.node_id) for event in batch.node_events}
+    instance_ids = {str(event.instance_id) for event in batch.service_instance_events}
+
+    with db.atomic(lock_type="IMMEDIATE"):
+        nodes = {node.id: node for node in NodeModel.retrieve_schemas(node_ids)} if node_ids else {}
+        instances = (
+            {instance.id: instance for instance in ServiceInstanceModel.retrieve_schemas(instance_ids)}
+            if instance_ids
+            else {}
+        )
+
+        node_results, applied_node_ids = [], set()
+        for event in batch.node_events:
+            node_results.append(_apply_batched_event(_apply_node_event, event, nodes.get(event.node_id, None)))
+            if node_results[-1].status_code == 200:
+                applied_node_ids.add(event.node_id)
+
+        instance_results, applied_instance_ids = [], set()
+        for event in batch.service_instance_events:
+            instance_results.append(
+                _apply_batched_event(_apply_service_instance_event, event, instances.get(event.instance_id, None))
+            )
+            if instance_results[-1].status_code == 200:
+                applied_instance_ids.add(event.instance_id)
+
+        NodeModel.synchronize_changes(nodes[node_id] for node_id in applied_node_ids)
+        ServiceInstanceModel.synchronize_changes(instances[instance_id] for instance_id in applied_instance_ids)
+        ChangeLogModel.record(ChangedObjectType.NODE, applied_node_ids)
+        ChangeLogModel.record(ChangedObjectType.SERVICE_INSTANCE, applied_instance_ids)
+
+    return EventsBatchResponse(status="OK", node_events=node_results, service_instance_events=instance_results)
@@ -1,24 +1,87 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Callable, Iterable, Iterator, Optional
 
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Header, Query, Response
 from pydantic import UUID4
 
-from app.models import SchedulerLogModel
-from app.scheduler.cluster import ClusterState
+from app.api.routes import ConnectionScopedRoute, matches_etag
+from app.api.snapshots import read_snapshots, retrieve_changed_state, snapshot_response
+from app.api.streaming import accepts_ndjson, ndjson_response, stream_chunks
+from app.models import ChangeLogModel, SchedulerLogModel
+from app.schemas.changes import ChangedObjectType
+from app.schemas.nodes import Node
 from app.schemas.responses import ClusterStateResponse, MetricsResponse
+from app.schemas.services import Service, ServiceInstance
 
-router = APIRouter(prefix="/api/monitoring")
+router = APIRouter(prefix="/api/monitoring", route_class=ConnectionScopedRoute)
+
+
+def _get_state_lines(
+    revision: int,
+    nodes: Iterable[Node],
+    services: Iterable[Service],
+    service_instances: Iterable[ServiceInstance],
+    serialize: Callable[[Any], bytes],
+) -> Iterator[bytes]:
+    yield f'{{"revision": {revision}}}\n'.encode()
+    for object_type, objects in (
+        (ChangedObjectType.SERVICE, services),
+        (ChangedObjectType.SERVICE_INSTANCE, service_instances),
+        (ChangedObjectType.NODE, nodes),
+    ):
+        for obj in objects:
+            yield f'{{"type": "{object_type.value}", "data": '.encode() + serialize(obj) + b"}\n"
 
 
 @router.get("/state/", response_model=ClusterStateResponse)
-def retrieve_cluster_state():
-    state = ClusterState()
+def retrieve_cluster_state(
+    response: Response,
+    since: Optional[int] = Query(None, ge=0),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+):
+    """
+    Cluster state at revision (seq of last change in change log), or only objects changed after since revision.
+    Full state is served from read snapshot. Changes are read after revision,
+    so objects changed concurrently may be returned again after it.
+    If NDJSON is accepted, revision and then each object are streamed as separate lines.
+    """
+    snapshot = read_snapshots.get() if since is None else None
+    revision = snapshot.revision if snapshot is not None else ChangeLogModel.last_seq()
+    etag = f'"{revision}"'
+    if matches_etag(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if accepts_ndjson(accept):
+        if snapshot is not None:
+            lines = _get_state_lines(
+                revision,
+                snapshot.nodes.values(),
+                snapshot.services.values(),
+                snapshot.service_instances.values(),
+                snapshot.serialize,
+            )
+        else:
+            lines = _get_state_lines(revision, *retrieve_changed_state(since), lambda obj: obj.json().encode())
+        return ndjson_response(lines, headers={"ETag": etag})
+
+    if snapshot is not None:
+        return snapshot_response(
+            headers={"ETag": etag},
+            revision=str(revision).encode(),
+            services=snapshot.serialize_list(snapshot.services.values()),
+            service_instances=snapshot.serialize_list(snapshot.service_instances.values()),
+            nodes=snapshot.serialize_list(snapshot.nodes.values()),
+        )
+
+    response.headers["ETag"] = etag
+    nodes, services, service_instances = retrieve_changed_state(since)
     return ClusterStateResponse(
         status="OK",
-        services=state.services,
-        service_instances=state.service_instances,
-        nodes=state.nodes,
+        revision=revision,
+        services=services,
+        service_instances=service_instances,
+        nodes=nodes,
     )
 
 
@@ -26,13 +89,24 @@ def retrieve_cluster_state():
 def retrieve_metrics(
     from_datetime: Optional[datetime] = Query(None, alias="from"),
     duration: Optional[timedelta] = None,
+    accept: Optional[str] = Header(None),
 ):
+    """Scheduler logs, if NDJSON is accepted they are streamed a line per log, reading them by chunks"""
     if from_datetime:
-        logs = SchedulerLogModel.retrieve_schemas_where(SchedulerLogModel.timestamp > from_datetime)
+        where_params = [SchedulerLogModel.timestamp > from_datetime]
     elif duration:
-        logs = SchedulerLogModel.retrieve_schemas_where(SchedulerLogModel.timestamp > (datetime.now() - duration))
+        where_params = [SchedulerLogModel.timestamp > (datetime.now() - duration)]
     else:
-        logs = SchedulerLogModel.retrieve_schemas()
+        where_params = []
+
+    if accepts_ndjson(accept):
+        return ndjson_response(
+            stream_chunks(
+                lambda after, limit: SchedulerLogModel.retrieve_json_chunk(*where_params, after=after, limit=limit)
+            )
+        )
+
+    logs = SchedulerLogModel.retrieve_schemas_where(*where_params)
     return MetricsResponse(
         status="OK",
         data=logs,
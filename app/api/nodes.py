@@ -1,12 +1,28 @@
-from fastapi import APIRouter, HTTPException
+import hashlib
+from datetime import timedelta
+from time import monotonic
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from pydantic import UUID4
 
-from app.models import NodeModel
+from app.api.dependencies import trigger_scheduling
+from app.api.pagination import PageParams, retrieve_page
+from app.api.routes import ConnectionScopedRoute, matches_etag, run_in_connection_scope
+from app.api.snapshots import read_snapshots, snapshot_response
+from app.api.watchers import revision_watcher
+from app.database import db
+from app.models import ChangeLogModel, NodeModel, ServiceInstanceModel
+from app.schemas.changes import ChangedObjectType
 from app.schemas.nodes import Node, NodeStatus
 from app.schemas.requests import CreateNodeRequest
-from app.schemas.responses import NodeListResponse, NodeResponse
+from app.schemas.responses import NodeAssignmentsResponse, NodeListResponse, NodeResponse
+from app.schemas.services import ServiceInstance
+from app.settings import settings
 
-router = APIRouter(prefix="/api/nodes")
+router = APIRouter(
+    prefix="/api/nodes", route_class=ConnectionScopedRoute, dependencies=[Depends(trigger_scheduling)]
+)
 
 
 @router.post("/", response_model=NodeResponse)
@@ -15,17 +31,92 @@ def create_node(request: CreateNodeRequest):
         status=NodeStatus.ACTIVE,
         node_resources=request.node_resources,
     )
-    NodeModel.synchronize_schema(node)
+    with db.atomic():
+        NodeModel.synchronize_schema(node)
+        ChangeLogModel.record(ChangedObjectType.NODE, [node.id])
     return NodeResponse(status="OK", data=node)
 
 
 @router.get("/{node_id}/", response_model=NodeResponse)
 def retrieve_node(node_id: UUID4):
-    try:
-        node = NodeModel.retrieve_schema(str(node_id))
-    except ValueError as exc:
-        raise HTTPException(status_code=404, detail=str(exc))
-    return NodeResponse(status="OK", data=node)
+    snapshot = read_snapshots.get()
+    node = snapshot.nodes.get(node_id, None)
+    if node is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return snapshot_response(data=snapshot.serialize(node, with_backrefs=False))
+
+
+def _retrieve_assignments(node_id: str) -> tuple[int, list[ServiceInstance]]:
+    """Cluster revision (read first) and instances placed on node"""
+    if not NodeModel.exists(node_id):
+        raise HTTPException(status_code=404, detail="Not found")
+    revision = ChangeLogModel.last_seq()
+    return revision, ServiceInstanceModel.retrieve_node_assignments(node_id)
+
+
+def _retrieve_assignments_changes(node_id: UUID4, revision: int, instance_ids: set[UUID4]) -> tuple[int, bool]:
+    """Last cluster revision and whether changes made after revision could touch assignments of node"""
+    last_revision, changed_ids = ChangeLogModel.retrieve_changes_since(revision)
+    if node_id in changed_ids[ChangedObjectType.NODE]:
+        return last_revision, True
+    changed_instance_ids = changed_ids[ChangedObjectType.SERVICE_INSTANCE]
+    if changed_instance_ids & instance_ids:  # Instance taken from node or changed on it
+        return last_revision, True
+    host_node_ids = ServiceInstanceModel.retrieve_host_node_ids(changed_instance_ids)
+    return last_revision, node_id in host_node_ids.values()  # Instance placed on node
+
+
+def _get_assignments_etag(instances: list[ServiceInstance]) -> str:
+    """ETag changes only when instances are placed on node or taken from it, or their allocations change"""
+    digest = hashlib.blake2b(digest_size=8)
+    for instance in sorted(instances, key=lambda obj: obj.id):
+        digest.update(f"{instance.id} {instance.executable} {instance.allocated_resources};".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+@router.get("/{node_id}/assignments/", response_model=NodeAssignmentsResponse)
+async def retrieve_node_assignments(
+    node_id: UUID4,
+    response: Response,
+    wait: Optional[timedelta] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Instances placed on node. If wait is given and assignments still match If-None-Match,
+    request waits (up to wait, capped by settings) until they change before it is answered with 304.
+    Assignments are re-read only when change log has changes of node or instances placed on it (or taken from it).
+    Wait without If-None-Match is rejected, as there is nothing to wait for a change of.
+    """
+    if wait is not None and if_none_match is None:
+        raise HTTPException(status_code=400, detail="Wait requires If-None-Match header")
+
+    read_only = settings.database_read_only_for_reads
+    revision, instances = await run_in_connection_scope(_retrieve_assignments, str(node_id), read_only=read_only)
+    etag = _get_assignments_etag(instances)
+
+    if wait is not None:
+        deadline = monotonic() + min(wait, settings.watch_max_wait).total_seconds()
+        while matches_etag(if_none_match, etag) and deadline > monotonic():
+            polled_revision = await revision_watcher.wait_for_change(
+                revision, timedelta(seconds=deadline - monotonic())
+            )
+            if polled_revision is None or polled_revision <= revision:
+                break
+            revision, is_changed = await run_in_connection_scope(
+                _retrieve_assignments_changes, node_id, revision, {instance.id for instance in instances},
+                read_only=read_only,
+            )
+            if not is_changed:
+                continue
+            revision, instances = await run_in_connection_scope(
+                _retrieve_assignments, str(node_id), read_only=read_only
+            )
+            etag = _get_assignments_etag(instances)
+
+    if matches_etag(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return NodeAssignmentsResponse(status="OK", revision=revision, data=instances)
 
 
 @router.delete("/{node_id}/", response_model=NodeResponse)
@@ -39,10 +130,18 @@ def delete_node(node_id: UUID4):
     node.node_resources = None
     node.available_resources = None
 
-    NodeModel.synchronize_schema(node)
+    with db.atomic():
+        NodeModel.synchronize_schema(node)
+        ChangeLogModel.record(ChangedObjectType.NODE, [node.id])
     return NodeResponse(status="OK", data=node)
 
 
 @router.get("/", response_model=NodeListResponse)
-def list_nodes():
-    return NodeListResponse(status="OK", data=NodeModel.retrieve_schemas())
+def list_nodes(status: Optional[NodeStatus] = None, page: PageParams = Depends()):
+    """Nodes, filtered and paginated if requested, otherwise all of them are served from read snapshot"""
+    if status is not None or page.is_set():
+        where_params = [NodeModel.status == status.value] if status is not None else []
+        return retrieve_page(NodeModel, Node, page, *where_params)
+
+    snapshot = read_snapshots.get()
+    return snapshot_response(data=snapshot.serialize_list(snapshot.nodes.values(), with_backrefs=False))
@@ -0,0 +1,54 @@
+from typing import Any, Optional
+
+from fastapi import HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import UUID4, BaseModel
+
+MAX_PAGE_SIZE = 1000
+
+
+class PageParams:
+    """
+    Keyset pagination and sparse fields of list endpoints.
+    Objects are ordered by id and page starts after object with given id, so pages are read by index range.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: Optional[UUID4] = None,
+        fields: Optional[list[str]] = Query(None),
+    ):
+        self.limit = limit
+        self.after = after
+        self.fields = fields
+
+    def is_set(self) -> bool:
+        return self.limit is not None or self.after is not None or self.fields is not None
+
+
+def retrieve_page(model: Any, schema_class: type[BaseModel], page: PageParams, *where_params) -> JSONResponse:
+    """
+    Page of schemas of model matching where_params with only requested fields.
+    Cursor of the next page (id to pass as after) is returned if there are more objects.
+    """
+    include = set(page.fields) if page.fields else None
+    unknown_fields = include - schema_class.__fields__.keys() if include else set()
+    if unknown_fields:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(sorted(unknown_fields))}")
+
+    limit = page.limit + 1 if page.limit is not None else None  # One more object shows whether next page exists
+    schemas = model.retrieve_schemas_page(*where_params, after=page.after, limit=limit)
+
+    next_after = None
+    if page.limit is not None and len(schemas) > page.limit:
+        schemas = schemas[:page.limit]
+        next_after = schemas[-1].id
+    return JSONResponse(
+        {
+            "status": "OK",
+            "data": [jsonable_encoder(obj, include=include) for obj in schemas],
+            "next_after": jsonable_encoder(next_after),
+        }
+    )
@@ -0,0 +1,48 @@
+import asyncio
+from functools import wraps
+from typing import Any, Callable, Optional, TypeVar
+
+from fastapi.routing import APIRoute
+
+from app.database import db
+from app.settings import settings
+
+T = TypeVar("T")
+
+
+def matches_etag(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether If-None-Match header lists etag, so client already has current representation"""
+    return if_none_match is not None and any(tag.strip() in ("*", etag) for tag in if_none_match.split(","))
+
+
+async def run_in_connection_scope(func: Callable[..., T], *args, read_only: bool = False) -> T:
+    """Run blocking database queries of async endpoint in thread with connection opened for them"""
+
+    def in_connection_scope() -> T:
+        with db.connection_scope(read_only=read_only):
+            return func(*args)
+
+    return await asyncio.to_thread(in_connection_scope)
+
+
+class ConnectionScopedRoute(APIRoute):
+    """
+    Route which endpoint is run with database connection opened for the request and closed after it.
+    Endpoint is run in a thread of threadpool, so connection is opened in the very same thread.
+    GET endpoints are served with read-only connection if enabled in settings.
+    Async endpoints are run in event loop as is, they run queries with run_in_connection_scope.
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            super().__init__(path, endpoint, **kwargs)
+            return
+
+        read_only = settings.database_read_only_for_reads and set(kwargs.get("methods") or ()) == {"GET"}
+
+        @wraps(endpoint)
+        def endpoint_in_connection_scope(*args, **kwargs):
+            with db.connection_scope(read_only=read_only):
+                return endpoint(*args, **kwargs)
+
+        super().__init__(path, endpoint_in_connection_scope, **kwargs)
@@ -1,12 +1,23 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import UUID4
 
+from app.api.dependencies import trigger_scheduling
+from app.api.pagination import PageParams, retrieve_page
+from app.api.routes import ConnectionScopedRoute
+from app.api.snapshots import read_snapshots, snapshot_response
+from app.database import db
+from app.models import ChangeLogModel
 from app.models.services import ServiceModel
+from app.schemas.changes import ChangedObjectType
 from app.schemas.requests import CreateServiceRequest, UpdateServiceRequest
 from app.schemas.responses import ServiceListResponse, ServiceResponse
-from app.schemas.services import Service, ServiceStatus
+from app.schemas.services import Service, ServiceStatus, ServiceType
 
-router = APIRouter(prefix="/api/services")
+router = APIRouter(
+    prefix="/api/services", route_class=ConnectionScopedRoute, dependencies=[Depends(trigger_scheduling)]
+)
 
 
 @router.post("/", response_model=ServiceResponse)
@@ -19,17 +30,19 @@ def create_service(request: CreateServiceRequest):
         resource_limit=request.resource_limit,
         resource_floor=request.resource_floor,
     )
-    ServiceModel.synchronize_schema(service)
+    with db.atomic():
+        ServiceModel.synchronize_schema(service)
+        ChangeLogModel.record(ChangedObjectType.SERVICE, [service.id])
     return ServiceResponse(status="OK", data=service)
 
 
-@router.get("/{service_id}/")
+@router.get("/{service_id}/", response_model=ServiceResponse)
 def retrieve_service(service_id: UUID4):
-    try:
-        node = ServiceModel.retrieve_schema(str(service_id))
-    except ValueError as exc:
-        raise HTTPException(status_code=404, detail=str(exc))
-    return ServiceResponse(status="OK", data=node)
+    snapshot = read_snapshots.get()
+    service = snapshot.services.get(service_id, None)
+    if service is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return snapshot_response(data=snapshot.serialize(service, with_backrefs=False))
 
 
 @router.patch("/{service_id}/", response_model=ServiceResponse)
@@ -51,7 +64,9 @@ def update_service(service_id: UUID4, request: UpdateServiceRequest):
     # TODO: Revalidate before making service active again
     service.status = ServiceStatus.ACTIVE
 
-    ServiceModel.synchronize_schema(service)
+    with db.atomic():
+        ServiceModel.synchronize_schema(service)
+        ChangeLogModel.record(ChangedObjectType.SERVICE, [service.id])
     return ServiceResponse(status="OK", data=service)
 
 
@@ -66,10 +81,35 @@ def delete_service(service_id: UUID4):
     service.resource_limit = None
     service.resource_floor = None
 
-    ServiceModel.synchronize_schema(service)
+    with db.atomic():
+        ServiceModel.synchronize_schema(service)
+        ChangeLogModel.record(ChangedObjectType.SERVICE, [service.id])
     return ServiceResponse(status="OK", data=service)
 
 
 @router.get("/", response_model=ServiceListResponse)
-def list_services():
-    return ServiceListResponse(status="OK", data=ServiceModel.retrieve_schemas())
+def list_services(
+    status: Optional[ServiceStatus] = None,
+    type: Optional[ServiceType] = None,
+    priority_from: Optional[int] = None,
+    priority_to: Optional[int] = None,
+    page: PageParams = Depends(),
+):
+    """
+    Services, filtered and paginated if requested, otherwise all of them are served from read snapshot.
+    Priority range includes both bounds.
+    """
+    where_params = []
+    if status is not None:
+        where_params.append(ServiceModel.status == status.value)
+    if type is not None:
+        where_params.append(ServiceModel.type == type.value)
+    if priority_from is not None:
+        where_params.append(ServiceModel.priority >= priority_from)
+    if priority_to is not None:
+        where_params.append(ServiceModel.priority <= priority_to)
+    if where_params or page.is_set():
+        return retrieve_page(ServiceModel, Service, page, *where_params)
+
+    snapshot = read_snapshots.get()
+    return snapshot_response(data=snapshot.serialize_list(snapshot.services.values(), with_backrefs=False))
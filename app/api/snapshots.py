@@ -0,0 +1,186 @@
+import threading
+from collections import defaultdict
+from typing import Iterable, Optional, Union
+
+from fastapi import Response
+from pydantic import UUID4
+
+from app.models import ChangeLogModel, NodeModel, ServiceInstanceModel, ServiceModel
+from app.schemas.changes import ChangedObjectType
+from app.schemas.nodes import Node
+from app.schemas.services import Service, ServiceInstance
+
+Schema = Union[Node, Service, ServiceInstance]
+
+# Fields of schemas set from other objects, they are not stored in rows of objects themselves
+backref_fields = {
+    Node: "instance_ids",
+    Service: "instance_id",
+}
+
+
+def _set_backrefs(
+    nodes: list[Node], services: list[Service], links: Iterable[tuple[Optional[UUID4], Optional[UUID4], UUID4]]
+):
+    """Set backrefs of nodes and services from (node id, service id, instance id) of instances linked to them"""
+    instance_ids_by_node_ids, instance_ids_by_service_ids = defaultdict(list), {}
+    for node_id, service_id, instance_id in links:
+        if node_id is not None:
+            instance_ids_by_node_ids[node_id].append(instance_id)
+        if service_id is not None:
+            instance_ids_by_service_ids[service_id] = instance_id
+
+    for node in nodes:
+        node.instance_ids = instance_ids_by_node_ids[node.id]
+    for service in services:
+        service.instance_id = instance_ids_by_service_ids.get(service.id, None)
+
+
+def retrieve_state() -> tuple[list[Node], list[Service], list[ServiceInstance]]:
+    """All nodes, services and instances with backrefs set, as in full cluster state"""
+    service_instances = ServiceInstanceModel.retrieve_schemas()
+    services = ServiceModel.retrieve_schemas()
+    nodes = NodeModel.retrieve_schemas()
+    _set_backrefs(nodes, services, ((obj.node_id, obj.service_id, obj.id) for obj in service_instances))
+    return nodes, services, service_instances
+
+
+def retrieve_changed_state(since: int) -> tuple[list[Node], list[Service], list[ServiceInstance]]:
+    """
+    Nodes, services and instances changed after revision since, with nodes and services of changed instances.
+    Backrefs of returned nodes and services are set from storage, as in full cluster state.
+    """
+    _, changed_ids = ChangeLogModel.retrieve_changes_since(since)
+
+    instance_ids = changed_ids[ChangedObjectType.SERVICE_INSTANCE]
+    service_instances = ServiceInstanceModel.retrieve_schemas(instance_ids) if instance_ids else []
+    service_ids = changed_ids[ChangedObjectType.SERVICE] | {obj.service_id for obj in service_instances}
+    node_ids = changed_ids[ChangedObjectType.NODE] | {obj.node_id for obj in service_instances}
+    service_ids.discard(None)
+    node_ids.discard(None)
+
+    services = ServiceModel.retrieve_schemas(service_ids) if service_ids else []
+    nodes = NodeModel.retrieve_schemas(node_ids) if node_ids else []
+    if services or nodes:
+        links = (
+            ServiceInstanceModel.select(
+                ServiceInstanceModel.host_node, ServiceInstanceModel.service, ServiceInstanceModel.id
+            )
+            .where(ServiceInstanceModel.service.in_(service_ids) | ServiceInstanceModel.host_node.in_(node_ids))
+            .tuples()
+        )
+        _set_backrefs(nodes, services, links)
+
+    return nodes, services, service_instances
+
+
+class ReadSnapshot:
+    """
+    Cluster state at revision served to GET endpoints together with JSON of its objects serialized on first use.
+    Published snapshot is never changed: changes produce a new snapshot which shares unchanged objects
+    (and their JSON) with the previous one.
+    """
+
+    def __init__(
+        self,
+        revision: int,
+        nodes: dict[UUID4, Node],
+        services: dict[UUID4, Service],
+        service_instances: dict[UUID4, ServiceInstance],
+        serialized: Optional[dict[tuple[UUID4, bool], bytes]] = None,
+    ):
+        self.revision = revision
+        self.nodes = nodes
+        self.services = services
+        self.service_instances = service_instances
+        # JSON of objects by (id, with backrefs), filled lazily. Concurrent requests may serialize object twice
+        self._serialized = serialized if serialized is not None else {}
+
+    @classmethod
+    def load(cls, revision: int) -> "ReadSnapshot":
+        nodes, services, service_instances = retrieve_state()
+        return cls(
+            revision,
+            {obj.id: obj for obj in nodes},
+            {obj.id: obj for obj in services},
+            {obj.id: obj for obj in service_instances},
+        )
+
+    def apply_changes(
+        self, revision: int, nodes: list[Node], services: list[Service], service_instances: list[ServiceInstance]
+    ) -> "ReadSnapshot":
+        """New snapshot with objects replaced by changed ones, which come with backrefs set"""
+        ids_to_nodes_mapping = dict(self.nodes)
+        changed_ids = {obj.id for obj in (*nodes, *services, *service_instances)}
+
+        # Instances moved from nodes which are not changed themselves are unlinked from them
+        for instance in service_instances:
+            previous = self.service_instances.get(instance.id, None)
+            node = ids_to_nodes_mapping.get(previous.node_id, None) if previous else None
+            if node is not None and node.id != instance.node_id and node.id not in changed_ids:
+                instance_ids = [obj for obj in node.instance_ids or () if obj != instance.id]
+                ids_to_nodes_mapping[node.id] = node.copy(update={"instance_ids": instance_ids})
+                changed_ids.add(node.id)
+
+        ids_to_nodes_mapping.update((obj.id, obj) for obj in nodes)
+        # Readers keep filling JSON of this snapshot, so it is copied at once before being filtered
+        serialized = {key: value for key, value in dict(self._serialized).items() if key[0] not in changed_ids}
+        return ReadSnapshot(
+            revision,
+            ids_to_nodes_mapping,
+            {**self.services, **{obj.id: obj for obj in services}},
+            {**self.service_instances, **{obj.id: obj for obj in service_instances}},
+            serialized,
+        )
+
+    def serialize(self, obj: Schema, with_backrefs: bool = True) -> bytes:
+        key = (obj.id, with_backrefs)
+        data = self._serialized.get(key, None)
+        if data is None:
+            backref_field = backref_fields.get(type(obj), None)
+            if not with_backrefs and backref_field is not None:
+                obj = obj.copy(update={backref_field: None})
+            data = self._serialized[key] = obj.json().encode()
+        return data
+
+    def serialize_list(self, objects: Iterable[Schema], with_backrefs: bool = True) -> bytes:
+        return b"[" + b",".join(self.serialize(obj, with_backrefs) for obj in objects) + b"]"
+
+
+class ReadSnapshotStore:
+    """
+    Keeps the latest read snapshot. Snapshot is checked against cluster revision (seq of last change in change log)
+    whenever it is requested, and changes are applied to it once revision moves, whatever process made them.
+    Readers get published snapshot without locks, only refresh is made by single thread at a time.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[ReadSnapshot] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> ReadSnapshot:
+        revision = ChangeLogModel.last_seq()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.revision >= revision:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                snapshot = ReadSnapshot.load(revision)
+            elif snapshot.revision < revision:
+                snapshot = snapshot.apply_changes(revision, *retrieve_changed_state(snapshot.revision))
+            self._snapshot = snapshot
+        return snapshot
+
+    def reset(self):
+        self._snapshot = None
+
+
+def snapshot_response(headers: Optional[dict[str, str]] = None, **fields: bytes) -> Response:
+    """Response with OK status and fields which are already serialized to JSON"""
+    body = b", ".join(f'"{name}": '.encode() + value for name, value in {"status": b'"OK"', **fields}.items())
+    return Response(b"{" + body + b"}", media_type="application/json", headers=headers)
+
+
+read_snapshots = ReadSnapshotStore()
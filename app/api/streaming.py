@@ -0,0 +1,39 @@
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+from fastapi.responses import StreamingResponse
+
+from app.api.routes import run_in_connection_scope
+from app.settings import settings
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Rows read from database per query while response is streamed
+STREAM_CHUNK_SIZE = 500
+
+
+def accepts_ndjson(accept: Optional[str]) -> bool:
+    return accept is not None and NDJSON_MEDIA_TYPE in accept
+
+
+async def stream_chunks(
+    retrieve_chunk: Callable[[Optional[int], int], tuple[Optional[int], list[bytes]]]
+) -> AsyncIterator[bytes]:
+    """
+    Lines of chunks read one at a time, each in its own connection scope, so no connection is held between them.
+    retrieve_chunk takes key of last row read before (None at start) and chunk size, and returns
+    key of last row of chunk with its lines. Stream ends with the first chunk smaller than chunk size.
+    """
+    key = None
+    while True:
+        key, lines = await run_in_connection_scope(
+            retrieve_chunk, key, STREAM_CHUNK_SIZE, read_only=settings.database_read_only_for_reads
+        )
+        for line in lines:
+            yield line + b"\n"
+        if len(lines) < STREAM_CHUNK_SIZE:
+            break
+
+
+def ndjson_response(lines: Iterable[bytes] | AsyncIterator[bytes], headers: Optional[dict[str, str]] = None):
+    """Response streamed with one JSON record per line (lines end with newline), each sent as soon as it is produced"""
+    return StreamingResponse(lines, media_type=NDJSON_MEDIA_TYPE, headers=headers)
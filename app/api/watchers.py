@@ -0,0 +1,63 @@
+import asyncio
+from datetime import timedelta
+from typing import Optional
+
+from app.api.routes import run_in_connection_scope
+from app.models import ChangeLogModel
+from app.settings import settings
+
+
+class RevisionWatcher:
+    """
+    Polls change log for cluster revision in background of event loop while there are requests waiting for it.
+    Waiting requests share single cheap query per poll interval instead of querying database each.
+    Polling starts with the first waiting request and stops with the last one.
+    """
+
+    def __init__(self, poll_interval: timedelta):
+        self.poll_interval = poll_interval
+        self.revision: Optional[int] = None
+
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._waiters = 0
+
+    async def wait_for_change(self, revision: int, timeout: timedelta) -> Optional[int]:
+        """Wait until cluster revision is newer than revision or timeout passes, returns last polled revision"""
+        if self._task is None:
+            self.revision = None  # Revision polled before could be outdated
+            self._changed = asyncio.Event()
+            self._task = asyncio.create_task(self._poll())
+
+        event_loop = asyncio.get_running_loop()
+        deadline = event_loop.time() + timeout.total_seconds()
+        self._waiters += 1
+        try:
+            while self.revision is None or self.revision <= revision:
+                remaining = deadline - event_loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            self._waiters -= 1
+            if not self._waiters:
+                self._task.cancel()
+                self._task = None
+        return self.revision
+
+    async def _poll(self):
+        while True:
+            revision = await run_in_connection_scope(
+                ChangeLogModel.last_seq, read_only=settings.database_read_only_for_reads
+            )
+            if revision != self.revision:
+                self.revision = revision
+                changed, self._changed = self._changed, asyncio.Event()
+                changed.set()
+            await asyncio.sleep(self.poll_interval.total_seconds())
+
+
+revision_watcher = RevisionWatcher(poll_interval=settings.watch_poll_interval)
@@ -1,7 +1,76 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
 from peewee import Model, SqliteDatabase, UUIDField
 
-db = SqliteDatabase("./sqlite.db")
-db.connect()
+from app.settings import settings
+
+# Pragmas which only set up database file, so they are not set on read-only connections
+database_file_pragmas = ("journal_mode",)
+
+
+class Database(SqliteDatabase):
+    """
+    SQLite database with a connection per thread (opened on first query if not opened explicitly).
+    Connection opened through connection_scope can be read-only, so reads never take write locks.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._read_only = threading.local()
+
+    def is_read_only(self) -> bool:
+        return getattr(self._read_only, "value", False)
+
+    @contextmanager
+    def connection_scope(self, read_only: bool = False) -> Iterator[None]:
+        """Connection of current thread opened for the scope and closed after it"""
+        if not self.is_closed():
+            self.close()
+        self._read_only.value = read_only
+        self.connect()
+        try:
+            yield
+        finally:
+            self.close()
+            self._read_only.value = False
+
+    def _connect(self):
+        if not self.is_read_only():
+            return super()._connect()
+
+        conn = sqlite3.connect(
+            f"file:{self.database}?mode=ro", uri=True, timeout=self._timeout, isolation_level=None,
+            **self.connect_params,
+        )
+        try:
+            self._add_conn_hooks(conn)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _set_pragmas(self, conn):
+        cursor = conn.cursor()
+        for pragma, value in self._pragmas:
+            if self.is_read_only() and pragma in database_file_pragmas:
+                continue
+            cursor.execute(f"PRAGMA {pragma} = {value};")
+        cursor.close()
+
+
+db = Database(
+    settings.database_path,
+    timeout=settings.database_busy_timeout.total_seconds(),
+    pragmas={
+        "journal_mode": settings.database_journal_mode,
+        "synchronous": settings.database_synchronous,
+        "cache_size": settings.database_cache_size,
+        "mmap_size": settings.database_mmap_size,
+    },
+)
 
 
 class BaseModel(Model):
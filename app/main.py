@@ -1,8 +1,33 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
 from app.api import events_router, monitoring_router, nodes_router, services_router
+from app.database import db
+from app.migrations import apply_migrations
+from app.scheduler.loop import scheduling_loop
+from app.scheduler.worker import WorkerSupervisor
+from app.settings import SchedulingMode, settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with db.connection_scope():
+        apply_migrations()
+
+    worker_supervisor = WorkerSupervisor(settings.scheduler_worker_check_interval)
+    if settings.scheduling_mode == SchedulingMode.IN_PROCESS:
+        await scheduling_loop.start()
+    elif settings.scheduling_mode == SchedulingMode.WORKER:
+        await worker_supervisor.start()
+
+    yield
+
+    await worker_supervisor.stop()
+    await scheduling_loop.stop()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(events_router)
 app.include_router(monitoring_router)
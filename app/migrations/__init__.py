@@ -0,0 +1,49 @@
+"""
+Schema migrations applied in order, each one once, names of applied ones are kept in MigrationModel.
+Initial migration creates tables with schema frozen at the time migrations were introduced (if they are missing),
+so migrations evolving schema further must be idempotent (check that column or index is missing before adding it).
+"""
+from typing import Callable
+
+from peewee import Database
+from playhouse.migrate import SqliteMigrator
+
+from app.database import db
+from app.models import MigrationModel
+
+from . import (
+    m0001_initial,
+    m0002_versions,
+    m0003_access_path_indexes,
+    m0004_change_sources,
+    m0005_assignments_index,
+    m0006_list_filter_indexes,
+)
+
+Migration = Callable[[SqliteMigrator], None]
+
+migrations: list[tuple[str, Migration]] = [
+    ("0001_initial", m0001_initial.migrate),
+    ("0002_versions", m0002_versions.migrate),
+    ("0003_access_path_indexes", m0003_access_path_indexes.migrate),
+    ("0004_change_sources", m0004_change_sources.migrate),
+    ("0005_assignments_index", m0005_assignments_index.migrate),
+    ("0006_list_filter_indexes", m0006_list_filter_indexes.migrate),
+]
+
+
+def apply_migrations(database: Database = db) -> list[str]:
+    """Apply migrations not applied yet, returns names of applied ones"""
+    applied_names = []
+    with database.bind_ctx([MigrationModel]), database.atomic(lock_type="IMMEDIATE"):
+        database.create_tables([MigrationModel], safe=True)
+        already_applied = {name for name, in MigrationModel.select(MigrationModel.name).tuples()}
+
+        migrator = SqliteMigrator(database)
+        for name, migrate in migrations:
+            if name in already_applied:
+                continue
+            migrate(migrator)
+            MigrationModel.create(name=name)
+            applied_names.append(name)
+    return applied_names
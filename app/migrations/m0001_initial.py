@@ -0,0 +1,31 @@
+from playhouse.migrate import SqliteMigrator
+
+# Schema as it was when migrations were introduced, kept as is so later changes of models don't change it.
+# Columns and indexes added since then are added by later migrations. Tables are created only if missing,
+# as databases created before migrations already have them.
+STATEMENTS = [
+    'CREATE TABLE IF NOT EXISTS "nodemodel" ('
+    '"id" TEXT NOT NULL PRIMARY KEY, "status" VARCHAR(20) NOT NULL, "cpu_cores" REAL, "ram" INTEGER, "disk" INTEGER)',
+    'CREATE TABLE IF NOT EXISTS "servicemodel" ('
+    '"id" TEXT NOT NULL PRIMARY KEY, "executable" TEXT NOT NULL, "status" VARCHAR(20) NOT NULL, '
+    '"type" VARCHAR(20) NOT NULL, "priority" INTEGER NOT NULL, '
+    '"cpu_cores_limit" REAL, "ram_limit" INTEGER, "disk_limit" INTEGER, '
+    '"cpu_cores_floor" REAL, "ram_floor" INTEGER, "disk_floor" INTEGER)',
+    'CREATE TABLE IF NOT EXISTS "serviceinstancemodel" ('
+    '"id" TEXT NOT NULL PRIMARY KEY, "executable" TEXT NOT NULL, "status" VARCHAR(20) NOT NULL, '
+    '"execution_status" VARCHAR(20), "resource_status" VARCHAR(20), "service_id" TEXT, "host_node_id" TEXT, '
+    '"cpu_cores" REAL, "ram" INTEGER, "disk" INTEGER, '
+    'FOREIGN KEY ("service_id") REFERENCES "servicemodel" ("id"), '
+    'FOREIGN KEY ("host_node_id") REFERENCES "nodemodel" ("id"))',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "serviceinstancemodel_service_id" ON "serviceinstancemodel" ("service_id")',
+    'CREATE INDEX IF NOT EXISTS "serviceinstancemodel_host_node_id" ON "serviceinstancemodel" ("host_node_id")',
+    'CREATE TABLE IF NOT EXISTS "schedulerlogmodel" ('
+    '"id" TEXT NOT NULL PRIMARY KEY, "metrics" TEXT NOT NULL, "timestamp" DATETIME NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS "changelogmodel" ('
+    '"seq" INTEGER NOT NULL PRIMARY KEY, "object_type" VARCHAR(20) NOT NULL, "object_id" TEXT NOT NULL)',
+]
+
+
+def migrate(migrator: SqliteMigrator):
+    for statement in STATEMENTS:
+        migrator.database.execute_sql(statement)
@@ -0,0 +1,20 @@
+from playhouse.migrate import SqliteMigrator, migrate as run_operations
+
+from app.models import NodeModel, SchedulerLogModel, ServiceInstanceModel, ServiceModel
+
+# Columns added to tables created before migrations were introduced
+ADDED_COLUMNS = [
+    (NodeModel, "version"),
+    (ServiceModel, "version"),
+    (ServiceInstanceModel, "version"),
+    (SchedulerLogModel, "change_seq"),
+]
+
+
+def migrate(migrator: SqliteMigrator):
+    operations = []
+    for model, column in ADDED_COLUMNS:
+        table = model._meta.table_name
+        if column not in {obj.name for obj in migrator.database.get_columns(table)}:
+            operations.append(migrator.add_column(table, column, model._meta.fields[column]))
+    run_operations(*operations)
@@ -0,0 +1,14 @@
+from playhouse.migrate import SqliteMigrator
+
+# Indexes of columns API and scheduler filter on, which are not covered by primary keys and foreign keys:
+# metrics are retrieved by timestamp range, scheduler checkpoint is MAX(change_seq) of its logs
+INDEXES = [
+    ("schedulerlogmodel_timestamp", "schedulerlogmodel", ("timestamp",)),
+    ("schedulerlogmodel_change_seq", "schedulerlogmodel", ("change_seq",)),
+]
+
+
+def migrate(migrator: SqliteMigrator):
+    for name, table, columns in INDEXES:
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        migrator.database.execute_sql(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_list})')
@@ -0,0 +1,11 @@
+from playhouse.migrate import SqliteMigrator, migrate as run_operations
+
+from app.models import ChangeLogModel
+
+
+def migrate(migrator: SqliteMigrator):
+    table = ChangeLogModel._meta.table_name
+    if "source" not in {obj.name for obj in migrator.database.get_columns(table)}:
+        run_operations(migrator.add_column(table, "source", ChangeLogModel.source))
+    # Scheduler and its worker look for changes made through API only
+    migrator.database.execute_sql(f'CREATE INDEX IF NOT EXISTS "{table}_source" ON "{table}" ("source")')
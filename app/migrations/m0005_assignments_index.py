@@ -0,0 +1,9 @@
+from playhouse.migrate import SqliteMigrator
+
+
+def migrate(migrator: SqliteMigrator):
+    # Node assignments are instances placed on node, the rest of node instances is never filtered by node
+    migrator.database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "serviceinstancemodel_placed_host_node_id" '
+        'ON "serviceinstancemodel" ("host_node_id") WHERE "status" = \'placed\''
+    )
@@ -0,0 +1,14 @@
+from playhouse.migrate import SqliteMigrator
+
+# Filtered lists are paginated by id, so filtered column goes first and pages are read as index ranges
+INDEXES = [
+    ("nodemodel_status_id", "nodemodel", ("status", "id")),
+    ("servicemodel_status_id", "servicemodel", ("status", "id")),
+    ("servicemodel_type_id", "servicemodel", ("type", "id")),
+]
+
+
+def migrate(migrator: SqliteMigrator):
+    for name, table, columns in INDEXES:
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        migrator.database.execute_sql(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_list})')
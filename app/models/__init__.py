@@ -1,3 +1,5 @@
+from .changes import ChangeLogModel
+from .migrations import MigrationModel
 from .monitoring import SchedulerLogModel
 from .nodes import NodeModel
 from .services import ServiceInstanceModel, ServiceModel
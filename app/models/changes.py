@@ -0,0 +1,55 @@
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from peewee import AutoField, CharField, Model, UUIDField, fn
+from pydantic import UUID4
+
+from app.database import db
+from app.schemas.changes import ChangedObjectType, ChangeSource
+
+
+class ChangeLogModel(Model):
+    """
+    Append-only log of changes made through API and committed by scheduler.
+    Entries are never deleted, so seq (rowid) grows monotonically and is used as cluster revision.
+    """
+
+    seq = AutoField()
+    object_type = CharField(max_length=20, choices=ChangedObjectType.choices())
+    object_id = UUIDField()
+    source = CharField(max_length=20, choices=ChangeSource.choices(), default=ChangeSource.API.value)
+
+    class Meta:
+        database = db
+
+    @classmethod
+    def record(
+        cls, object_type: ChangedObjectType, object_ids: Iterable[UUID4], source: ChangeSource = ChangeSource.API
+    ):
+        rows = [
+            {"object_type": object_type.value, "object_id": object_id, "source": source.value}
+            for object_id in object_ids
+        ]
+        if rows:
+            cls.insert_many(rows).execute()
+
+    @classmethod
+    def last_seq(cls, source: Optional[ChangeSource] = None) -> int:
+        query = cls.select(fn.MAX(cls.seq))
+        if source is not None:
+            query = query.where(cls.source == source.value)
+        return query.scalar() or 0
+
+    @classmethod
+    def retrieve_changes_since(
+        cls, seq: int, source: Optional[ChangeSource] = None
+    ) -> tuple[int, dict[ChangedObjectType, set[UUID4]]]:
+        """Retrieve ids of objects changed after seq (by source if given) grouped by type and seq of last change"""
+        query = cls.select(cls.seq, cls.object_type, cls.object_id).where(cls.seq > seq)
+        if source is not None:
+            query = query.where(cls.source == source.value)
+        query = query.order_by(cls.seq).tuples()
+        last_seq, changed_ids = seq, defaultdict(set)
+        for last_seq, object_type, object_id in query:
+            changed_ids[ChangedObjectType(object_type)].add(object_id)
+        return last_seq, changed_ids
@@ -0,0 +1,15 @@
+from datetime import datetime
+
+from peewee import CharField, DateTimeField, Model
+
+from app.database import db
+
+
+class MigrationModel(Model):
+    """Names of schema migrations applied to database"""
+
+    name = CharField(max_length=100, primary_key=True)
+    applied_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        database = db
@@ -1,9 +1,26 @@
-from typing import Iterable, Optional
+from collections import defaultdict
+from typing import Any, Iterable, Optional, TypeVar
 
-from funcy import first, lmap
+from funcy import chunks, first, lcat, lmap, project
 from peewee import FloatField, IntegerField, Model
 from pydantic import BaseModel
 
+from app.schemas.helpers import TrackedModel
+from app.settings import settings
+
+SchemaType = TypeVar("SchemaType", bound=BaseModel)
+
+
+def load_schema(schema_class: type[SchemaType], **values) -> SchemaType:
+    """
+    Build schema from values of row read from database.
+    Stored values were validated before they were written, so validation is skipped
+    unless settings.validate_loaded_schemas is set (values must already have schema types then).
+    """
+    if settings.validate_loaded_schemas:
+        return schema_class(**values)
+    return schema_class.construct(**values)
+
 
 class ResourceDataMixin(Model):
     cpu_cores = FloatField(null=True)
@@ -23,6 +40,14 @@ class SchemaRetrieversMixin:
             raise ValueError("Not found")
         return scheduler_log
 
+    @classmethod
+    def exists(cls, obj_id: str) -> bool:
+        """
+        Check whether object with id exists without retrieving it.
+        Class with this mixin must be a model to use this method.
+        """
+        return cls.select().where(cls.id == obj_id).exists()  # type: ignore
+
     @classmethod
     def retrieve_schemas(cls, obj_ids: Optional[Iterable[str]] = None) -> list[BaseModel]:
         """
@@ -35,13 +60,117 @@ class SchemaRetrieversMixin:
         return cls.retrieve_schemas_where()
 
     @classmethod
-    def retrieve_schemas_where(cls, *where_params) -> list[BaseModel]:
+    def retrieve_schemas_page(
+        cls, *where_params, after: Optional[str] = None, limit: Optional[int] = None
+    ) -> list[BaseModel]:
+        """
+        Retrieve schemas matching where_params ordered by id, up to limit ones with ids greater than after.
+        Class with this mixin must be a model to use this method.
+        """
+        if after is not None:
+            where_params = (*where_params, cls.id > after)  # type: ignore
+        return cls.retrieve_schemas_where(*where_params, order_by=cls.id, limit=limit)  # type: ignore
+
+    @classmethod
+    def retrieve_schemas_where(
+        cls, *where_params, order_by: Any = None, limit: Optional[int] = None
+    ) -> list[BaseModel]:
         """
         Retrieve schemas with any filtering.
-        Class with this mixin must be a model with a valid _schema method to use this method.
+        Rows are selected as named tuples, so no model instances are created.
+        Class with this mixin must be a model with a valid _to_schema method to use this method.
         """
         query = cls.select()  # type: ignore
         if where_params:
             query = query.where(*where_params)
-        models = list(query.execute())
-        return lmap(cls._to_schema, models)  # type: ignore
+        if order_by is not None:
+            query = query.order_by(order_by)
+        if limit is not None:
+            query = query.limit(limit)
+        rows = list(query.namedtuples())
+        schemas = lmap(cls._to_schema, rows)  # type: ignore
+        for row, schema in zip(rows, schemas):
+            if isinstance(schema, TrackedModel):
+                schema.reset_changes()  # Retrieved schemas match storage
+                schema._version = getattr(row, "version", 0)
+        return schemas
+
+
+class SchemaSynchronizersMixin:
+    schema_columns: dict[str, tuple[str, ...]] = {}
+    bulk_update_batch_size = 500
+
+    @classmethod
+    def _is_versioned(cls) -> bool:
+        return "version" in cls._meta.fields  # type: ignore
+
+    @classmethod
+    def _changed_columns(cls, schema: TrackedModel) -> tuple[str, ...]:
+        return tuple(sorted(set(lcat(cls.schema_columns.get(name, ()) for name in schema.changed_fields()))))
+
+    @classmethod
+    def synchronize_changes(cls, schemas: Iterable[TrackedModel]) -> int:
+        """
+        Persist only changed fields of already saved schemas and reset their changes.
+        Schemas with the same set of changed columns are written together with bulk (CASE) updates.
+        Versions of updated rows (and schemas) are increased.
+        Class with this mixin must be a model with valid schema_columns and _to_columns to use this method.
+        """
+        is_versioned = cls._is_versioned()
+        models_by_columns: dict[tuple[str, ...], list[Model]] = defaultdict(list)
+        for schema in schemas:
+            columns = cls._changed_columns(schema)
+            if columns:
+                values = project(cls._to_columns(schema), columns)  # type: ignore
+                if is_versioned:
+                    schema._version += 1
+                    values["version"] = schema._version
+                models_by_columns[columns].append(cls(id=schema.id, **values))  # type: ignore
+            schema.reset_changes()
+
+        updated = 0
+        for columns, models in models_by_columns.items():
+            fields = columns + ("version",) if is_versioned else columns
+            updated += cls.bulk_update(models, fields=fields, batch_size=cls.bulk_update_batch_size)  # type: ignore
+        return updated
+
+    @classmethod
+    def retrieve_updated_ids(cls, schemas: Iterable[TrackedModel]) -> set:
+        """
+        Ids of changed schemas whose rows were updated (have other version) since schemas were retrieved.
+        Class with this mixin must be a versioned model to use this method.
+        """
+        schemas = [schema for schema in schemas if cls._changed_columns(schema)]
+
+        stored_versions = {}
+        for chunk in chunks(cls.bulk_update_batch_size, [schema.id for schema in schemas]):
+            query = cls.select(cls.id, cls.version).where(cls.id.in_(chunk))  # type: ignore
+            stored_versions.update(query.tuples())
+        return {schema.id for schema in schemas if stored_versions.get(schema.id, None) != schema._version}
+
+    @classmethod
+    def insert_schemas(cls, schemas: Iterable[TrackedModel]):
+        """
+        Insert new schemas which already have ids and reset their changes.
+        Class with this mixin must be a model with valid _to_columns to use this method.
+        """
+        rows = []
+        for schema in schemas:
+            rows.append({"id": schema.id, **cls._to_columns(schema)})  # type: ignore
+            schema.reset_changes()
+            schema._version = 0
+        for chunk in chunks(cls.bulk_update_batch_size, rows):
+            cls.insert_many(chunk).execute()  # type: ignore
+
+    @classmethod
+    def update_columns_where(cls, obj_id: str, columns: dict[str, Any], *where_params) -> int:
+        """
+        Update only given columns of object with id if it matches where_params, without retrieving it.
+        If no columns are given only the match is checked. Number of updated rows is returned.
+        Class with this mixin must be a model to use this method.
+        """
+        if not columns:
+            columns = {"id": cls.id}  # type: ignore
+        elif cls._is_versioned():
+            columns = {**columns, "version": cls.version + 1}  # type: ignore
+        return cls.update(**columns).where(cls.id == obj_id, *where_params).execute()  # type: ignore
@@ -1,8 +1,9 @@
 import json
 from datetime import datetime
+from typing import Optional
 from uuid import uuid4
 
-from peewee import DateTimeField, TextField
+from peewee import SQL, DateTimeField, IntegerField, TextField, fn
 
 from app.database import BaseModel
 from app.schemas.monitoring import SchedulerLog, SchedulerMetrics
@@ -13,14 +14,37 @@ from .mixins import SchemaRetrieversMixin
 class SchedulerLogModel(SchemaRetrieversMixin, BaseModel):
     metrics = TextField(default="{}")
     timestamp = DateTimeField(default=datetime.now)
+    change_seq = IntegerField(default=0)  # Seq of last change from ChangeLogModel consumed by the run
 
     @classmethod
-    def persist_schema(cls, scheduler_log: SchedulerLog):
-        saved_model = cls.create(id=uuid4(), metrics=scheduler_log.metrics.json())
+    def persist_schema(cls, scheduler_log: SchedulerLog, change_seq: int = 0):
+        saved_model = cls.create(id=uuid4(), metrics=scheduler_log.metrics.json(), change_seq=change_seq)
 
         scheduler_log.id = saved_model.id
         scheduler_log.timestamp = saved_model.timestamp
 
+    @classmethod
+    def retrieve_json_chunk(cls, *where_params, after: Optional[int], limit: int) -> tuple[Optional[int], list[bytes]]:
+        """
+        Retrieve up to limit logs persisted after the one with rowid after, serialized to JSON in order of persisting.
+        Stored metrics are put into JSON as is, without parsing. Rowid of the last retrieved log is returned too.
+        """
+        rowid = SQL("rowid")
+        query = cls.select(rowid, cls.id, cls.metrics, cls.timestamp)
+        if after is not None:
+            where_params = (*where_params, rowid > after)
+        if where_params:
+            query = query.where(*where_params)
+
+        lines = []
+        for after, log_id, metrics, timestamp in query.order_by(rowid).limit(limit).tuples():
+            lines.append(f'{{"id": "{log_id}", "metrics": {metrics}, "timestamp": "{timestamp.isoformat()}"}}'.encode())
+        return after, lines
+
+    @classmethod
+    def last_change_seq(cls) -> int:
+        return cls.select(fn.MAX(cls.change_seq)).scalar() or 0
+
     @staticmethod
     def _to_schema(model: "SchedulerLogModel") -> SchedulerLog:
         schema = SchedulerLog(
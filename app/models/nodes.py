@@ -1,48 +1,58 @@
+from typing import NamedTuple
 from uuid import uuid4
 
-from peewee import BooleanField, CharField, FloatField, IntegerField
+from peewee import CharField, FloatField, IntegerField
 
 from app.database import BaseModel
 from app.schemas.helpers import ResourceData
 from app.schemas.nodes import Node, NodeStatus
 
-from .mixins import SchemaRetrieversMixin
+from .mixins import SchemaRetrieversMixin, SchemaSynchronizersMixin, load_schema
 
 
-class NodeModel(SchemaRetrieversMixin, BaseModel):
+class NodeModel(SchemaRetrieversMixin, SchemaSynchronizersMixin, BaseModel):
     status = CharField(max_length=20, choices=NodeStatus.choices())
 
     cpu_cores = FloatField(null=True)
     ram = IntegerField(null=True)
     disk = IntegerField(null=True)
 
-    was_updated = BooleanField(null=False, default=True)
+    version = IntegerField(default=0)  # Increased on every update, used to detect concurrent updates
+
+    schema_columns = {
+        "status": ("status",),
+        "node_resources": ("cpu_cores", "ram", "disk"),
+    }
 
     @classmethod
     def synchronize_schema(cls, node: Node):
-        query_kwargs = {
+        query_kwargs = cls._to_columns(node)
+        if node.id is None:
+            saved_model = cls.create(id=uuid4(), **query_kwargs)  # TODO: Move id generation to DB
+            node.id = saved_model.id
+        else:
+            cls.update(**query_kwargs, version=cls.version + 1).where(cls.id == node.id).execute()
+
+    @staticmethod
+    def _to_columns(node: Node) -> dict:
+        return {
             "status": node.status.value,
             "cpu_cores": node.node_resources.cpu_cores if node.node_resources else None,
             "ram": node.node_resources.ram if node.node_resources else None,
             "disk": node.node_resources.disk if node.node_resources else None,
-            "was_updated": True,
         }
-        if node.id is None:
-            saved_model = cls.create(id=uuid4(), **query_kwargs)  # TODO: Move id generation to DB
-            node.id = saved_model.id
-        else:
-            cls.update(**query_kwargs).where(cls.id == node.id).execute()
 
     @staticmethod
-    def _to_schema(model: "NodeModel") -> Node:
-        schema = Node(
-            id=model.id,
-            status=model.status,
-            node_resources=ResourceData(
-                cpu_cores=model.cpu_cores,
-                ram=model.ram,
-                disk=model.disk,
-            ),
+    def _to_schema(row: NamedTuple) -> Node:
+        status = NodeStatus(row.status)
+        if status == NodeStatus.DELETED:
+            node_resources = None
+        else:
+            node_resources = load_schema(ResourceData, cpu_cores=row.cpu_cores, ram=row.ram, disk=row.disk)
+        schema = load_schema(
+            Node,
+            id=row.id,
+            status=status,
+            node_resources=node_resources,
         )
-        schema._was_updated = model.was_updated
         return schema
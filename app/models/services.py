@@ -1,16 +1,27 @@
+from typing import Iterable, NamedTuple, Optional
 from uuid import uuid4
 
-from peewee import BooleanField, CharField, FloatField, ForeignKeyField, IntegerField, UUIDField
+from funcy import chunks
+from peewee import CharField, FloatField, ForeignKeyField, IntegerField, UUIDField
+from pydantic import UUID4
 
 from app.database import BaseModel
 from app.schemas.helpers import ResourceData
-from app.schemas.services import Service, ServiceInstance, ServiceInstanceStatus, ServiceStatus, ServiceType
-
-from .mixins import SchemaRetrieversMixin
+from app.schemas.services import (
+    ExecutionStatus,
+    ResourceStatus,
+    Service,
+    ServiceInstance,
+    ServiceInstanceStatus,
+    ServiceStatus,
+    ServiceType,
+)
+
+from .mixins import SchemaRetrieversMixin, SchemaSynchronizersMixin, load_schema
 from .nodes import NodeModel
 
 
-class ServiceModel(SchemaRetrieversMixin, BaseModel):
+class ServiceModel(SchemaRetrieversMixin, SchemaSynchronizersMixin, BaseModel):
     executable = UUIDField()
     status = CharField(max_length=20, choices=ServiceStatus.choices())
     type = CharField(max_length=20, choices=ServiceType.choices())
@@ -24,11 +35,29 @@ class ServiceModel(SchemaRetrieversMixin, BaseModel):
     ram_floor = IntegerField(null=True)
     disk_floor = IntegerField(null=True)
 
-    was_updated = BooleanField(null=False, default=True)
+    version = IntegerField(default=0)  # Increased on every update, used to detect concurrent updates
+
+    schema_columns = {
+        "executable": ("executable",),
+        "status": ("status",),
+        "type": ("type",),
+        "priority": ("priority",),
+        "resource_limit": ("cpu_cores_limit", "ram_limit", "disk_limit"),
+        "resource_floor": ("cpu_cores_floor", "ram_floor", "disk_floor"),
+    }
 
     @classmethod
     def synchronize_schema(cls, service: Service):
-        query_kwargs = {
+        query_kwargs = cls._to_columns(service)
+        if service.id is None:
+            saved_model = cls.create(id=uuid4(), **query_kwargs)  # TODO: Move id generation to DB
+            service.id = saved_model.id
+        else:
+            cls.update(**query_kwargs, version=cls.version + 1).where(cls.id == service.id).execute()
+
+    @staticmethod
+    def _to_columns(service: Service) -> dict:
+        return {
             "executable": service.executable,
             "status": service.status,
             "type": service.type,
@@ -41,40 +70,35 @@ class ServiceModel(SchemaRetrieversMixin, BaseModel):
             "cpu_cores_floor": service.resource_floor.cpu_cores if service.resource_floor else None,
             "ram_floor": service.resource_floor.ram if service.resource_floor else None,
             "disk_floor": service.resource_floor.disk if service.resource_floor else None,
-
-            "was_updated": True,
         }
-        if service.id is None:
-            saved_model = cls.create(id=uuid4(), **query_kwargs)  # TODO: Move id generation to DB
-            service.id = saved_model.id
-        else:
-            cls.update(**query_kwargs).where(cls.id == service.id).execute()
 
     @staticmethod
-    def _to_schema(model: "ServiceModel") -> Service:
-        schema = Service(
-            id=model.id,
-            executable=model.executable,
-            status=model.status,
-            type=model.type,
-            priority=model.priority,
-            resource_limit=ResourceData(
-                cpu_cores=model.cpu_cores_limit,
-                ram=model.ram_limit,
-                disk=model.disk_limit,
-            ),
-            resource_floor=ResourceData(
-                cpu_cores=model.cpu_cores_floor,
-                ram=model.ram_floor,
-                disk=model.disk_floor,
-            ),
+    def _to_schema(row: NamedTuple) -> Service:
+        status = ServiceStatus(row.status)
+        if status == ServiceStatus.DELETED:
+            resource_limit, resource_floor = None, None
+        else:
+            resource_limit = load_schema(
+                ResourceData, cpu_cores=row.cpu_cores_limit, ram=row.ram_limit, disk=row.disk_limit
+            )
+            resource_floor = load_schema(
+                ResourceData, cpu_cores=row.cpu_cores_floor, ram=row.ram_floor, disk=row.disk_floor
+            )
+        schema = load_schema(
+            Service,
+            id=row.id,
+            executable=row.executable,
+            status=status,
+            type=ServiceType(row.type),
+            priority=row.priority,
+            resource_limit=resource_limit,
+            resource_floor=resource_floor,
             instance_id=None,
         )
-        schema._was_updated = model.was_updated
         return schema
 
 
-class ServiceInstanceModel(SchemaRetrieversMixin, BaseModel):
+class ServiceInstanceModel(SchemaRetrieversMixin, SchemaSynchronizersMixin, BaseModel):
     executable = UUIDField()
     status = CharField(max_length=20, choices=ServiceInstanceStatus.choices())
     execution_status = CharField(max_length=20, choices=ServiceStatus.choices(), null=True)
@@ -87,18 +111,52 @@ class ServiceInstanceModel(SchemaRetrieversMixin, BaseModel):
     ram = IntegerField(null=True)
     disk = IntegerField(null=True)
 
-    was_updated = BooleanField(null=False, default=True)
+    version = IntegerField(default=0)  # Increased on every update, used to detect concurrent updates
+
+    schema_columns = {
+        "executable": ("executable",),
+        "status": ("status",),
+        "execution_status": ("execution_status",),
+        "resource_status": ("resource_status",),
+        "node_id": ("host_node",),
+        "service_id": ("service",),
+        "allocated_resources": ("cpu_cores", "ram", "disk"),
+    }
+
+    @classmethod
+    def retrieve_node_assignments(cls, node_id: str) -> list[ServiceInstance]:
+        """Retrieve instances placed on node"""
+        return cls.retrieve_schemas_where(  # type: ignore
+            cls.host_node == node_id, cls.status == ServiceInstanceStatus.PLACED.value
+        )
+
+    @classmethod
+    def retrieve_host_node_ids(cls, instance_ids: Iterable[UUID4]) -> dict[UUID4, Optional[UUID4]]:
+        """Ids of nodes instances are stored as placed on"""
+        host_node_ids = {}
+        for chunk in chunks(cls.bulk_update_batch_size, list(instance_ids)):
+            host_node_ids.update(cls.select(cls.id, cls.host_node).where(cls.id.in_(chunk)).tuples())
+        return host_node_ids
 
     @classmethod
     def synchronize_schema(cls, service_instance: ServiceInstance):
-        query_kwargs = {
+        query_kwargs = cls._to_columns(service_instance)
+        if service_instance.id is None:
+            saved_model = cls.create(id=uuid4(), **query_kwargs)  # TODO: Move id generation to DB
+            service_instance.id = saved_model.id
+        else:
+            cls.update(**query_kwargs, version=cls.version + 1).where(cls.id == service_instance.id).execute()
+
+    @staticmethod
+    def _to_columns(service_instance: ServiceInstance) -> dict:
+        return {
             "executable": service_instance.executable,
             "status": service_instance.status,
             "execution_status": service_instance.execution_status,
             "resource_status": service_instance.resource_status,
 
-            "host_node_id": service_instance.node_id,
-            "service_id": service_instance.service_id,
+            "host_node": service_instance.node_id,
+            "service": service_instance.service_id,
 
             "cpu_cores": (
                 service_instance.allocated_resources.cpu_cores
@@ -107,36 +165,25 @@ class ServiceInstanceModel(SchemaRetrieversMixin, BaseModel):
             ),
             "ram": service_instance.allocated_resources.ram if service_instance.allocated_resources else None,
             "disk": service_instance.allocated_resources.disk if service_instance.allocated_resources else None,
-
-            "was_updated": True,
         }
-        if service_instance.id is None:
-            saved_model = cls.create(id=uuid4(), **query_kwargs)  # TODO: Move id generation to DB
-            service_instance.id = saved_model.id
-        else:
-            cls.update(**query_kwargs).where(cls.id == service_instance.id).execute()
 
     @staticmethod
-    def _to_schema(model: "ServiceInstanceModel") -> ServiceInstance:
-        if all((model.cpu_cores is None, model.ram is None, model.disk is None)):
+    def _to_schema(row: NamedTuple) -> ServiceInstance:
+        if all((row.cpu_cores is None, row.ram is None, row.disk is None)):
             allocated_resources = None
         else:
-            allocated_resources = ResourceData(
-                cpu_cores=model.cpu_cores,
-                ram=model.ram,
-                disk=model.disk,
-            )
-        schema = ServiceInstance(
-            id=model.id,
-            executable=model.executable,
-            status=model.status,
-            execution_status=model.execution_status,
-            resource_status=model.resource_status,
+            allocated_resources = load_schema(ResourceData, cpu_cores=row.cpu_cores, ram=row.ram, disk=row.disk)
+        schema = load_schema(
+            ServiceInstance,
+            id=row.id,
+            executable=row.executable,
+            status=ServiceInstanceStatus(row.status),
+            execution_status=row.execution_status and ExecutionStatus(row.execution_status),
+            resource_status=row.resource_status and ResourceStatus(row.resource_status),
 
             allocated_resources=allocated_resources,
 
-            node_id=model.host_node,
-            service_id=model.service_id,
+            node_id=row.host_node,
+            service_id=row.service,
         )
-        schema._was_updated = model.was_updated
         return schema
@@ -1,12 +1,15 @@
 from contextlib import contextmanager
 from datetime import timedelta
 from time import perf_counter
+from typing import Optional
 
 from app.database import db
 from app.models import SchedulerLogModel
 from app.schemas.monitoring import SchedulerLog
+from app.settings import settings
 
 from .cluster import ClusterState
+from .optimizer import PlacementOptimizer
 from .steps import NodeUpdatesResolver, ServiceInstanceUpdatesResolver, ServiceUpdatesResolver
 
 
@@ -17,20 +20,48 @@ def catch_time() -> float:
 
 
 class Scheduler:
+    _state: Optional[ClusterState] = None
+
+    @classmethod
+    def get_state(cls) -> ClusterState:
+        """
+        Get cluster state resident in this process.
+        It is fully loaded on first use, afterwards only rows changed since previous run are applied.
+        """
+        if cls._state is None:
+            cls._state = ClusterState()
+        else:
+            cls._state.refresh()
+        return cls._state
+
+    @classmethod
+    def reset_state(cls):
+        """Drop resident cluster state, so it will be fully loaded on next run"""
+        cls._state = None
+
     @classmethod
     def run_scheduling(cls):
-        with db.atomic():
-            state = ClusterState()
+        try:
+            # State is loaded and resolved without transaction, so API writes don't wait for scheduling
+            state = cls.get_state()
 
             # Catch time without DB queries
             with catch_time() as get_seconds:
                 state = NodeUpdatesResolver.run(state)
                 state = ServiceUpdatesResolver.run(state)
                 state = ServiceInstanceUpdatesResolver.run(state)
+                if settings.optimizer_time_budget:
+                    state = PlacementOptimizer.run(state, settings.optimizer_time_budget)
             seconds = get_seconds()
 
-            state.commit()
+            # Objects changed concurrently are not overwritten, write lock is held only while committing
+            with db.atomic(lock_type="IMMEDIATE"):
+                state.commit()
+        except Exception:
+            # Resident state no longer matches storage
+            cls.reset_state()
+            raise
 
         state.finalize_metrics()
         state.metrics.duration = timedelta(seconds=seconds)
-        SchedulerLogModel.persist_schema(SchedulerLog(metrics=state.metrics))
+        SchedulerLogModel.persist_schema(SchedulerLog(metrics=state.metrics), change_seq=state.checkpoint)
@@ -0,0 +1,131 @@
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import Callable, Optional
+
+import numpy as np
+from pydantic import UUID4
+
+from .resources import ResourceVector
+
+
+class CapacityMatrix:
+    """
+    Free resources of nodes kept as (nodes x resource types) matrix.
+    Each node keeps its row once added, rows of nodes which can't be used for placement are disabled.
+    """
+
+    initial_capacity = 64
+
+    def __init__(self):
+        self.node_ids: list[UUID4] = []
+        self.rows: dict[UUID4, int] = {}
+
+        self._free = np.zeros((self.initial_capacity, 3), dtype=np.int64)
+        self._enabled = np.zeros(self.initial_capacity, dtype=bool)
+
+    @staticmethod
+    def _to_row(resources: ResourceVector) -> tuple[int, int, int]:
+        return resources.cpu, resources.ram, resources.disk
+
+    def _get_or_add_row(self, node_id: UUID4) -> int:
+        row = self.rows.get(node_id, None)
+        if row is not None:
+            return row
+
+        row = len(self.node_ids)
+        if row == len(self._enabled):  # Grow storage twice
+            self._free = np.concatenate((self._free, np.zeros_like(self._free)))
+            self._enabled = np.concatenate((self._enabled, np.zeros_like(self._enabled)))
+        self.node_ids.append(node_id)
+        self.rows[node_id] = row
+        return row
+
+    def set(self, node_id: UUID4, free: ResourceVector, enabled: bool = True):
+        row = self._get_or_add_row(node_id)
+        self._free[row] = self._to_row(free)
+        self._enabled[row] = enabled
+
+    def disable(self, node_id: UUID4):
+        row = self.rows.get(node_id, None)
+        if row is not None:
+            self._enabled[row] = False
+
+    def add(self, node_id: UUID4, resources: ResourceVector):
+        row = self.rows.get(node_id, None)
+        if row is not None:
+            self._free[row] += self._to_row(resources)
+
+    def subtract(self, node_id: UUID4, resources: ResourceVector):
+        row = self.rows.get(node_id, None)
+        if row is not None:
+            self._free[row] -= self._to_row(resources)
+
+    def fitting_nodes_ids(self, required: ResourceVector) -> list[UUID4]:
+        """Ids of enabled nodes with enough free resources, in order nodes were added"""
+        size = len(self.node_ids)
+        mask = self._enabled[:size] & np.all(self._free[:size] >= self._to_row(required), axis=1)
+        return [self.node_ids[row] for row in np.flatnonzero(mask)]
+
+
+class BestFitIndex:
+    """
+    Free resources of nodes kept sorted separately for each resource type.
+    Tightest fitting node is searched by binary search in the resource type fewest nodes have enough of,
+    so only nodes which already have enough of the scarcest resource are checked for the others.
+    Sorted values are kept in plain lists: insort and del are O(n) moves of pointers, which stay cheap
+    for thousands of nodes. Scan is bounded, if other resources are short on many candidates,
+    fitting nodes are filtered at once (by CapacityMatrix) instead.
+    """
+
+    max_checked_nodes = 32
+
+    def __init__(self):
+        self.free: dict[UUID4, tuple[int, int, int]] = {}
+        self._sorted: tuple[list, list, list] = ([], [], [])
+
+    def set(self, node_id: UUID4, free: ResourceVector):
+        self.remove(node_id)
+        values = free.cpu, free.ram, free.disk
+        self.free[node_id] = values
+        for value, sorted_values in zip(values, self._sorted):
+            insort(sorted_values, (value, node_id))
+
+    def update(self, node_id: UUID4, free: ResourceVector):
+        """Update free resources of node if it is indexed"""
+        if node_id in self.free:
+            self.set(node_id, free)
+
+    def remove(self, node_id: UUID4):
+        values = self.free.pop(node_id, None)
+        if values is None:
+            return
+        for value, sorted_values in zip(values, self._sorted):
+            del sorted_values[bisect_left(sorted_values, (value, node_id))]
+
+    def best_fit(
+        self, required: ResourceVector, fitting_nodes_ids: Optional[Callable[[ResourceVector], list[UUID4]]] = None
+    ) -> Optional[UUID4]:
+        """
+        Id of node with the least free resources of the scarcest resource type among fitting nodes.
+        If fitting_nodes_ids is given, at most max_checked_nodes are scanned before falling back to it.
+        """
+        required_values = required.cpu, required.ram, required.disk
+        positions = [
+            bisect_left(sorted_values, (value,)) for value, sorted_values in zip(required_values, self._sorted)
+        ]
+        scarcest = max(range(len(positions)), key=positions.__getitem__)
+        sorted_values, start = self._sorted[scarcest], positions[scarcest]
+        stop = start + self.max_checked_nodes if fitting_nodes_ids is not None else len(sorted_values)
+
+        for _, node_id in islice(sorted_values, start, stop):
+            if all(free >= value for free, value in zip(self.free[node_id], required_values)):
+                return node_id
+        if stop >= len(sorted_values):
+            return None
+
+        # Same order as scan, by free resources of the scarcest type and id
+        return min(
+            (node_id for node_id in fitting_nodes_ids(required) if node_id in self.free),
+            key=lambda node_id: (self.free[node_id][scarcest], node_id),
+            default=None,
+        )
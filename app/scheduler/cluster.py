@@ -1,89 +1,358 @@
-from copy import deepcopy
 from functools import partial
 from typing import Iterable, Optional
 
-from funcy import lfilter, lpluck_attr, pluck_attr, project
+from funcy import lfilter, lmap, pluck_attr, project
 from pydantic import UUID4
 
-from app.models import NodeModel, ServiceInstanceModel, ServiceModel
-from app.schemas.helpers import ResourceData
+from app.models import ChangeLogModel, NodeModel, SchedulerLogModel, ServiceInstanceModel, ServiceModel
+from app.schemas.changes import ChangedObjectType, ChangeSource
+from app.schemas.helpers import TrackedModel
 from app.schemas.monitoring import SchedulerMetrics, TrackedAction, TrackedObjects
 from app.schemas.nodes import Node, NodeStatus
-from app.schemas.services import ExecutionStatus, ResourceStatus, Service, ServiceInstance, ServiceInstanceStatus, ServiceType
-from app.utils.exceptions import EvictionError, SchedulingError
+from app.schemas.services import ExecutionStatus, ResourceStatus, Service, ServiceInstance, ServiceInstanceStatus, ServiceStatus, ServiceType
+from app.utils.exceptions import SchedulingError
 
-from .selectors import SelectorType
+from .capacity import BestFitIndex, CapacityMatrix
+from .eviction import EvictionCandidates, eviction_cost
+from .resources import ResourceVector
+from .selectors import SelectorType, effective_priority, effective_priority_thresholds
 
 
 class ClusterState:
-    def __init__(self):
-        self.nodes: list[Node] = []
-        self.services: list[Service] = []
-        self.service_instances: list[ServiceInstance] = []
+    # Models objects of each type are stored with
+    models = {
+        ChangedObjectType.NODE: NodeModel,
+        ChangedObjectType.SERVICE: ServiceModel,
+        ChangedObjectType.SERVICE_INSTANCE: ServiceInstanceModel,
+    }
 
+    def __init__(self):
         self.ids_to_nodes_mapping: dict[UUID4, Node] = {}
         self.ids_to_services_mapping: dict[UUID4, Service] = {}
         self.ids_to_service_instances_mapping: dict[UUID4, ServiceInstance] = {}
 
+        # Ids of objects which are to be resolved by scheduler. Unresolved ids are kept for next run
+        self.updated_nodes_ids: set[UUID4] = set()
+        self.updated_services_ids: set[UUID4] = set()
+        self.updated_service_instances_ids: set[UUID4] = set()
+
+        # Seq of last consumed change from ChangeLogModel
+        self.checkpoint: int = 0
+
+        # Resources of nodes and instances in internal representation
+        self.nodes_resources: dict[UUID4, ResourceVector] = {}
+        self.available_resources: dict[UUID4, ResourceVector] = {}  # Only nodes with known available resources
+        self.allocated_resources: dict[UUID4, ResourceVector] = {}
+        # Available resources of nodes mirrored into matrix for vectorized placement queries
+        self.capacity = CapacityMatrix()
+        # Available resources of active nodes indexed for best fit placement
+        self.best_fit_index = BestFitIndex()
+        # Instances of nodes ordered for eviction, built on first use
+        self.eviction_candidates: dict[UUID4, EvictionCandidates] = {}
+        # Version of capacity, increased whenever placement may become possible for requests which failed before
+        self.capacity_version: int = 0
+        # Requests (resources, effective priority) which could not be placed at capacity version
+        self.unplaceable_requests: set[tuple[int, int, int, int, int]] = set()
+        # Available resources of active nodes before they were invalidated, to tell if they were freed since
+        self._previous_available_resources: dict[UUID4, ResourceVector] = {}
+
         self.metrics = SchedulerMetrics()
 
+        # Objects with fields changed since last commit
+        self._changed_objects: list[TrackedModel] = []
+        # Instances created since last commit, they are inserted on commit
+        self._new_service_instances: list[ServiceInstance] = []
+
         self._load_state()
 
+    @property
+    def nodes(self) -> list[Node]:
+        return list(self.ids_to_nodes_mapping.values())
+
+    @property
+    def services(self) -> list[Service]:
+        return list(self.ids_to_services_mapping.values())
+
+    @property
+    def service_instances(self) -> list[ServiceInstance]:
+        return list(self.ids_to_service_instances_mapping.values())
+
     def _load_state(self):
-        """Load state from persistent storage. Order is important"""
-        self._load_service_instances()
-        self._load_services()
-        self._load_nodes()
-
-    def _load_service_instances(self):
-        """Load service instances, created ids to objects mapping"""
-        self.service_instances: list[ServiceInstance] = ServiceInstanceModel.retrieve_schemas()
-        self.ids_to_service_instances_mapping: dict[UUID4, ServiceInstance] = {
-            obj.id: obj for obj in self.service_instances
-        }
+        """
+        Load state from persistent storage. Order is important.
+        Changes after checkpoint of the last scheduler run and not placed instances are to be resolved.
+        """
+        self.checkpoint = SchedulerLogModel.last_change_seq()
 
-    def _load_services(self):
-        """Load services, created ids to objects mapping, set backrefs"""
-        self.services: list[Service] = ServiceModel.retrieve_schemas()
-        self.ids_to_services_mapping: dict[UUID4, Service] = {obj.id: obj for obj in self.services}
+        instances = self._apply_service_instances(ServiceInstanceModel.retrieve_schemas())
+        self._apply_services(ServiceModel.retrieve_schemas())
+        self._apply_nodes(NodeModel.retrieve_schemas())
+        self._link_service_instances(instances)
+        self._forget_changes()
 
-        # Setting backrefs: for each service set instance_id to its instance
-        for instance in self.service_instances:
+        self.updated_service_instances_ids |= {
+            instance.id for instance in instances if instance.status == ServiceInstanceStatus.EVICTED
+        }
+        # Instances of reactivated services whose reactivation was consumed before instances were restored
+        self.updated_services_ids |= {
+            service.id
+            for service in self.services
+            if service.status == ServiceStatus.ACTIVE
+            and service.instance_id is not None
+            and self.ids_to_service_instances_mapping[service.instance_id].status == ServiceInstanceStatus.DELETED
+        }
+        self._consume_changes(reload=False)
+
+    def refresh(self):
+        """
+        Apply changes made since previous run on top of already loaded state. Order is important.
+        Unchanged objects (and available resources of untouched nodes) are kept as is.
+        """
+        self.metrics = SchedulerMetrics()
+        self._consume_changes(reload=True)
+
+    def _consume_changes(self, reload: bool):
+        """Mark objects changed through API after checkpoint as updated, reloading them from storage if requested"""
+        self.checkpoint, changed_ids = ChangeLogModel.retrieve_changes_since(self.checkpoint, ChangeSource.API)
+        instance_ids = changed_ids[ChangedObjectType.SERVICE_INSTANCE]
+        service_ids = changed_ids[ChangedObjectType.SERVICE]
+        node_ids = changed_ids[ChangedObjectType.NODE]
+
+        if reload:
+            instances = self._apply_service_instances(
+                ServiceInstanceModel.retrieve_schemas(instance_ids) if instance_ids else []
+            )
+            self._apply_services(ServiceModel.retrieve_schemas(service_ids) if service_ids else [])
+            self._apply_nodes(NodeModel.retrieve_schemas(node_ids) if node_ids else [])
+            self._link_service_instances(instances)
+            self._forget_changes()
+
+        self.updated_service_instances_ids |= instance_ids & self.ids_to_service_instances_mapping.keys()
+        self.updated_services_ids |= service_ids & self.ids_to_services_mapping.keys()
+        self.updated_nodes_ids |= node_ids & self.ids_to_nodes_mapping.keys()
+
+    def _apply_service_instances(self, instances: list[ServiceInstance]) -> list[ServiceInstance]:
+        """Add or replace service instances, unlink replaced ones from their previous nodes"""
+        for instance in instances:
+            previous = self.ids_to_service_instances_mapping.get(instance.id, None)
+            if previous and previous.node_id != instance.node_id:
+                node = self.ids_to_nodes_mapping.get(previous.node_id, None)
+                if node:
+                    node.instance_ids = [_id for _id in node.instance_ids if _id != instance.id]
+                    self._invalidate_available_resources(node.id)
+            elif previous and previous.allocated_resources != instance.allocated_resources:
+                if previous.node_id in self.ids_to_nodes_mapping:
+                    self._invalidate_available_resources(previous.node_id)
+            self._track(instance)
+            self.ids_to_service_instances_mapping[instance.id] = instance
+            self.allocated_resources[instance.id] = ResourceVector.from_data(instance.allocated_resources)
+        return instances
+
+    def _apply_services(self, services: list[Service]):
+        """Add or replace services, keeping backrefs of replaced ones"""
+        for service in services:
+            previous = self.ids_to_services_mapping.get(service.id, None)
+            if previous:
+                service.instance_id = previous.instance_id
+                instance = self.ids_to_service_instances_mapping.get(previous.instance_id, None)
+                is_reordered = (previous.priority, previous.type) != (service.priority, service.type)
+                if instance and instance.node_id and is_reordered:  # Eviction order of instance changed
+                    self.eviction_candidates.pop(instance.node_id, None)
+                    self._increase_capacity_version()
+            self._track(service)
+            self.ids_to_services_mapping[service.id] = service
+
+    def _apply_nodes(self, nodes: list[Node]):
+        """Add or replace nodes, keeping backrefs of replaced ones. Available resources are recalculated"""
+        for node in nodes:
+            previous = self.ids_to_nodes_mapping.get(node.id, None)
+            node.instance_ids = list(previous.instance_ids) if previous else []
+            self._track(node)
+            self.ids_to_nodes_mapping[node.id] = node
+            self.nodes_resources[node.id] = ResourceVector.from_data(node.node_resources)
+            self._invalidate_available_resources(node.id)
+
+    def _link_service_instances(self, instances: list[ServiceInstance]):
+        """Setting backrefs: for each instance set service instance_id and add it to node instance_ids"""
+        for instance in instances:
             service = self.ids_to_services_mapping.get(instance.service_id, None)
             if service:
                 service.instance_id = instance.id
 
-    def _load_nodes(self):
-        """Load services, created ids to objects mapping, set backref_ids"""
-        self.nodes: list[Node] = NodeModel.retrieve_schemas()
-        self.ids_to_nodes_mapping: dict[UUID4, Node] = {obj.id: obj for obj in self.nodes}
-
-        # For each node set instance_ids to empty list
-        for node in self.nodes:
-            node.instance_ids = []
-
-        # Setting backrefs: for each node set instance_ids to its instances
-        for instance in self.service_instances:
             node = self.ids_to_nodes_mapping.get(instance.node_id, None)
-            if node:
+            if node and instance.id not in node.instance_ids:  # Instance is placed on node since it was loaded
                 node.instance_ids.append(instance.id)
+                self._invalidate_available_resources(node.id)
+
+    def _invalidate_available_resources(self, node_id: UUID4):
+        """Available resources will be recalculated before next placement"""
+        previous = self.available_resources.pop(node_id, None)
+        if previous is not None and node_id in self.best_fit_index.free:
+            self._previous_available_resources[node_id] = previous
+        self.capacity.disable(node_id)
+        self.best_fit_index.remove(node_id)
+        self.eviction_candidates.pop(node_id, None)
+
+    def _acquire_resources(self, node_id: UUID4, resources: ResourceVector):
+        self.available_resources[node_id] -= resources
+        self.capacity.subtract(node_id, resources)
+        self.best_fit_index.update(node_id, self.available_resources[node_id])
+
+    def _release_resources(self, node_id: UUID4, resources: ResourceVector):
+        if node_id in self.available_resources:
+            self.available_resources[node_id] += resources
+            self.capacity.add(node_id, resources)
+            self.best_fit_index.update(node_id, self.available_resources[node_id])
+            self._increase_capacity_version()
+
+    def _increase_capacity_version(self):
+        """Requests which failed at previous versions may be placed now"""
+        self.capacity_version += 1
+        self.unplaceable_requests.clear()
+
+    def _get_request_key(self, required_resources: ResourceVector, service: Service) -> tuple[int, int, int, int, int]:
+        return (
+            required_resources.cpu,
+            required_resources.ram,
+            required_resources.disk,
+            effective_priority(service),
+            self.capacity_version,
+        )
+
+    def is_known_unplaceable(self, required_resources: ResourceVector, service: Service) -> bool:
+        """Whether the same request already failed at current capacity version"""
+        return self._get_request_key(required_resources, service) in self.unplaceable_requests
+
+    def remember_unplaceable(self, required_resources: ResourceVector, service: Service):
+        self.unplaceable_requests.add(self._get_request_key(required_resources, service))
+
+    def _track(self, obj: TrackedModel):
+        """Register obj in changed objects on its first change"""
+        obj.reset_changes()
+        obj._on_change = self._changed_objects.append
+
+    def _forget_changes(self):
+        """Changes made while loading state are already persisted"""
+        for obj in self._changed_objects:
+            obj.reset_changes()
+        self._changed_objects.clear()
+
+    def add_service_instance(self, instance: ServiceInstance):
+        """Add instance created by scheduler, it is inserted on commit"""
+        self._track(instance)
+        self._new_service_instances.append(instance)
+        self.ids_to_service_instances_mapping[instance.id] = instance
+        self.allocated_resources[instance.id] = ResourceVector.from_data(instance.allocated_resources)
 
     def commit(self):
-        self.commit_nodes()
-        self.commit_services()
-        self.commit_instances()
+        """
+        Persist new instances and changed fields of changed objects only, and record them in change log.
+        Changes of objects updated concurrently since they were loaded are not written, see _requeue_conflicting.
+        Must be called in transaction holding write lock.
+        """
+        changed_objects = self._get_changed_objects()
+        conflicting_ids = {
+            object_type: self.models[object_type].retrieve_updated_ids(objects)
+            for object_type, objects in changed_objects.items()
+        }
+        if any(conflicting_ids.values()):
+            self._requeue_conflicting(conflicting_ids)
+            changed_objects = self._get_changed_objects()
+
+        new_instances_ids = {instance.id for instance in self._new_service_instances}
+        written_ids = {
+            object_type: {obj.id for obj in objects if self.models[object_type]._changed_columns(obj)}
+            for object_type, objects in changed_objects.items()
+        }
+        ServiceInstanceModel.insert_schemas(self._new_service_instances)
+        for object_type, objects in changed_objects.items():
+            self.models[object_type].synchronize_changes(objects)
+        self._new_service_instances.clear()
+        self._changed_objects.clear()
+
+        ChangeLogModel.record(ChangedObjectType.SERVICE_INSTANCE, new_instances_ids, ChangeSource.SCHEDULER)
+        for object_type, object_ids in written_ids.items():
+            ChangeLogModel.record(object_type, object_ids, ChangeSource.SCHEDULER)
+
+    def _get_changed_objects(self) -> dict[ChangedObjectType, list[TrackedModel]]:
+        """Changed objects which are already stored, by type"""
+        new_instances_ids = {instance.id for instance in self._new_service_instances}
+        return {
+            object_type: [
+                obj for obj in self._changed_objects if isinstance(obj, schema) and obj.id not in new_instances_ids
+            ]
+            for object_type, schema in (
+                (ChangedObjectType.NODE, Node),
+                (ChangedObjectType.SERVICE, Service),
+                (ChangedObjectType.SERVICE_INSTANCE, ServiceInstance),
+            )
+        }
 
-    def commit_nodes(self):
-        for node in self.nodes:
-            NodeModel.synchronize_schema(node)
+    def _requeue_conflicting(self, conflicting_ids: dict[ChangedObjectType, set[UUID4]]):
+        """
+        Drop changes of conflicting objects and changes depending on them, reload such objects to resolve them again.
+        Changes on the same node depend on each other (placement relies on evictions made for it),
+        so every change of instance placed on or removed from node touched by conflicting change is dropped too.
+        Other changes are kept, so they are committed and resident state is not reloaded.
+        """
+        self.metrics.increase_counter(TrackedObjects.CONFLICTING, sum(map(len, conflicting_ids.values())))
+
+        instances = [obj for obj in self._changed_objects if isinstance(obj, ServiceInstance)]
+        stored_node_ids = ServiceInstanceModel.retrieve_host_node_ids(obj.id for obj in instances)
+        touched_node_ids = {
+            instance.id: {stored_node_ids.get(instance.id, None), instance.node_id} - {None} for instance in instances
+        }
 
-    def commit_services(self):
-        for service in self.services:
-            ServiceModel.synchronize_schema(service)
+        dropped_ids = set(conflicting_ids[ChangedObjectType.SERVICE_INSTANCE])
+        dropped_node_ids = set(conflicting_ids[ChangedObjectType.NODE])
+        while True:
+            for instance_id in dropped_ids:
+                dropped_node_ids |= touched_node_ids[instance_id]
+            depending_ids = {
+                instance_id for instance_id, node_ids in touched_node_ids.items() if node_ids & dropped_node_ids
+            }
+            if depending_ids <= dropped_ids:
+                break
+            dropped_ids |= depending_ids
+
+        # New instances are not placed, but still inserted to keep link with their services
+        new_instances_ids = {instance.id for instance in self._new_service_instances}
+        for instance in self.get_service_instances_by_ids(dropped_ids & new_instances_ids):
+            self._unplace_new_instance(instance)
+
+        # Stored objects are reloaded with their changes dropped
+        instances_ids = dropped_ids - new_instances_ids
+        services_ids = conflicting_ids[ChangedObjectType.SERVICE]
+        nodes_ids = conflicting_ids[ChangedObjectType.NODE]
+        dropped = {*instances_ids, *services_ids, *nodes_ids}
+        # Changes are registered through bound append of the list, so it is filtered in place
+        self._changed_objects[:] = [obj for obj in self._changed_objects if obj.id not in dropped]
+
+        instances = self._apply_service_instances(
+            ServiceInstanceModel.retrieve_schemas(instances_ids) if instances_ids else []
+        )
+        self._apply_services(ServiceModel.retrieve_schemas(services_ids) if services_ids else [])
+        self._apply_nodes(NodeModel.retrieve_schemas(nodes_ids) if nodes_ids else [])
+        self._link_service_instances(instances)
+        for node_id in dropped_node_ids:
+            self._invalidate_available_resources(node_id)
+
+        self.updated_service_instances_ids |= dropped_ids
+        self.updated_services_ids |= services_ids
+        self.updated_nodes_ids |= nodes_ids
+
+    def _unplace_new_instance(self, instance: ServiceInstance):
+        """Return instance created by scheduler to not placed one, its node is to be invalidated"""
+        node = self.ids_to_nodes_mapping.get(instance.node_id, None)
+        if node:
+            node.instance_ids = [_id for _id in node.instance_ids if _id != instance.id]
+        self.allocated_resources[instance.id] = ResourceVector()
 
-    def commit_instances(self):
-        for instance in self.service_instances:
-            ServiceInstanceModel.synchronize_schema(instance)
+        instance.allocated_resources = None
+        instance.node_id = None
+        instance.status = ServiceInstanceStatus.EVICTED
+        instance.execution_status = None
+        instance.resource_status = None
 
     def get_nodes_by_ids(self, ids: Iterable[UUID4]) -> Iterable[Node]:
         return project(self.ids_to_nodes_mapping, ids).values()
@@ -101,66 +370,154 @@ class ClusterState:
         return self.get_services_by_ids(pluck_attr('service_id', self.get_node_instances(node)))
 
     def finalize_metrics(self) -> SchedulerMetrics:
-        self.metrics.increase_counter(TrackedObjects.NODE, len(self.nodes))
-        self.metrics.increase_counter(TrackedObjects.SERVICE, len(self.service_instances))
+        self.metrics.increase_counter(TrackedObjects.NODE, len(self.ids_to_nodes_mapping))
+        self.metrics.increase_counter(TrackedObjects.SERVICE, len(self.ids_to_service_instances_mapping))
 
-        total, available = ResourceData(), ResourceData()
-        for node in self.nodes:
-            total += node.node_resources
-            available += node.available_resources
+        if not self.nodes_resources:
+            return self.metrics
 
-        self.metrics.total_cluster_resources = total
-        self.metrics.utilized_cluster_resources = total - available
+        total, available = ResourceVector(), ResourceVector()
+        for node_id, node_resources in self.nodes_resources.items():
+            total += node_resources
+            available += self.available_resources.get(node_id, node_resources)
+
+        self.metrics.total_cluster_resources = total.to_data()
+        self.metrics.utilized_cluster_resources = (total - available).to_data()
         self.metrics.calculate_utilization()
 
         return self.metrics
 
     def calculate_available_resources(self):
-        """For each node available resources is calculated (or set to None if error occurred)"""
+        """
+        For each node without known available resources they are calculated.
+        Resident state keeps them up to date between runs, so only nodes touched by refresh are recalculated.
+        """
 
         for node in self.nodes:
-            instances = self.get_service_instances_by_ids(node.instance_ids)
-            occupied_resources = ResourceData()
+            if node.id in self.available_resources:
+                continue
 
-            for occupied_by_instance_resources in lpluck_attr("allocated_resources", instances):
-                occupied_resources += occupied_by_instance_resources
+            available_resources = self.nodes_resources[node.id].copy()
+            for instance_id in node.instance_ids:
+                available_resources -= self.allocated_resources[instance_id]
 
-            try:
-                node.available_resources = node.node_resources - occupied_resources
-            except ValueError:
+            if available_resources.is_negative():
                 raise SchedulingError("available_resource cannot be negative")
+            self.available_resources[node.id] = available_resources
+            self.capacity.set(node.id, available_resources, enabled=node.status == NodeStatus.ACTIVE)
+            previous = self._previous_available_resources.pop(node.id, None)
+            if node.status == NodeStatus.ACTIVE:
+                self.best_fit_index.set(node.id, available_resources)
+                if previous is None or not previous.fits(available_resources):  # Added, reactivated or freed
+                    self._increase_capacity_version()
+            else:
+                self.best_fit_index.remove(node.id)
+
+    def active_nodes_resources(self) -> ResourceVector:
+        """Total resources of active nodes"""
+        total = ResourceVector()
+        for node in self.active_nodes():
+            total += self.nodes_resources[node.id]
+        return total
+
+    def get_best_fit_node(self, required_resources: ResourceVector) -> Optional[Node]:
+        """Active node which is left with the least of the scarcest resource after placing required_resources"""
+        node_id = self.best_fit_index.best_fit(required_resources, self.capacity.fitting_nodes_ids)
+        return self.ids_to_nodes_mapping[node_id] if node_id else None
+
+    def get_eviction_candidates(self, node: Node) -> EvictionCandidates:
+        candidates = self.eviction_candidates.get(node.id, None)
+        if candidates is None:
+            candidates = EvictionCandidates()
+            for instance_id in node.instance_ids:
+                self._add_eviction_candidate(candidates, instance_id)
+            self.eviction_candidates[node.id] = candidates
+        return candidates
+
+    def _add_eviction_candidate(self, candidates: EvictionCandidates, instance_id: UUID4):
+        service = self.ids_to_services_mapping[self.ids_to_service_instances_mapping[instance_id].service_id]
+        allocated_resources = self.allocated_resources[instance_id]
+        candidates.add(
+            instance_id, effective_priority(service), allocated_resources, eviction_cost(service, allocated_resources)
+        )
+
+    def get_fitting_nodes(self, required_resources: ResourceVector) -> list[Node]:
+        """Active nodes with enough available resources to place required_resources without evictions"""
+        return [
+            self.ids_to_nodes_mapping[node_id] for node_id in self.capacity.fitting_nodes_ids(required_resources)
+        ]
 
     def attempt_to_acquire_resources(
-        self, node: Node, required_resources: ResourceData, for_service: Service, selector: SelectorType
+        self, node: Node, required_resources: ResourceVector, for_service: Service, selector: SelectorType
     ) -> Optional[list[ServiceInstance]]:
         """
         Attempt to acquire requested resources from node.
         If service can acquire requested resources through eviction of some (maybe empty) set,
-        then ids of "to be evicted" instances is returned.
-        Otherwise, EvictionError is raised.
+        then "to be evicted" instances are returned.
+        Otherwise, None is returned.
         """
-        if (node.available_resources is None) or not node.available_resources.is_complete():
-            raise ValueError("To attempt to acquire resources from node available_resources must be set and complete")
+        plan = self.plan_eviction(node, required_resources, for_service, selector)
+        return plan[1] if plan is not None else None
 
-        if node.available_resources.fits(required_resources):
-            return []
+    def plan_eviction(
+        self, node: Node, required_resources: ResourceVector, for_service: Service, selector: SelectorType
+    ) -> Optional[tuple[float, list[ServiceInstance]]]:
+        """
+        Cheapest found set of instances to evict from node to acquire requested resources with its eviction cost.
+        None is returned if requested resources can't be acquired from node.
+        """
+        available_resources = self.available_resources.get(node.id, None)
+        if available_resources is None:
+            raise ValueError("To attempt to acquire resources from node available_resources must be calculated")
+
+        if available_resources.fits(required_resources):
+            return 0.0, []
+
+        threshold = effective_priority_thresholds.get(selector, None)
+        if threshold is not None:  # Evictable instances are exactly the ones with the lowest priority
+            candidates = self.get_eviction_candidates(node)
+            plan = candidates.cheapest_eviction(
+                candidates.count_below(threshold(for_service)), required_resources - available_resources
+            )
+            if plan is None:
+                return None
+            cost, instance_ids = plan
+            return cost, lmap(self.ids_to_service_instances_mapping.get, instance_ids)
 
         evictable_services: list[Service] = lfilter(
             partial(selector, for_service), self.get_node_services(node)
         )
 
         evicted_instances: list[ServiceInstance] = []
-        sum_ = deepcopy(node.available_resources)
-        for counter, service in enumerate(evictable_services):
+        cost = 0.0
+        sum_ = available_resources.copy()
+        for service in evictable_services:
             instance = self.ids_to_service_instances_mapping[service.instance_id]
             evicted_instances.append(instance)
-            sum_ += instance.allocated_resources
+            sum_ += self.allocated_resources[instance.id]
+            cost += eviction_cost(service, self.allocated_resources[instance.id])
 
             if sum_.fits(required_resources):
-                return evicted_instances
+                return cost, evicted_instances
 
         return None
 
+    def plan_cheapest_eviction(
+        self, nodes: Iterable[Node], required_resources: ResourceVector, for_service: Service, selector: SelectorType
+    ) -> Optional[tuple[Node, list[ServiceInstance]]]:
+        """Node and set of instances to evict from it with the lowest eviction cost among given nodes"""
+        best_cost, best_plan = None, None
+        for node in nodes:
+            plan = self.plan_eviction(node, required_resources, for_service, selector)
+            if plan is None:
+                continue
+            cost, evicted_instances = plan
+            if best_cost is None or cost < best_cost:
+                best_cost, best_plan = cost, (node, evicted_instances)
+                if not cost:
+                    break
+        return best_plan
+
     def evict_instance(self, instance: ServiceInstance, node: Optional[Node] = None):
         """Evicts instance from node. Adjusts available resources."""
         self.metrics.increase_counter(TrackedAction.EVICTION, 1)
@@ -168,9 +525,10 @@ class ClusterState:
             self.metrics.increase_counter(TrackedAction.FRAGILE_EVICTION, 1)
 
         if not node:
-            node = self.ids_to_nodes_mapping[instance.id]
-        if node.available_resources is not None:
-            node.available_resources += instance.allocated_resources
+            node = self.ids_to_nodes_mapping[instance.node_id]
+        self._release_resources(node.id, self.allocated_resources.pop(instance.id, ResourceVector()))
+        if node.id in self.eviction_candidates:
+            self.eviction_candidates[node.id].remove(instance.id)
         node.instance_ids = [_id for _id in node.instance_ids if _id != instance.id]
 
         instance.allocated_resources = None
@@ -178,37 +536,88 @@ class ClusterState:
         instance.status = ServiceInstanceStatus.EVICTED
         instance.execution_status = None
         instance.resource_status = None
-        instance._was_updated = True
+        self.updated_service_instances_ids.add(instance.id)
 
-    def place_instance(self, instance: ServiceInstance, node: Node, required_resources: ResourceData):
+    def place_instance(self, instance: ServiceInstance, node: Node, required_resources: ResourceVector):
         """
         Places instance onto node. Adjusts available resources.
         If there is not enough resources to place instance raises SchedulingError.
         """
-        if not node.available_resources.fits(required_resources):
+        available_resources = self.available_resources.get(node.id, None)
+        if available_resources is None or not available_resources.fits(required_resources):
             raise SchedulingError()
-        try:  # If there is not enough resources to place instance raises SchedulingError
-            node.available_resources -= required_resources
-            self.metrics.increase_counter(TrackedAction.ALLOCATION, 1)
-        except (ValueError, AttributeError) as exc:
-            raise SchedulingError(exc)
+        self._acquire_resources(node.id, required_resources)
+        self.metrics.increase_counter(TrackedAction.ALLOCATION, 1)
         node.instance_ids.append(instance.id)
 
-        instance.allocated_resources = required_resources
+        self.allocated_resources[instance.id] = required_resources.copy()
+        if node.id in self.eviction_candidates:
+            self._add_eviction_candidate(self.eviction_candidates[node.id], instance.id)
+        instance.allocated_resources = required_resources.to_data()
         instance.node_id = node.id
         instance.status = ServiceInstanceStatus.PLACED
         instance.execution_status = ExecutionStatus.UNKNOWN
         instance.resource_status = ResourceStatus.OK
-        instance._was_updated = False
+        self.updated_service_instances_ids.discard(instance.id)
 
-    def shrink_instance(self, instance: ServiceInstance, resource_limit: ResourceData, node: Optional[Node] = None):
+    def relocate_instances(self, moves: list[tuple[ServiceInstance, Node]]):
+        """
+        Moves placed instances onto other nodes keeping their allocations. Adjusts available resources.
+        Resources of all moved instances are released first, so instances can be swapped between nodes.
+        If there is not enough resources on target node raises SchedulingError, nothing is changed then.
+        """
+        # Every target is checked against resources left after all moves before state is changed
+        resulting_resources: dict[UUID4, ResourceVector] = {}
+        for instance, node in moves:
+            for node_id in (instance.node_id, node.id):
+                if node_id not in resulting_resources and node_id in self.available_resources:
+                    resulting_resources[node_id] = self.available_resources[node_id].copy()
+            if node.id not in resulting_resources:
+                raise SchedulingError()
+            if instance.node_id in resulting_resources:
+                resulting_resources[instance.node_id] += self.allocated_resources[instance.id]
+            resulting_resources[node.id] -= self.allocated_resources[instance.id]
+        if any(resources.is_negative() for resources in resulting_resources.values()):
+            raise SchedulingError()
+
+        for instance, _ in moves:
+            self._release_resources(instance.node_id, self.allocated_resources[instance.id])
+        for instance, node in moves:
+            self._acquire_resources(node.id, self.allocated_resources[instance.id])
+
+        for instance, node in moves:
+            current_node = self.ids_to_nodes_mapping[instance.node_id]
+            current_node.instance_ids = [_id for _id in current_node.instance_ids if _id != instance.id]
+            if current_node.id in self.eviction_candidates:
+                self.eviction_candidates[current_node.id].remove(instance.id)
+
+            node.instance_ids.append(instance.id)
+            if node.id in self.eviction_candidates:
+                self._add_eviction_candidate(self.eviction_candidates[node.id], instance.id)
+            self.metrics.increase_counter(TrackedAction.MIGRATION, 1)
+            instance.node_id = node.id
+            instance.execution_status = ExecutionStatus.UNKNOWN
+
+    def extend_instance(self, instance: ServiceInstance, node: Node, additional_resources: ResourceVector):
+        """Extends instance allocation in place. Resources must be already available on node."""
+        self._acquire_resources(node.id, additional_resources)
+        allocated_resources = self.allocated_resources[instance.id]
+        allocated_resources += additional_resources
+        if node.id in self.eviction_candidates:
+            self._add_eviction_candidate(self.eviction_candidates[node.id], instance.id)
+        instance.allocated_resources = allocated_resources.to_data()
+
+    def shrink_instance(
+        self, instance: ServiceInstance, resource_limit: ResourceVector, node: Optional[Node] = None
+    ):
         """Shrink instance.allocated_resources to comply with resource_limit. Raises SchedulingError if not possible."""
-        new_allocated_resources = instance.allocated_resources.get_compliant(resource_limit)
+        allocated_resources = self.allocated_resources[instance.id]
+        new_allocated_resources = allocated_resources.get_compliant(resource_limit)
 
-        if new_allocated_resources == instance.allocated_resources:
+        if new_allocated_resources == allocated_resources:
             return
 
-        if not Node:
+        if not node:
             node = self.ids_to_nodes_mapping[instance.node_id]
 
         self.evict_instance(instance, node)
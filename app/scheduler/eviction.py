@@ -0,0 +1,137 @@
+from bisect import bisect_left, insort
+from typing import Optional
+
+import numpy as np
+from pydantic import UUID4
+
+from app.schemas.services import Service, ServiceType
+
+from .resources import ResourceVector, base_allocated_resources
+
+# Disruption caused by eviction of instance of each service type relative to stateless one
+type_eviction_costs = {
+    ServiceType.STATELESS: 1.0,
+    ServiceType.FRAGILE: 4.0,
+    ServiceType.STATEFUL: 16.0,
+}
+
+
+def eviction_cost(service: Service, allocated_resources: ResourceVector) -> float:
+    """Disruption caused by evicting instance, grows with service type, priority and size of its allocation"""
+    size = (
+        allocated_resources.cpu / base_allocated_resources.cpu
+        + allocated_resources.ram / base_allocated_resources.ram
+        + allocated_resources.disk / base_allocated_resources.disk
+    ) / 3
+    return type_eviction_costs[service.type] * (1 + service.priority / 100) * (1 + size)
+
+
+class EvictionCandidates:
+    """
+    Instances placed on a node ordered by effective priority (lowest first)
+    with cumulative sums of their allocated resources, so minimal set to evict is found by binary search.
+    """
+
+    def __init__(self):
+        self._keys: list[tuple[int, UUID4]] = []
+        self._priorities: dict[UUID4, int] = {}
+        self._resources: dict[UUID4, tuple[int, int, int]] = {}
+        self._costs: dict[UUID4, float] = {}
+        self._prefix_sums: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, instance_id: UUID4, priority: int, resources: ResourceVector, cost: float = 1.0):
+        self.remove(instance_id)
+        insort(self._keys, (priority, instance_id))
+        self._priorities[instance_id] = priority
+        self._resources[instance_id] = resources.cpu, resources.ram, resources.disk
+        self._costs[instance_id] = cost
+        self._prefix_sums = None
+
+    def remove(self, instance_id: UUID4):
+        priority = self._priorities.pop(instance_id, None)
+        if priority is None:
+            return
+        del self._keys[bisect_left(self._keys, (priority, instance_id))]
+        del self._resources[instance_id]
+        del self._costs[instance_id]
+        self._prefix_sums = None
+
+    def instance_ids(self, count: Optional[int] = None) -> list[UUID4]:
+        """Ids of count candidates with the lowest priority"""
+        return [instance_id for _, instance_id in self._keys[:count]]
+
+    def count_below(self, priority: int) -> int:
+        """Number of candidates with priority lower than given one"""
+        return bisect_left(self._keys, (priority,))
+
+    def prefix_sums(self) -> np.ndarray:
+        """Resources freed by evicting first i + 1 candidates in row i"""
+        if self._prefix_sums is None:
+            resources = np.array(
+                [self._resources[instance_id] for _, instance_id in self._keys], dtype=np.int64
+            ).reshape(-1, 3)
+            self._prefix_sums = np.cumsum(resources, axis=0)
+        return self._prefix_sums
+
+    def minimal_eviction_size(self, count: int, lacking: ResourceVector) -> Optional[int]:
+        """
+        Minimal number of lowest priority candidates (out of first count) which free lacking resources.
+        None is returned if evicting all count candidates is not enough.
+        """
+        prefix_sums = self.prefix_sums()[:count]
+        size = 0
+        for column, value in enumerate((lacking.cpu, lacking.ram, lacking.disk)):
+            if value <= 0:
+                continue
+            position = int(np.searchsorted(prefix_sums[:, column], value, side="left"))
+            if position == count:
+                return None
+            size = max(size, position + 1)
+        return size
+
+    def cheapest_eviction(self, count: int, lacking: ResourceVector) -> Optional[tuple[float, list[UUID4]]]:
+        """
+        Set of candidates (out of first count) which frees lacking resources with low total eviction cost.
+        It is chosen by greedy multi-dimensional knapsack heuristic: candidate with the lowest cost per share
+        of still lacking resources is taken until nothing is lacking, then taken candidates which turn out
+        to be unnecessary are dropped, most costly first. Minimal prefix of candidates is returned if it is cheaper.
+        None is returned if evicting all count candidates is not enough.
+        """
+        size = self.minimal_eviction_size(count, lacking)
+        if size is None:
+            return None
+        prefix_ids = self.instance_ids(size)
+        prefix_cost = sum(self._costs[instance_id] for instance_id in prefix_ids)
+        if size == 0:
+            return prefix_cost, prefix_ids
+
+        instance_ids = self.instance_ids(count)
+        resources = np.array([self._resources[instance_id] for instance_id in instance_ids], dtype=np.int64)
+        costs = np.array([self._costs[instance_id] for instance_id in instance_ids], dtype=np.float64)
+        lacking_values = np.array((lacking.cpu, lacking.ram, lacking.disk), dtype=np.int64)
+
+        remaining = np.maximum(lacking_values, 0)
+        scale = np.where(remaining > 0, remaining, 1)
+        taken = np.zeros(count, dtype=bool)
+        while remaining.any():
+            useful = (np.minimum(resources, remaining) / scale).sum(axis=1)
+            useful[taken] = 0
+            ratios = np.full(count, np.inf)
+            np.divide(costs, useful, out=ratios, where=useful > 0)
+            chosen = int(np.argmin(ratios))
+            taken[chosen] = True
+            remaining = np.maximum(remaining - resources[chosen], 0)
+
+        freed = resources[taken].sum(axis=0)
+        for position in sorted(np.flatnonzero(taken), key=lambda position: -costs[position]):
+            if np.all(freed - resources[position] >= lacking_values):
+                taken[position] = False
+                freed -= resources[position]
+
+        cost = float(costs[taken].sum())
+        if cost < prefix_cost:
+            return cost, [instance_ids[position] for position in np.flatnonzero(taken)]
+        return prefix_cost, prefix_ids
@@ -0,0 +1,52 @@
+import fcntl
+from typing import IO, Optional
+
+from app.settings import settings
+
+
+class SchedulerLock:
+    """
+    Advisory lock on file next to database, so only one process runs scheduler for it.
+    Resident states of schedulers don't see each other's writes and commit checks only rows being written,
+    so concurrent schedulers could overcommit the same node. Lock is released by OS when holder process exits.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[IO] = None
+
+    @property
+    def is_acquired(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """Take lock without waiting. True is returned if lock is held by this object"""
+        if self._file is not None:
+            return True
+        file = open(self.path, "a")
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def is_held_elsewhere(self) -> bool:
+        """Whether lock is held by other process (or other object), it is not taken by the check"""
+        if self._file is not None:
+            return False
+        if not self.acquire():
+            return True
+        self.release()
+        return False
+
+
+def get_scheduler_lock() -> SchedulerLock:
+    return SchedulerLock(f"{settings.database_path}.scheduler-lock")
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from app.settings import settings
+
+from . import Scheduler
+from .lock import SchedulerLock, get_scheduler_lock
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulingLoop:
+    """
+    Runs scheduler in background of event loop.
+    Run is triggered by writes: triggers coming within debounce window are coalesced into one run.
+    If nothing triggers it, run is still made once max_staleness passes since previous one.
+    If lock is given, runs are skipped until it is acquired, so only one of API processes schedules.
+    """
+
+    def __init__(self, debounce: timedelta, max_staleness: timedelta, lock: Optional[SchedulerLock] = None):
+        self.debounce = debounce
+        self.max_staleness = max_staleness
+        self.lock = lock
+
+        self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._triggered: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        self._event_loop = asyncio.get_running_loop()
+        self._triggered = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._event_loop, self._triggered, self._task = None, None, None
+        if self.lock is not None:
+            self.lock.release()
+
+    def trigger(self):
+        """Request scheduling run. Safe to call from any thread, does nothing if loop is not running"""
+        event_loop, triggered = self._event_loop, self._triggered
+        if event_loop is not None and triggered is not None:
+            event_loop.call_soon_threadsafe(triggered.set)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._triggered.wait(), timeout=self.max_staleness.total_seconds())
+            except asyncio.TimeoutError:
+                pass
+            else:
+                await asyncio.sleep(self.debounce.total_seconds())
+            self._triggered.clear()
+
+            if self.lock is not None and not self.lock.is_acquired:
+                if not self.lock.acquire():
+                    continue  # Other process runs scheduler, this one takes over once it exits
+                Scheduler.reset_state()  # Resident state doesn't have writes of previous lock holder
+
+            try:
+                # Scheduler makes blocking DB queries, so it is run outside of event loop
+                await asyncio.to_thread(Scheduler.run_scheduling)
+            except Exception:
+                logger.exception("Scheduling run failed")
+
+
+scheduling_loop = SchedulingLoop(
+    debounce=settings.scheduling_debounce,
+    max_staleness=settings.scheduling_max_staleness,
+    lock=get_scheduler_lock(),
+)
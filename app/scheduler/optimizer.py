@@ -0,0 +1,166 @@
+from datetime import timedelta
+from time import perf_counter
+from typing import Optional
+
+from funcy import first
+
+from app.schemas.monitoring import TrackedObjects
+from app.schemas.nodes import Node
+from app.schemas.services import ServiceInstance, ServiceInstanceStatus, ServiceStatus, ServiceType
+
+from .cluster import ClusterState
+from .packing import PendingInstance, first_fit_decreasing_order, required_resources_of
+from .resources import ResourceVector, base_allocated_resources
+
+
+class PlacementOptimizer:
+    """
+    Local search over placement made by resolvers, bounded by time budget.
+    Only improving moves are applied, so state always holds the best plan found so far
+    and search can be stopped at any moment without losing it.
+    Moves are made with instances of stateless services only.
+    """
+
+    @staticmethod
+    def run(state: ClusterState, time_budget: timedelta) -> ClusterState:
+        deadline = perf_counter() + time_budget.total_seconds()
+        total_resources = state.active_nodes_resources()
+
+        is_improved = True
+        while is_improved and perf_counter() < deadline:
+            is_improved = PlacementOptimizer.place_pending_instances(
+                state, total_resources, deadline
+            ) or PlacementOptimizer.reduce_stranded_resources(state, total_resources, deadline)
+
+        state.metrics.objects_counter[TrackedObjects.EVICTED] = len(PlacementOptimizer._get_pending(state))
+        return state
+
+    @staticmethod
+    def place_pending_instances(state: ClusterState, total_resources: ResourceVector, deadline: float) -> bool:
+        """Place instances left unplaced by resolvers, making room by moving stateless instances away"""
+        is_improved = False
+        for instance, _, required_resources in first_fit_decreasing_order(
+            PlacementOptimizer._get_pending(state), total_resources
+        ):
+            if perf_counter() >= deadline:
+                break
+
+            node = state.get_best_fit_node(required_resources)
+            if node is None:
+                node = PlacementOptimizer._make_room(state, required_resources)
+            if node is not None:
+                state.place_instance(instance, node, required_resources)
+                is_improved = True
+
+        return is_improved
+
+    @staticmethod
+    def _make_room(state: ClusterState, required_resources: ResourceVector) -> Optional[Node]:
+        """Move single instance away from some node so required_resources fit onto it"""
+        for node in state.active_nodes():
+            available_resources = state.available_resources[node.id]
+            for instance in PlacementOptimizer._get_movable_instances(state, node):
+                allocated_resources = state.allocated_resources[instance.id]
+                if not (available_resources + allocated_resources).fits(required_resources):
+                    continue
+
+                target_node = first(
+                    obj for obj in state.get_fitting_nodes(allocated_resources) if obj.id != node.id
+                )
+                if target_node is not None:
+                    state.relocate_instances([(instance, target_node)])
+                    return node
+
+        return None
+
+    @staticmethod
+    def reduce_stranded_resources(state: ClusterState, total_resources: ResourceVector, deadline: float) -> bool:
+        """Apply first move or swap of instances which decreases resources stranded on nodes"""
+        for node in state.active_nodes():
+            available_resources = state.available_resources[node.id]
+            stranded = PlacementOptimizer._stranded_share(available_resources, total_resources)
+            if not stranded:
+                continue
+
+            for instance in PlacementOptimizer._get_movable_instances(state, node):
+                if perf_counter() >= deadline:
+                    return False
+                allocated_resources = state.allocated_resources[instance.id]
+
+                # Move neighbourhood
+                for target_node in state.get_fitting_nodes(allocated_resources):
+                    if target_node.id == node.id:
+                        continue
+                    target_available_resources = state.available_resources[target_node.id]
+                    if PlacementOptimizer._is_improving(
+                        total_resources,
+                        (available_resources, available_resources + allocated_resources),
+                        (target_available_resources, target_available_resources - allocated_resources),
+                    ):
+                        state.relocate_instances([(instance, target_node)])
+                        return True
+
+                # Swap neighbourhood
+                for target_node in state.active_nodes():
+                    if target_node.id == node.id:
+                        continue
+                    target_available_resources = state.available_resources[target_node.id]
+                    for target_instance in PlacementOptimizer._get_movable_instances(state, target_node):
+                        delta = allocated_resources - state.allocated_resources[target_instance.id]
+                        new_available_resources = available_resources + delta
+                        new_target_available_resources = target_available_resources - delta
+                        if new_available_resources.is_negative() or new_target_available_resources.is_negative():
+                            continue
+                        if PlacementOptimizer._is_improving(
+                            total_resources,
+                            (available_resources, new_available_resources),
+                            (target_available_resources, new_target_available_resources),
+                        ):
+                            state.relocate_instances([(instance, target_node), (target_instance, node)])
+                            return True
+
+        return False
+
+    @staticmethod
+    def _is_improving(total_resources: ResourceVector, *changes: tuple[ResourceVector, ResourceVector]) -> bool:
+        """Whether changes of available resources of nodes (before, after) decrease stranded resources"""
+        return sum(
+            PlacementOptimizer._stranded_share(after, total_resources)
+            - PlacementOptimizer._stranded_share(before, total_resources)
+            for before, after in changes
+        ) < 0
+
+    @staticmethod
+    def _stranded_share(available_resources: ResourceVector, total_resources: ResourceVector) -> float:
+        """Share of cluster resources available on node which are too few to place any instance"""
+        if available_resources.fits(base_allocated_resources):
+            return 0.0
+        return sum(
+            (available / total) if total else 0.0
+            for available, total in (
+                (available_resources.cpu, total_resources.cpu),
+                (available_resources.ram, total_resources.ram),
+                (available_resources.disk, total_resources.disk),
+            )
+        )
+
+    @staticmethod
+    def _get_pending(state: ClusterState) -> list[PendingInstance]:
+        pending = []
+        for instance_id in state.updated_service_instances_ids:
+            instance: ServiceInstance = state.ids_to_service_instances_mapping[instance_id]
+            if instance.status != ServiceInstanceStatus.EVICTED:
+                continue
+            service = state.ids_to_services_mapping[instance.service_id]
+            if service.status == ServiceStatus.DELETED:
+                continue
+            pending.append(PendingInstance(instance, service, required_resources_of(service)))
+        return pending
+
+    @staticmethod
+    def _get_movable_instances(state: ClusterState, node: Node) -> list[ServiceInstance]:
+        instances = []
+        for instance in state.get_node_instances(node):
+            if state.ids_to_services_mapping[instance.service_id].type == ServiceType.STATELESS:
+                instances.append(instance)
+        return instances
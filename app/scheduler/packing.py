@@ -0,0 +1,48 @@
+from typing import NamedTuple
+
+from app.schemas.services import Service, ServiceInstance
+
+from .resources import ResourceVector, base_allocated_resources
+from .selectors import type_bonuses
+
+
+class PendingInstance(NamedTuple):
+    instance: ServiceInstance
+    service: Service
+    required_resources: ResourceVector
+
+
+def required_resources_of(service: Service) -> ResourceVector:
+    """Resources allocated to newly placed instance of service"""
+    return base_allocated_resources.get_compliant(
+        ResourceVector.from_data(service.resource_limit), ResourceVector.from_data(service.resource_floor)
+    )
+
+
+def dominant_share(required_resources: ResourceVector, total_resources: ResourceVector) -> float:
+    """Largest share of cluster resources required over all resource types"""
+    return max(
+        (required / total) if total else 0.0
+        for required, total in (
+            (required_resources.cpu, total_resources.cpu),
+            (required_resources.ram, total_resources.ram),
+            (required_resources.disk, total_resources.disk),
+        )
+    )
+
+
+def first_fit_decreasing_order(
+    pending: list[PendingInstance], total_resources: ResourceVector
+) -> list[PendingInstance]:
+    """
+    Order pending instances for packing: largest dominant share first,
+    ties are broken by higher priority and then by harder to evict service type.
+    """
+    return sorted(
+        pending,
+        key=lambda item: (
+            -dominant_share(item.required_resources, total_resources),
+            -item.service.priority,
+            -type_bonuses[item.service.type],
+        ),
+    )
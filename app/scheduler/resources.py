@@ -0,0 +1,99 @@
+from typing import Optional
+
+from app.schemas.helpers import ResourceData, increase_resource_step_kwargs, resource_types
+
+CPU_CORES_SCALE = 10  # ResourceData rounds cpu_cores up to tenths, so they are kept as integer tenths
+
+# Names of ResourceVector slots for each resource type
+resource_slots = {
+    "cpu_cores": "cpu",
+    "ram": "ram",
+    "disk": "disk",
+}
+
+
+class ResourceVector:
+    """
+    Compact integer representation of resources used by scheduler internals.
+    In-place operations do not allocate, conversion to and from ResourceData is made on API and DB boundary only.
+    Missing values of ResourceData are represented as zeros (for limits zero means no limit).
+    """
+
+    __slots__ = ("cpu", "ram", "disk")
+
+    def __init__(self, cpu: int = 0, ram: int = 0, disk: int = 0):
+        self.cpu = cpu
+        self.ram = ram
+        self.disk = disk
+
+    @classmethod
+    def from_data(cls, data: Optional[ResourceData]) -> "ResourceVector":
+        if data is None:
+            return cls()
+        return cls(
+            cpu=round((data.cpu_cores or 0) * CPU_CORES_SCALE),
+            ram=int(data.ram or 0),
+            disk=int(data.disk or 0),
+        )
+
+    def to_data(self) -> ResourceData:
+        # Values are already validated, so validation (and cpu_cores rounding) is skipped
+        return ResourceData.construct(cpu_cores=self.cpu / CPU_CORES_SCALE, ram=self.ram, disk=self.disk)
+
+    def copy(self) -> "ResourceVector":
+        return ResourceVector(self.cpu, self.ram, self.disk)
+
+    def get(self, resource_type: str) -> int:
+        return getattr(self, resource_slots[resource_type])
+
+    def set(self, resource_type: str, value: int):
+        setattr(self, resource_slots[resource_type], value)
+
+    def __iadd__(self, other: "ResourceVector") -> "ResourceVector":
+        self.cpu += other.cpu
+        self.ram += other.ram
+        self.disk += other.disk
+        return self
+
+    def __isub__(self, other: "ResourceVector") -> "ResourceVector":
+        self.cpu -= other.cpu
+        self.ram -= other.ram
+        self.disk -= other.disk
+        return self
+
+    def __add__(self, other: "ResourceVector") -> "ResourceVector":
+        return ResourceVector(self.cpu + other.cpu, self.ram + other.ram, self.disk + other.disk)
+
+    def __sub__(self, other: "ResourceVector") -> "ResourceVector":
+        return ResourceVector(self.cpu - other.cpu, self.ram - other.ram, self.disk - other.disk)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ResourceVector):
+            return NotImplemented
+        return self.cpu == other.cpu and self.ram == other.ram and self.disk == other.disk
+
+    def __repr__(self) -> str:
+        return f"ResourceVector(cpu={self.cpu}, ram={self.ram}, disk={self.disk})"
+
+    def fits(self, other: "ResourceVector") -> bool:
+        return self.cpu >= other.cpu and self.ram >= other.ram and self.disk >= other.disk
+
+    def is_negative(self) -> bool:
+        return self.cpu < 0 or self.ram < 0 or self.disk < 0
+
+    def get_compliant(
+        self, resource_limit: "ResourceVector", resource_floor: Optional["ResourceVector"] = None
+    ) -> "ResourceVector":
+        """Same as ResourceData.get_compliant: values are capped by non-zero limits and raised to floor"""
+        compliant = ResourceVector()
+        for resource_type in resource_types:
+            value, limit = self.get(resource_type), resource_limit.get(resource_type)
+            value = min(value, limit) if limit else value
+            if resource_floor is not None:
+                value = max(value, resource_floor.get(resource_type))
+            compliant.set(resource_type, value)
+        return compliant
+
+
+increase_resource_step = ResourceVector.from_data(ResourceData(**increase_resource_step_kwargs))
+base_allocated_resources = increase_resource_step
@@ -18,5 +18,15 @@ def any_with_lower_priority(requester: Service, target: Service) -> bool:
     return requester.priority > target.priority
 
 
+def effective_priority(service: Service) -> int:
+    return service.priority + type_bonuses[service.type]
+
+
 def same_or_lower_type_with_lower_priority(requester: Service, target: Service) -> bool:
-    return (requester.priority + type_bonuses[requester.type]) > (target.priority + type_bonuses[target.type])
\ No newline at end of file
+    return effective_priority(requester) > effective_priority(target)
+
+
+# Selectors which select exactly targets with effective priority lower than returned threshold
+effective_priority_thresholds: dict[SelectorType, Callable[[Service], int]] = {
+    same_or_lower_type_with_lower_priority: effective_priority,
+}
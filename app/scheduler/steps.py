@@ -1,23 +1,24 @@
 from typing import Optional
+from uuid import uuid4
 
-from funcy import lfilter, lpluck_attr, pluck_attr
+from funcy import lfilter, lpluck_attr
 from pydantic import UUID4
 
-from app.models import ServiceInstanceModel
-from app.schemas.helpers import ResourceData, base_allocated_resources, increase_resource_step_kwargs, resource_types
 from app.schemas.monitoring import TrackedObjects
 from app.schemas.nodes import Node, NodeStatus
-from app.schemas.services import ExecutionStatus, ResourceStatus, Service, ServiceInstance, ServiceInstanceStatus, ServiceStatus, ServiceType
-from app.utils.exceptions import EvictionError, SchedulingError
+from app.schemas.services import ExecutionStatus, ResourceStatus, Service, ServiceInstance, ServiceInstanceStatus, ServiceStatus
+from app.utils.exceptions import SchedulingError
 
 from .cluster import ClusterState
+from .packing import PendingInstance, first_fit_decreasing_order, required_resources_of
+from .resources import ResourceVector, increase_resource_step
 from .selectors import any_with_lower_priority, same_or_lower_type_with_lower_priority
 
 
 class NodeUpdatesResolver:
     @staticmethod
     def run(state: ClusterState) -> ClusterState:
-        updated_nodes_ids: set[UUID4] = set(pluck_attr("id", filter(lambda obj: obj._was_updated, state.nodes)))
+        updated_nodes_ids: set[UUID4] = set(state.updated_nodes_ids)
 
         state, updated_nodes_ids = NodeUpdatesResolver.evict_from_non_active_nodes(state, updated_nodes_ids)
         state, updated_nodes_ids = NodeUpdatesResolver.resolve_active_nodes(state, updated_nodes_ids)
@@ -42,7 +43,7 @@ class NodeUpdatesResolver:
                 state.evict_instance(instance, node)
 
             node.instance_ids = []
-            node._was_updated = False
+            state.updated_nodes_ids.discard(node_id)
             updated_nodes_ids.remove(node_id)
 
         return state, updated_nodes_ids
@@ -55,7 +56,7 @@ class NodeUpdatesResolver:
             if node.status != NodeStatus.ACTIVE:
                 continue
 
-            node._was_updated = False
+            state.updated_nodes_ids.discard(node_id)
             updated_nodes_ids.remove(node_id)
 
         return state, updated_nodes_ids
@@ -64,7 +65,7 @@ class NodeUpdatesResolver:
 class ServiceUpdatesResolver:
     @staticmethod
     def run(state: ClusterState) -> ClusterState:
-        updated_services_ids: set[UUID4] = set(pluck_attr("id", filter(lambda obj: obj._was_updated, state.services)))
+        updated_services_ids: set[UUID4] = set(state.updated_services_ids)
 
         state, updated_services_ids = ServiceUpdatesResolver.delete_instances_of_deleted_services(
             state, updated_services_ids
@@ -88,11 +89,15 @@ class ServiceUpdatesResolver:
             if service.status != ServiceStatus.DELETED:
                 continue
 
-            instance: ServiceInstance = state.ids_to_service_instances_mapping[service.instance_id]
-            if instance.node_id:
-                state.evict_instance(instance)
+            if service.instance_id:
+                instance: ServiceInstance = state.ids_to_service_instances_mapping[service.instance_id]
+                if instance.node_id:
+                    state.evict_instance(instance)
+                # Deleted instance is not pending, so it is never placed again
+                instance.status = ServiceInstanceStatus.DELETED
+                state.updated_service_instances_ids.discard(instance.id)
 
-            service._was_updated = False
+            state.updated_services_ids.discard(service_id)
             updated_services_ids.remove(service_id)
 
         return state, updated_services_ids
@@ -108,46 +113,91 @@ class ServiceUpdatesResolver:
                 continue
             if service.instance_id:
                 instance: ServiceInstance = state.ids_to_service_instances_mapping[service.instance_id]
+                if instance.status == ServiceInstanceStatus.DELETED:  # Service is reactivated
+                    instance.status = ServiceInstanceStatus.EVICTED
             else:
                 instance = ServiceInstance(
+                    id=uuid4(),
                     executable=service.executable,
                     status=ServiceInstanceStatus.EVICTED,
                     service_id=service.id,
                 )
-                ServiceInstanceModel.synchronize_schema(instance)
                 # Link to service
                 service.instance_id = instance.id
                 # Add to cluster state
-                state.service_instances.append(instance)
-                state.ids_to_service_instances_mapping[instance.id] = instance
-            instance._was_updated = True
+                state.add_service_instance(instance)
+            state.updated_service_instances_ids.add(instance.id)
 
-            service._was_updated = False
+            state.updated_services_ids.discard(service_id)
             updated_services_ids.remove(service_id)
 
         return state, updated_services_ids
 
 
 class ServiceInstanceUpdatesResolver:
+    # Max number of waves of instances evicted during run which are placed again within the same run
+    max_cascade_depth = 3
+
     @staticmethod
     def run(state: ClusterState) -> ClusterState:
-        updated_service_instances_ids: set[UUID4] = set(
-            pluck_attr("id", filter(lambda obj: obj._was_updated, state.service_instances))
-        )
+        updated_service_instances_ids: set[UUID4] = set(state.updated_service_instances_ids)
 
         state.calculate_available_resources()
 
         state, updated_service_instances_ids = ServiceInstanceUpdatesResolver.resolve_placed_service_instances(
             state, updated_service_instances_ids
         )
+        pending_ids = ServiceInstanceUpdatesResolver._get_evicted_ids(state, updated_service_instances_ids)
         state, updated_service_instances_ids = ServiceInstanceUpdatesResolver.resolve_evicted_service_instances(
             state, updated_service_instances_ids
         )
+        state, updated_service_instances_ids, pending_ids = ServiceInstanceUpdatesResolver.resolve_evicted_victims(
+            state, updated_service_instances_ids, pending_ids
+        )
 
-        state.metrics.increase_counter(TrackedObjects.EVICTED, len(updated_service_instances_ids))
+        if pending_ids:
+            unplaced_ids = ServiceInstanceUpdatesResolver._get_evicted_ids(state, pending_ids)
+            state.metrics.packing_ratio = 1 - len(unplaced_ids) / len(pending_ids)
+        # Victims left beyond cascade depth are waiting for placement as well
+        state.metrics.increase_counter(
+            TrackedObjects.EVICTED,
+            len(ServiceInstanceUpdatesResolver._get_evicted_ids(state, state.updated_service_instances_ids)),
+        )
 
         return state
 
+    @staticmethod
+    def resolve_evicted_victims(
+        state: ClusterState, updated_service_instances_ids: set[UUID4], pending_ids: set[UUID4]
+    ) -> tuple[ClusterState, set[UUID4], set[UUID4]]:
+        """
+        Instances evicted while resolving are queued back and placed within the same run, wave by wave.
+        Cascade is bounded by max_cascade_depth waves. Instances which were already pending in this run
+        are not queued again, so eviction cycles are cut and the rest is left for next run.
+        """
+        attempted_ids = updated_service_instances_ids | pending_ids
+        for _ in range(ServiceInstanceUpdatesResolver.max_cascade_depth):
+            victims_ids = ServiceInstanceUpdatesResolver._get_evicted_ids(
+                state, state.updated_service_instances_ids - attempted_ids
+            )
+            if not victims_ids:
+                break
+            attempted_ids |= victims_ids
+            pending_ids |= victims_ids
+
+            state, victims_ids = ServiceInstanceUpdatesResolver.resolve_evicted_service_instances(state, victims_ids)
+            updated_service_instances_ids |= victims_ids
+
+        return state, updated_service_instances_ids, pending_ids
+
+    @staticmethod
+    def _get_evicted_ids(state: ClusterState, instances_ids: set[UUID4]) -> set[UUID4]:
+        return {
+            instance_id
+            for instance_id in instances_ids
+            if state.ids_to_service_instances_mapping[instance_id].status == ServiceInstanceStatus.EVICTED
+        }
+
     @staticmethod
     def resolve_placed_service_instances(
         state: ClusterState, updated_service_instances_ids: set[UUID4]
@@ -158,11 +208,17 @@ class ServiceInstanceUpdatesResolver:
             if instance.status != ServiceInstanceStatus.PLACED:
                 continue
 
+            node = state.ids_to_nodes_mapping.get(instance.node_id, None)
+            if node is not None and node.status != NodeStatus.ACTIVE:  # Reloaded after concurrent update
+                state.evict_instance(instance, node)
+                continue
+
             if instance.resource_status != ResourceStatus.OK:
                 state = ServiceInstanceUpdatesResolver.resolve_constraint_service_instance(state, instance)
 
             service: Service = state.ids_to_services_mapping[instance.service_id]
-            state.shrink_instance(instance, service.resource_limit)
+            state.shrink_instance(instance, ResourceVector.from_data(service.resource_limit))
+            state.updated_service_instances_ids.discard(instance_id)
             updated_service_instances_ids.remove(instance_id)
 
         return state, updated_service_instances_ids
@@ -176,32 +232,35 @@ class ServiceInstanceUpdatesResolver:
         service: Service = state.ids_to_services_mapping[instance.service_id]
         current_node = state.ids_to_nodes_mapping[instance.node_id]
 
+        allocated_resources = state.allocated_resources[instance.id]
         increased_resources = ServiceInstanceUpdatesResolver._calculate_increased_resources(
-            service, instance, constraint_resource_type
+            ResourceVector.from_data(service.resource_limit), allocated_resources, constraint_resource_type
         )
 
         # Attempt to increase resources without moving
-        additional_resources = increased_resources - instance.allocated_resources
+        additional_resources = increased_resources - allocated_resources
         evict = state.attempt_to_acquire_resources(current_node, additional_resources, service, same_or_lower_type_with_lower_priority)
         if evict is not None:
             for evicted_instance in evict:
                 state.evict_instance(evicted_instance, current_node)
-            instance.allocated_resources += additional_resources
-            current_node.available_resources -= additional_resources
+            state.extend_instance(instance, current_node, additional_resources)
 
             instance.resource_status = ResourceStatus.OK
             return state
 
-        # Attempt to increase resources by moving
-        for node in (obj for obj in state.active_nodes() if obj.id != current_node.id):
-            evict = state.attempt_to_acquire_resources(
-                node, increased_resources, service, same_or_lower_type_with_lower_priority
-            )
-            if evict is not None:
-                for evicted_instance in evict:
-                    state.evict_instance(evicted_instance, node)
-                state.evict_instance(instance, current_node)
-                state.place_instance(instance, node, increased_resources)
+        # Attempt to increase resources by moving with the least disruptive evictions
+        plan = state.plan_cheapest_eviction(
+            (obj for obj in state.active_nodes() if obj.id != current_node.id),
+            increased_resources,
+            service,
+            same_or_lower_type_with_lower_priority,
+        )
+        if plan:
+            node, evict = plan
+            for evicted_instance in evict:
+                state.evict_instance(evicted_instance, node)
+            state.evict_instance(instance, current_node)
+            state.place_instance(instance, node, increased_resources)
 
             instance.resource_status = ResourceStatus.OK
             return state
@@ -212,62 +271,66 @@ class ServiceInstanceUpdatesResolver:
     def resolve_evicted_service_instances(
         state: ClusterState, updated_service_instances_ids: set[UUID4]
     ) -> tuple[ClusterState, set[UUID4]]:
-
-        for instance_id in list(updated_service_instances_ids):
+        pending: list[PendingInstance] = []
+        for instance_id in updated_service_instances_ids:
             instance: ServiceInstance = state.ids_to_service_instances_mapping[instance_id]
 
             if instance.status != ServiceInstanceStatus.EVICTED:
                 continue
 
             service: Service = state.ids_to_services_mapping[instance.service_id]
-            required_resources = base_allocated_resources.get_compliant(service.resource_limit, service.resource_floor)
+            if service.status == ServiceStatus.DELETED:
+                continue  # Has no resource limit, must not be placed
+            pending.append(PendingInstance(instance, service, required_resources_of(service)))
+
+        # Pack pending instances all at once, largest first
+        for instance, service, required_resources in first_fit_decreasing_order(
+            pending, state.active_nodes_resources()
+        ):
+            if state.is_known_unplaceable(required_resources, service):
+                continue  # Nothing is released since the same request failed
 
             is_placed = ServiceInstanceUpdatesResolver.place_instance_somewhere(
                 state, instance, required_resources, service
             )
             if is_placed:
-                updated_service_instances_ids.remove(instance_id)
+                updated_service_instances_ids.remove(instance.id)
             else:
-                pass  # Resolve not enough resources to place
+                state.remember_unplaceable(required_resources, service)
 
         return state, updated_service_instances_ids
 
     @staticmethod
     def _calculate_increased_resources(
-        service: Service, instance: ServiceInstance, exceeded_resource_type: str
-    ) -> ResourceData:
-        resource_limit = getattr(service.resource_limit, exceeded_resource_type)
-        resource_allocated = getattr(instance.allocated_resources, exceeded_resource_type)
+        resource_limits: ResourceVector, allocated_resources: ResourceVector, exceeded_resource_type: str
+    ) -> ResourceVector:
+        resource_limit = resource_limits.get(exceeded_resource_type)
+        resource_allocated = allocated_resources.get(exceeded_resource_type)
+        increase_step = increase_resource_step.get(exceeded_resource_type)
 
+        increased_resources = allocated_resources.copy()
         if resource_limit == resource_allocated:
-            return instance.allocated_resources
+            return increased_resources
         resource_increased = min(
-            resource_limit, resource_allocated + increase_resource_step_kwargs[exceeded_resource_type]
-        ) if resource_limit else resource_allocated + increase_resource_step_kwargs[exceeded_resource_type]
+            resource_limit, resource_allocated + increase_step
+        ) if resource_limit else resource_allocated + increase_step
 
-        return ResourceData(**(instance.allocated_resources.dict() | {exceeded_resource_type: resource_increased}))
+        increased_resources.set(exceeded_resource_type, resource_increased)
+        return increased_resources
 
     @staticmethod
     def place_instance_somewhere(
-        state: ClusterState, instance: ServiceInstance, required_resources: ResourceData, service: Service
+        state: ClusterState, instance: ServiceInstance, required_resources: ResourceVector, service: Service
     ) -> bool:
-        for node in state.active_nodes():  # Try to place instance without evictions
-            try:
-                state.place_instance(instance, node, required_resources)
-                return True
-            except SchedulingError:
-                continue
-        chosen_node = None
-        for node in state.active_nodes():  # Try to place instance with evictions
-            evict = state.attempt_to_acquire_resources(
-                node, required_resources, service, same_or_lower_type_with_lower_priority
-            )
-            if evict is not None:
-                chosen_node = node
-                if all(map(lambda x: x.type != ServiceType, state.get_node_services(node))):
-                    break
-
-        if chosen_node:
+        best_fit_node = state.get_best_fit_node(required_resources)
+        if best_fit_node:  # Place instance without evictions
+            state.place_instance(instance, best_fit_node, required_resources)
+            return True
+        plan = state.plan_cheapest_eviction(  # Try to place instance with the least disruptive evictions
+            state.active_nodes(), required_resources, service, same_or_lower_type_with_lower_priority
+        )
+        if plan:
+            node, evict = plan
             for evicted_instance in evict:
                 state.evict_instance(evicted_instance, node)
             state.place_instance(instance, node, required_resources)
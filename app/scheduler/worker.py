@@ -0,0 +1,130 @@
+"""
+Scheduler worker process, so scheduling runs don't compete with API requests for GIL.
+Worker learns about writes made by API processes from change log. Started by API process
+or separately with `python -m app.scheduler.worker`.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+from datetime import timedelta
+from typing import Optional
+
+from app.database import db
+from app.migrations import apply_migrations
+from app.models import ChangeLogModel
+from app.schemas.changes import ChangeSource
+from app.settings import settings
+
+from .lock import get_scheduler_lock
+from .loop import SchedulingLoop
+
+logger = logging.getLogger(__name__)
+
+# Exit code of worker which found scheduler already run by other process
+lock_held_exit_code = 3
+
+
+class ChangeLogWatcher:
+    """Triggers scheduling loop whenever new changes made through API are appended to change log"""
+
+    def __init__(self, scheduling_loop: SchedulingLoop, poll_interval: timedelta):
+        self.scheduling_loop = scheduling_loop
+        self.poll_interval = poll_interval
+
+    async def run(self):
+        seen_seq = await asyncio.to_thread(ChangeLogModel.last_seq, ChangeSource.API)
+        self.scheduling_loop.trigger()  # Resolve changes made while worker was not running
+        while True:
+            await asyncio.sleep(self.poll_interval.total_seconds())
+            last_seq = await asyncio.to_thread(ChangeLogModel.last_seq, ChangeSource.API)
+            if last_seq != seen_seq:
+                seen_seq = last_seq
+                self.scheduling_loop.trigger()
+
+
+async def run_worker():
+    scheduling_loop = SchedulingLoop(
+        debounce=settings.scheduling_debounce, max_staleness=settings.scheduling_max_staleness
+    )
+    await scheduling_loop.start()
+    try:
+        await ChangeLogWatcher(scheduling_loop, settings.scheduling_poll_interval).run()
+    finally:
+        await scheduling_loop.stop()
+
+
+def main():
+    # Exits at once if other process already runs scheduler, supervisor of this process won't restart it then
+    lock = get_scheduler_lock()
+    if not lock.acquire():
+        logger.warning("Scheduler is already run by other process, worker exits")
+        sys.exit(lock_held_exit_code)
+
+    if settings.scheduler_worker_cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {settings.scheduler_worker_cpu})
+    with db.connection_scope():
+        apply_migrations()
+    asyncio.run(run_worker())
+
+
+def start_worker_process() -> multiprocessing.Process:
+    process = multiprocessing.get_context("spawn").Process(target=main, name="scheduler-worker", daemon=True)
+    process.start()
+    return process
+
+
+def stop_worker_process(process: multiprocessing.Process, timeout: float = 5.0):
+    process.terminate()
+    process.join(timeout)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+class WorkerSupervisor:
+    """
+    Keeps scheduler worker process running until supervisor is stopped: exited worker is started again.
+    Worker is not started while scheduler lock is held by other process (worker of other API process,
+    external worker or in-process scheduler), so it takes over only once that process exits.
+    """
+
+    def __init__(self, check_interval: timedelta):
+        self.check_interval = check_interval
+        self.restarts = 0
+
+        self._lock = get_scheduler_lock()
+        self._process: Optional[multiprocessing.Process] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._process is not None:
+            # Process is joined for up to timeout, so event loop is not blocked meanwhile
+            await asyncio.to_thread(stop_worker_process, self._process)
+        self._process, self._task = None, None
+
+    async def _run(self):
+        while True:
+            if self._process is not None and not self._process.is_alive():
+                if self._process.exitcode != lock_held_exit_code:
+                    logger.error("Scheduler worker process exited with code %s", self._process.exitcode)
+                    self.restarts += 1
+                self._process = None
+            if self._process is None and not self._lock.is_held_elsewhere():
+                # Spawning process imports app in child, so it is not done in event loop
+                self._process = await asyncio.to_thread(start_worker_process)
+            await asyncio.sleep(self.check_interval.total_seconds())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+from app.utils.typing import ChoicesEnum
+
+
+class ChangedObjectType(str, ChoicesEnum):
+    NODE = "node"
+    SERVICE = "service"
+    SERVICE_INSTANCE = "service_instance"
+
+
+class ChangeSource(str, ChoicesEnum):
+    API = "api"
+    SCHEDULER = "scheduler"
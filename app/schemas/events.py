@@ -1,6 +1,6 @@
 from typing import Optional
 
-from pydantic import UUID4, BaseModel, validator
+from pydantic import UUID4, BaseModel, Field, validator
 
 from .helpers import ResourceData
 from .nodes import NodeStatus
@@ -22,3 +22,8 @@ class ServiceInstanceEvent(BaseModel):
     instance_id: UUID4 = ...
     execution_status: Optional[ExecutionStatus] = None
     resource_status: Optional[ResourceStatus] = None
+
+
+class EventsBatch(BaseModel):
+    node_events: list[NodeEvent] = Field(default_factory=list)
+    service_instance_events: list[ServiceInstanceEvent] = Field(default_factory=list)
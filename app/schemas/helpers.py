@@ -1,9 +1,9 @@
 import math
 from copy import deepcopy
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
 from funcy import lmap, lpluck_attr
-from pydantic import BaseModel, ByteSize, Field, validator
+from pydantic import BaseModel, ByteSize, Field, PrivateAttr, validator
 
 resource_types = ("cpu_cores", "ram", "disk")
 
@@ -82,4 +82,29 @@ class ResourceData(BaseModel):
         return ResourceData(**resource_data_kwargs)
 
 
+class TrackedModel(BaseModel):
+    """
+    Schema which remembers names of attributes assigned after creation.
+    When first change is made, _on_change (if set) is called with changed schema.
+    _version is version of stored row schema was retrieved with.
+    """
+
+    _changed_fields: set[str] = PrivateAttr(default_factory=set)
+    _on_change: Optional[Callable[["TrackedModel"], Any]] = PrivateAttr(None)
+    _version: int = PrivateAttr(0)
+
+    def __setattr__(self, name: str, value: Any):
+        super().__setattr__(name, value)
+        if name in self.__fields__:
+            if not self._changed_fields and self._on_change is not None:
+                self._on_change(self)
+            self._changed_fields.add(name)
+
+    def changed_fields(self) -> set[str]:
+        return self._changed_fields
+
+    def reset_changes(self):
+        self._changed_fields = set()
+
+
 base_allocated_resources = ResourceData(**increase_resource_step_kwargs)
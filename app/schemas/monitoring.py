@@ -12,12 +12,14 @@ class TrackedAction(str, ChoicesEnum):
     EVICTION = "eviction"
     FRAGILE_EVICTION = "fragile_eviction"
     ALLOCATION = "allocation"
+    MIGRATION = "migration"
 
 
 class TrackedObjects(str, ChoicesEnum):
     NODE = "node"
     SERVICE = "service"
     EVICTED = "evicted"
+    CONFLICTING = "conflicting"  # Changed concurrently with scheduler run, so left for next run
 
 
 class SchedulerMetrics(BaseModel):
@@ -26,6 +28,7 @@ class SchedulerMetrics(BaseModel):
     total_cluster_resources: Optional[ResourceData] = None
     utilized_cluster_resources: Optional[ResourceData] = None
     utilization: dict = Field(default_factory=dict)
+    packing_ratio: Optional[float] = None  # Share of evicted instances placed by the run
 
     actions_counter: dict[TrackedAction, int] = Field(default_factory=dict)
     objects_counter: dict[TrackedObjects, int] = Field(default_factory=dict)
@@ -42,7 +45,7 @@ class SchedulerMetrics(BaseModel):
         for resource_type in resource_types:
             total = getattr(self.total_cluster_resources, resource_type)
             utilized = getattr(self.utilized_cluster_resources, resource_type)
-            if (total is not None) and (utilized is not None):
+            if total and (utilized is not None):
                 self.utilization[resource_type] = utilized / total
 
     def increase_counter(self, on: Union[TrackedAction, TrackedObjects], by: int):
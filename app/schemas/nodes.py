@@ -1,10 +1,10 @@
 from typing import Any, Optional
 
-from pydantic import UUID4, BaseModel, validator
+from pydantic import UUID4, validator
 
 from app.utils.typing import ChoicesEnum
 
-from .helpers import ResourceData
+from .helpers import ResourceData, TrackedModel
 
 
 class NodeStatus(str, ChoicesEnum):
@@ -13,7 +13,7 @@ class NodeStatus(str, ChoicesEnum):
     DELETED = "deleted"
 
 
-class Node(BaseModel):
+class Node(TrackedModel):
     id: UUID4 = None
     status: NodeStatus = NodeStatus.ACTIVE
 
@@ -21,8 +21,6 @@ class Node(BaseModel):
     available_resources: Optional[ResourceData] = None
     instance_ids: Optional[list[UUID4]] = None
 
-    _was_updated: Optional[bool] = None
-
     @validator("node_resources")
     def validate_node_resources(cls, value: Optional[ResourceData], values: dict[str, Any]) -> Optional[ResourceData]:
         """Not deleted nodes must have a complete node_resources"""
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import UUID4, BaseModel
 
 from .monitoring import SchedulerLog
 from .nodes import Node
@@ -13,12 +15,28 @@ class EventResponse(BaseResponse):
     pass
 
 
+class EventResult(BaseModel):
+    status_code: int = 200
+    detail: Optional[str] = None
+
+
+class EventsBatchResponse(BaseResponse):
+    node_events: list[EventResult] = ...
+    service_instance_events: list[EventResult] = ...
+
+
 class NodeResponse(BaseResponse):
     data: Node = ...
 
 
 class NodeListResponse(BaseResponse):
     data: list[Node] = ...
+    next_after: Optional[UUID4] = None  # Cursor of the next page if list is paginated and there are more nodes
+
+
+class NodeAssignmentsResponse(BaseResponse):
+    revision: int = ...
+    data: list[ServiceInstance] = ...
 
 
 class ServiceResponse(BaseResponse):
@@ -27,9 +45,11 @@ class ServiceResponse(BaseResponse):
 
 class ServiceListResponse(BaseResponse):
     data: list[Service] = ...
+    next_after: Optional[UUID4] = None  # Cursor of the next page if list is paginated and there are more services
 
 
 class ClusterStateResponse(BaseResponse):
+    revision: int = ...
     services: list[Service] = ...
     service_instances: list[ServiceInstance] = ...
     nodes: list[Node] = ...
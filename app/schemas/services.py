@@ -1,10 +1,10 @@
 from typing import Any, Optional
 
-from pydantic import UUID4, BaseModel, Field, validator
+from pydantic import UUID4, Field, validator
 
 from app.utils.typing import ChoicesEnum
 
-from .helpers import ResourceData
+from .helpers import ResourceData, TrackedModel
 
 DEFAULT_PRIORITY = 99
 
@@ -39,7 +39,7 @@ class ResourceStatus(str, ChoicesEnum):
     CONSTRAINT_BY_DISK = 'disk'
 
 
-class ServiceInstance(BaseModel):
+class ServiceInstance(TrackedModel):
     id: UUID4 = None
     executable: UUID4 = None
     status: ServiceInstanceStatus = ServiceInstanceStatus.EVICTED
@@ -49,8 +49,6 @@ class ServiceInstance(BaseModel):
     node_id: Optional[UUID4] = None
     service_id: Optional[UUID4] = None
 
-    _was_updated: Optional[bool] = None
-
     @validator("allocated_resources")
     def validate_allocated_resources(cls, value: Any) -> Optional[ResourceData]:
         if value is None or value.is_complete():
@@ -77,7 +75,7 @@ class ServiceInstance(BaseModel):
         underscore_attrs_are_private = True
 
 
-class Service(BaseModel):
+class Service(TrackedModel):
     id: UUID4 = None
     executable: UUID4 = None
     status: ServiceStatus = ServiceStatus.ACTIVE
@@ -87,8 +85,6 @@ class Service(BaseModel):
     resource_floor: Optional[ResourceData] = ...
     instance_id: Optional[UUID4] = None
 
-    _was_updated: Optional[bool] = None
-
     @validator("resource_limit")
     def validate_resource_limit(cls, value: Any, values: dict[str, Any]) -> Optional[ResourceData]:
         return cls._check_resource_compatibility(value, values["status"], 'limit')
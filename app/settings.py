@@ -1,5 +1,52 @@
+from datetime import timedelta
+from typing import Optional
+
 from pydantic import BaseSettings
 
+from app.utils.typing import ChoicesEnum
+
+
+class SchedulingMode(str, ChoicesEnum):
+    # Scheduling loop runs in API process. With several API processes only the one holding advisory lock next to
+    # database schedules, writes made by the others are picked up from change log within scheduling_max_staleness
+    IN_PROCESS = "in_process"
+    # API process starts and stops dedicated scheduler worker process. With several API processes only one worker
+    # runs at a time: workers hold advisory lock next to database, the others start once its holder exits
+    WORKER = "worker"
+    EXTERNAL = "external"  # Scheduler worker is started separately through its own entry point
+
 
 class Settings(BaseSettings):
-    pass
+    database_path: str = "./sqlite.db"
+    database_journal_mode: str = "wal"
+    database_synchronous: str = "normal"
+    database_cache_size: int = -64 * 1024  # Negative value is size in KiB
+    database_mmap_size: int = 256 * 1024 * 1024
+    database_busy_timeout: timedelta = timedelta(seconds=5)
+    # GET endpoints are served with read-only connections
+    database_read_only_for_reads: bool = False
+    # Schemas loaded from database are validated (for debugging, stored rows are trusted otherwise)
+    validate_loaded_schemas: bool = False
+
+    # Time budget of placement optimizer which runs after resolvers, optimizer is disabled if not set
+    optimizer_time_budget: Optional[timedelta] = None
+
+    scheduling_mode: SchedulingMode = SchedulingMode.IN_PROCESS
+    # Writes coming within debounce window after the first one are resolved by single scheduling run
+    scheduling_debounce: timedelta = timedelta(milliseconds=200)
+    # Scheduling is run at least once per max staleness even if nothing triggers it
+    scheduling_max_staleness: timedelta = timedelta(seconds=10)
+    # How often scheduler worker checks change log for writes made by API processes
+    scheduling_poll_interval: timedelta = timedelta(milliseconds=50)
+    # CPU core scheduler worker process is pinned to, it is not pinned if not set
+    scheduler_worker_cpu: Optional[int] = None
+    # How often API process checks that scheduler worker process it started is alive, exited one is restarted
+    scheduler_worker_check_interval: timedelta = timedelta(seconds=1)
+
+    # How often cluster revision is checked while watch requests wait for changes
+    watch_poll_interval: timedelta = timedelta(milliseconds=100)
+    # Longest time watch request waits for changes before it is answered with unchanged data
+    watch_max_wait: timedelta = timedelta(seconds=60)
+
+
+settings = Settings()
@@ -1,11 +1,35 @@
 import pytest
 from fastapi.testclient import TestClient
-from peewee import Database, SqliteDatabase
+from peewee import Database
 
+from app.api.snapshots import read_snapshots
+from app.database import db
 from app.main import app
-from app.models import NodeModel, SchedulerLogModel, ServiceInstanceModel, ServiceModel
-
-MODELS = [NodeModel, ServiceModel, ServiceInstanceModel, SchedulerLogModel]
+from app.migrations import apply_migrations
+from app.models import (
+    ChangeLogModel,
+    MigrationModel,
+    NodeModel,
+    SchedulerLogModel,
+    ServiceInstanceModel,
+    ServiceModel,
+)
+from app.scheduler import Scheduler
+from app.scheduler.lock import get_scheduler_lock
+from app.scheduler.loop import scheduling_loop
+from app.settings import settings
+
+MODELS = [NodeModel, ServiceModel, ServiceInstanceModel, SchedulerLogModel, ChangeLogModel, MigrationModel]
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database_path(tmp_path_factory) -> str:
+    """Test database is kept in temporary directory instead of working tree"""
+    path = str(tmp_path_factory.mktemp("database") / "test.db")
+    settings.database_path = path
+    db.init(path, timeout=db._timeout)  # Pragmas are kept
+    scheduling_loop.lock = get_scheduler_lock()
+    return path
 
 
 @pytest.fixture
@@ -14,16 +38,24 @@ def test_client() -> TestClient:
 
 
 @pytest.fixture(autouse=True)
-def test_db(mocker) -> Database:
-    test_db = SqliteDatabase("./test.db")
-    test_db.bind(MODELS)
-    test_db.connect()
-    test_db.create_tables(MODELS)
+def test_db() -> Database:
+    apply_migrations(db)
+
+    yield db
+
+    db.drop_tables(MODELS)
+    db.close()
 
-    mocked_db = mocker.patch("app.database.db", autospec=True)
-    mocked_db.return_value = test_db
 
-    yield test_db
+@pytest.fixture(autouse=True)
+def scheduler_state():
+    Scheduler.reset_state()
+    yield
+    Scheduler.reset_state()
+
 
-    test_db.drop_tables(MODELS)
-    test_db.close()
+@pytest.fixture(autouse=True)
+def read_snapshot():
+    read_snapshots.reset()
+    yield
+    read_snapshots.reset()
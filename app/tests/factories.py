@@ -1,7 +1,8 @@
 import factory
 from pydantic import ByteSize
 
-from app.models import NodeModel, ServiceInstanceModel, ServiceModel
+from app.models import ChangeLogModel, NodeModel, ServiceInstanceModel, ServiceModel
+from app.schemas.changes import ChangedObjectType
 from app.schemas.nodes import NodeStatus
 from app.schemas.services import (
     ExecutionStatus,
@@ -19,7 +20,16 @@ class BaseModelFactory(factory.Factory):
         return model_class.create(**kwargs)
 
 
-class NodeFactory(BaseModelFactory):
+class ChangedModelFactory(BaseModelFactory):
+    """Factory of models tracked by ChangeLogModel. Pass was_updated=True to record change of created model"""
+
+    @factory.post_generation
+    def was_updated(obj, create, extracted, **kwargs):
+        if create and extracted:
+            ChangeLogModel.record(CHANGED_OBJECT_TYPES[type(obj)], [obj.id])
+
+
+class NodeFactory(ChangedModelFactory):
     id = factory.Faker("uuid4")
     status = NodeStatus.ACTIVE.value
 
@@ -31,7 +41,7 @@ class NodeFactory(BaseModelFactory):
         model = NodeModel
 
 
-class ServiceFactory(BaseModelFactory):
+class ServiceFactory(ChangedModelFactory):
     id = factory.Faker("uuid4")
     executable = factory.Faker("uuid4")
     status = ServiceStatus.ACTIVE.value
@@ -50,7 +60,7 @@ class ServiceFactory(BaseModelFactory):
         model = ServiceModel
 
 
-class ServiceInstanceFactory(BaseModelFactory):
+class ServiceInstanceFactory(ChangedModelFactory):
     id = factory.Faker("uuid4")
     executable = factory.Faker("uuid4")
     status = ServiceInstanceStatus.PLACED.value
@@ -66,3 +76,10 @@ class ServiceInstanceFactory(BaseModelFactory):
 
     class Meta:
         model = ServiceInstanceModel
+
+
+CHANGED_OBJECT_TYPES = {
+    NodeModel: ChangedObjectType.NODE,
+    ServiceModel: ChangedObjectType.SERVICE,
+    ServiceInstanceModel: ChangedObjectType.SERVICE_INSTANCE,
+}
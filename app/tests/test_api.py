@@ -1,11 +1,18 @@
 import json
 from datetime import timedelta
 from functools import partial
-from uuid import uuid4
+from threading import Timer
+from uuid import UUID, uuid4
 
 from funcy import lmap, omit
 
-from app.models import NodeModel, SchedulerLogModel, ServiceModel
+from app.api.nodes import _retrieve_assignments
+from app.api.snapshots import read_snapshots
+from app.database import db
+from app.models import ChangeLogModel, NodeModel, SchedulerLogModel, ServiceInstanceModel, ServiceModel
+from app.scheduler import Scheduler
+from app.scheduler.cluster import ClusterState
+from app.schemas.changes import ChangedObjectType
 from app.schemas.monitoring import SchedulerLog, SchedulerMetrics
 from app.schemas.nodes import NodeStatus
 from app.schemas.services import ExecutionStatus, ResourceStatus, ServiceInstanceStatus, ServiceStatus, ServiceType
@@ -63,6 +70,89 @@ class TestNodeCRUDAndListAPI:
         response = test_client.get("/api/nodes/")
         assert response.json()["data"] == lmap(_serialize_node_model, nodes)
 
+    def test_list_nodes_by_pages(self, test_client):
+        nodes = sorted(NodeFactory.create_batch(size=5), key=lambda obj: obj.id)
+
+        pages, params = [], {"limit": 2}
+        while "after" not in params or params["after"] is not None:
+            response = test_client.get("/api/nodes/", params=params)
+            pages.append(response.json()["data"])
+            params["after"] = response.json()["next_after"]
+
+        assert pages == [lmap(_serialize_node_model, nodes[i:i + 2]) for i in range(0, 5, 2)]
+
+    def test_list_nodes_filtered_by_status_with_sparse_fields(self, test_client):
+        node = NodeFactory.create()
+        NodeFactory.create(status=NodeStatus.DELETED.value, cpu_cores=None, ram=None, disk=None)
+
+        response = test_client.get("/api/nodes/", params={"status": "active", "fields": ["id", "status"]})
+
+        assert response.json()["data"] == [{"id": node.id, "status": NodeStatus.ACTIVE.value}]
+        assert test_client.get("/api/nodes/", params={"fields": ["cpu"]}).status_code == 422
+
+
+class TestNodeAssignmentsAPI:
+    def test_retrieve_node_assignments(self, test_client):
+        node, other_node = NodeFactory.create_batch(size=2)
+        placed_instance = ServiceInstanceFactory.create(host_node=node)
+        ServiceInstanceFactory.create(host_node=other_node)
+        ServiceInstanceFactory.create(
+            host_node=node, status=ServiceInstanceStatus.DELETED.value, execution_status=None, resource_status=None
+        )
+
+        response = test_client.get(f"/api/nodes/{node.id}/assignments/")
+
+        assert response.json()["data"] == [_serialize_service_instance_model(placed_instance, node_id=node.id)]
+        assert test_client.get(f"/api/nodes/{uuid4()}/assignments/").status_code == 404
+
+    def test_watch_answers_304_if_assignments_not_changed(self, test_client):
+        node = NodeFactory.create()
+        ServiceInstanceFactory.create(host_node=node)
+        etag = test_client.get(f"/api/nodes/{node.id}/assignments/").headers["ETag"]
+
+        NodeFactory.create(was_updated=True)  # Changes of other objects do not change assignments
+        response = test_client.get(
+            f"/api/nodes/{node.id}/assignments/?wait={timedelta(milliseconds=300)}", headers={"If-None-Match": etag}
+        )
+
+        assert response.status_code == 304
+
+    def test_watch_answers_when_assignments_change(self, test_client):
+        node = NodeFactory.create()
+        response = test_client.get(f"/api/nodes/{node.id}/assignments/")
+        etag = response.headers["ETag"]
+
+        timer = Timer(0.2, lambda: ServiceInstanceFactory.create(host_node=node, was_updated=True))
+        timer.start()
+        response = test_client.get(
+            f"/api/nodes/{node.id}/assignments/?wait={timedelta(seconds=10)}", headers={"If-None-Match": etag}
+        )
+        timer.join()
+
+        assert response.status_code == 200 and response.headers["ETag"] != etag
+        assert len(response.json()["data"]) == 1
+
+    def test_watch_does_not_reread_assignments_on_changes_of_other_nodes(self, test_client, mocker):
+        node, other_node = NodeFactory.create_batch(size=2)
+        etag = test_client.get(f"/api/nodes/{node.id}/assignments/").headers["ETag"]
+        retrieve_assignments = mocker.patch("app.api.nodes._retrieve_assignments", wraps=_retrieve_assignments)
+
+        timer = Timer(0.1, lambda: ServiceInstanceFactory.create(host_node=other_node, was_updated=True))
+        timer.start()
+        response = test_client.get(
+            f"/api/nodes/{node.id}/assignments/?wait={timedelta(milliseconds=500)}", headers={"If-None-Match": etag}
+        )
+        timer.join()
+
+        assert response.status_code == 304
+        assert retrieve_assignments.call_count == 1  # Only the initial read
+
+    def test_watch_400_without_if_none_match(self, test_client):
+        node = NodeFactory.create()
+        response = test_client.get(f"/api/nodes/{node.id}/assignments/?wait={timedelta(seconds=10)}")
+
+        assert response.status_code == 400
+
 
 class TestServiceCRUDAndListAPI:
     def test_create_service(self, test_client):
@@ -168,6 +258,106 @@ class TestServiceCRUDAndListAPI:
         response = test_client.get("/api/services/")
         assert response.json()["data"] == lmap(_serialize_service_model, services)
 
+    def test_list_services_filtered_by_type_and_priority_range(self, test_client):
+        service = ServiceFactory.create(type=ServiceType.STATEFUL.value, priority=10)
+        ServiceFactory.create(type=ServiceType.STATEFUL.value, priority=50)
+        ServiceFactory.create(type=ServiceType.STATELESS.value, priority=10)
+
+        response = test_client.get(
+            "/api/services/", params={"type": "stateful", "priority_from": 0, "priority_to": 10}
+        )
+
+        assert response.json()["data"] == [_serialize_service_model(service)]
+        assert response.json()["next_after"] is None
+
+    def test_instance_of_deleted_service_is_not_placed_again(self, test_client):
+        NodeFactory.create(was_updated=False)
+        service = ServiceFactory.create(was_updated=True)
+        Scheduler.run_scheduling()
+
+        test_client.delete(f"/api/services/{service.id}/")
+        Scheduler.run_scheduling()
+        Scheduler.reset_state()
+        Scheduler.run_scheduling()
+
+        instance = ServiceInstanceModel.get(service=service.id)
+        assert instance.status == ServiceInstanceStatus.DELETED.value
+        assert instance.host_node_id is None
+
+    def test_evicted_instance_of_deleted_service_is_not_placed_when_node_is_added(self, test_client):
+        service = ServiceFactory.create(was_updated=True)
+        Scheduler.run_scheduling()  # There are no nodes to place instance on
+
+        test_client.delete(f"/api/services/{service.id}/")
+        Scheduler.run_scheduling()
+        test_client.post("/api/nodes/", json={"node_resources": {"cpu_cores": 4.0, "ram": "16GiB", "disk": "1TiB"}})
+        Scheduler.run_scheduling()
+
+        instance = ServiceInstanceModel.get(service=service.id)
+        assert instance.status == ServiceInstanceStatus.DELETED.value
+        assert instance.host_node_id is None
+
+    def test_instance_of_reactivated_service_is_placed(self, test_client):
+        node = NodeFactory.create(was_updated=False)
+        service = ServiceFactory.create(was_updated=True)
+        Scheduler.run_scheduling()
+        test_client.delete(f"/api/services/{service.id}/")
+        Scheduler.run_scheduling()
+
+        resources = {"cpu_cores": 1.0, "ram": "1GiB", "disk": "10GiB"}
+        test_client.patch(
+            f"/api/services/{service.id}/", json={"resource_limit": resources, "resource_floor": resources}
+        )
+        Scheduler.run_scheduling()
+
+        instance = ServiceInstanceModel.get(service=service.id)
+        assert instance.status == ServiceInstanceStatus.PLACED.value
+        assert str(instance.host_node_id) == str(node.id)
+
+
+class TestReadSnapshot:
+    def test_reads_are_served_from_snapshot_until_revision_changes(self, test_client, mocker):
+        node = NodeFactory.create(was_updated=True)
+        test_client.get("/api/nodes/")
+
+        to_node_schema = mocker.spy(NodeModel, "_to_schema")
+        response = test_client.get(f"/api/nodes/{node.id}/")
+        assert response.json() == {"status": "OK", "data": _serialize_node_model(node)}
+        assert to_node_schema.call_count == 0
+
+        new_node = NodeFactory.create(was_updated=True)
+        response = test_client.get("/api/nodes/")
+        assert response.json()["data"] == lmap(_serialize_node_model, [node, new_node])
+        assert to_node_schema.call_count == 1  # Only changed node is loaded
+
+    def test_unchanged_objects_are_shared_with_previous_snapshot(self):
+        node, other_node, unchanged_node = NodeFactory.create_batch(size=3, was_updated=True)
+        instance = ServiceInstanceFactory.create(host_node=node, was_updated=True)
+        snapshot = read_snapshots.get()
+        serialized_node = snapshot.serialize(snapshot.nodes[UUID(unchanged_node.id)])
+
+        ServiceInstanceModel.update(host_node=other_node.id).where(ServiceInstanceModel.id == instance.id).execute()
+        ChangeLogModel.record(ChangedObjectType.SERVICE_INSTANCE, [UUID(instance.id)])
+        new_snapshot = read_snapshots.get()
+
+        assert snapshot.nodes[UUID(node.id)].instance_ids == [UUID(instance.id)]  # Published snapshot is not changed
+        assert new_snapshot.nodes[UUID(node.id)].instance_ids == []
+        assert new_snapshot.nodes[UUID(other_node.id)].instance_ids == [UUID(instance.id)]
+        assert new_snapshot.service_instances[UUID(instance.id)].node_id == UUID(other_node.id)
+        assert new_snapshot.nodes[UUID(unchanged_node.id)] is snapshot.nodes[UUID(unchanged_node.id)]
+        assert new_snapshot.serialize(new_snapshot.nodes[UUID(unchanged_node.id)]) is serialized_node
+
+    def test_snapshot_is_loaded_without_scheduler_state(self, mocker):
+        node, service = NodeFactory.create(), ServiceFactory.create()
+        instance = ServiceInstanceFactory.create(host_node=node, service=service)
+        load_state = mocker.spy(ClusterState, "_load_state")
+
+        snapshot = read_snapshots.get()
+
+        assert load_state.call_count == 0
+        assert snapshot.nodes[UUID(node.id)].instance_ids == [UUID(instance.id)]
+        assert snapshot.services[UUID(service.id)].instance_id == UUID(instance.id)
+
 
 class TestMonitoringAPI:
     def test_retrieve_cluster_state(self, test_client):
@@ -179,11 +369,42 @@ class TestMonitoringAPI:
 
         assert response.json() == {
             "status": "OK",
+            "revision": 0,
             "nodes": lmap(partial(_serialize_node_model, instance_ids=[]), nodes),
             "services": lmap(_serialize_service_model, services),
             "service_instances": lmap(_serialize_service_instance_model, service_instances),
         }
 
+    def test_retrieve_cluster_state_changed_since_revision(self, test_client):
+        node = NodeFactory.create(was_updated=True)
+        service = ServiceFactory.create(was_updated=True)
+        Scheduler.run_scheduling()
+        revision = test_client.get("/api/monitoring/state/").json()["revision"]
+
+        new_node = NodeFactory.create(was_updated=True)
+        response = test_client.get(f"/api/monitoring/state/?since={revision}")
+
+        assert response.json()["revision"] == ChangeLogModel.last_seq() > revision
+        assert [obj["id"] for obj in response.json()["nodes"]] == [new_node.id]
+        assert response.json()["services"] == response.json()["service_instances"] == []
+
+        response = test_client.get("/api/monitoring/state/?since=0")
+
+        instance = ServiceInstanceModel.get(service=service.id)
+        assert {obj["id"] for obj in response.json()["nodes"]} == {node.id, new_node.id}
+        assert [obj["instance_id"] for obj in response.json()["services"]] == [str(instance.id)]
+        assert [obj["id"] for obj in response.json()["service_instances"]] == [str(instance.id)]
+
+    def test_retrieve_cluster_state_304_if_not_changed(self, test_client):
+        NodeFactory.create(was_updated=True)
+        etag = test_client.get("/api/monitoring/state/").headers["ETag"]
+
+        assert test_client.get("/api/monitoring/state/", headers={"If-None-Match": etag}).status_code == 304
+
+        NodeFactory.create(was_updated=True)
+        response = test_client.get("/api/monitoring/state/", headers={"If-None-Match": etag})
+        assert response.status_code == 200 and response.headers["ETag"] != etag
+
     def test_retrieve_metrics(self, test_client):
         logs = self._create_logs()
         response = test_client.get("/api/monitoring/metrics/")
@@ -199,6 +420,31 @@ class TestMonitoringAPI:
         response = test_client.get(f"/api/monitoring/metrics/?duration={timedelta(minutes=1)}")
         assert response.json()["data"] == [json.loads(log.json()) for log in logs]
 
+    def test_stream_metrics(self, test_client, mocker):
+        mocker.patch("app.api.streaming.STREAM_CHUNK_SIZE", 2)
+        logs = self._create_logs()
+
+        response = test_client.get(
+            f"/api/monitoring/metrics/?from={logs[0].timestamp}", headers={"Accept": "application/x-ndjson"}
+        )
+
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert lmap(json.loads, response.text.splitlines()) == [json.loads(log.json()) for log in logs[1:]]
+
+    def test_stream_cluster_state(self, test_client):
+        NodeFactory.create_batch(size=2, was_updated=True)
+        ServiceInstanceFactory.create(service=ServiceFactory.create(was_updated=True), was_updated=True)
+        state = test_client.get("/api/monitoring/state/").json()
+
+        response = test_client.get("/api/monitoring/state/", headers={"Accept": "application/x-ndjson"})
+
+        revision, *objects = lmap(json.loads, response.text.splitlines())
+        assert revision == {"revision": state["revision"]}
+        object_types = {"services": "service", "service_instances": "service_instance", "nodes": "node"}
+        assert objects == [
+            {"type": object_type, "data": obj} for key, object_type in object_types.items() for obj in state[key]
+        ]
+
     @staticmethod
     def _create_logs():
         logs = []
@@ -248,6 +494,151 @@ class TestEventsAPI:
         )
         assert response.status_code == 422
 
+    def test_event_updates_only_its_column_without_retrieving_row(self, test_client, mocker):
+        service_instance = ServiceInstanceFactory.create(resource_status=ResourceStatus.CONSTRAINT_BY_RAM.value)
+        ServiceInstanceModel.update(cpu_cores=2.0).where(ServiceInstanceModel.id == service_instance.id).execute()
+        retrieve_schemas = mocker.spy(ServiceInstanceModel, "retrieve_schemas")
+        response = test_client.post(
+            "/api/events/service-instances/",
+            json={"instance_id": service_instance.id, "execution_status": ExecutionStatus.RUNNING.value},
+        )
+
+        assert response.status_code == 200
+        assert retrieve_schemas.call_count == 0
+        model = ServiceInstanceModel.get(id=service_instance.id)
+        assert model.execution_status == ExecutionStatus.RUNNING.value
+        assert model.resource_status == ResourceStatus.CONSTRAINT_BY_RAM.value
+        assert model.cpu_cores == 2.0
+
+    def test_node_event_404_if_not_found(self, test_client):
+        response = test_client.post(
+            "/api/events/nodes/", json={"node_id": str(uuid4()), "updated_status": NodeStatus.ACTIVE.value}
+        )
+        assert response.status_code == 404
+
+    def test_service_instance_event_404_if_not_found(self, test_client):
+        response = test_client.post("/api/events/service-instances/", json={"instance_id": str(uuid4())})
+        assert response.status_code == 404
+
+    def test_service_instance_event_403_if_not_placed(self, test_client):
+        service_instance = ServiceInstanceFactory.create(
+            status=ServiceInstanceStatus.EVICTED.value, execution_status=None, resource_status=None
+        )
+        response = test_client.post(
+            "/api/events/service-instances/",
+            json={"instance_id": service_instance.id, "execution_status": ExecutionStatus.RUNNING.value},
+        )
+
+        assert response.status_code == 403
+        assert ServiceInstanceModel.get(id=service_instance.id).execution_status is None
+
+
+class TestEventsBatchAPI:
+    def test_events_are_applied_with_per_item_status(self, test_client):
+        node = NodeFactory.create()
+        deleted_node = NodeFactory.create(status=NodeStatus.DELETED.value, cpu_cores=None, ram=None, disk=None)
+        service_instance = ServiceInstanceFactory.create()
+        response = test_client.post(
+            "/api/events/batch/",
+            json={
+                "node_events": [
+                    {"node_id": node.id, "updated_status": NodeStatus.FAILED.value},
+                    {"node_id": deleted_node.id, "updated_status": NodeStatus.ACTIVE.value},
+                    {"node_id": str(uuid4()), "updated_status": NodeStatus.ACTIVE.value},
+                ],
+                "service_instance_events": [
+                    {"instance_id": service_instance.id, "execution_status": ExecutionStatus.RUNNING.value},
+                ],
+            },
+        )
+
+        assert response.status_code == 200
+        assert lmap(lambda result: result["status_code"], response.json()["node_events"]) == [200, 403, 404]
+        assert response.json()["service_instance_events"] == [{"status_code": 200, "detail": None}]
+        assert NodeModel.get(id=node.id).status == NodeStatus.FAILED.value
+        assert NodeModel.get(id=deleted_node.id).status == NodeStatus.DELETED.value
+        assert ServiceInstanceModel.get(id=service_instance.id).execution_status == ExecutionStatus.RUNNING.value
+        assert sorted(_retrieve_changes()) == sorted(
+            [(ChangedObjectType.NODE.value, node.id), (ChangedObjectType.SERVICE_INSTANCE.value, service_instance.id)]
+        )
+
+    def test_referenced_objects_are_loaded_with_one_query_per_type(self, test_client, mocker):
+        nodes = NodeFactory.create_batch(10)
+        retrieve_schemas = mocker.spy(NodeModel, "retrieve_schemas")
+        response = test_client.post(
+            "/api/events/batch/",
+            json={"node_events": [{"node_id": node.id, "updated_status": NodeStatus.FAILED.value} for node in nodes]},
+        )
+
+        assert response.status_code == 200
+        assert retrieve_schemas.call_count == 1
+        assert all(node.status == NodeStatus.FAILED for node in NodeModel.retrieve_schemas())
+
+    def test_batch_is_validated_together(self, test_client):
+        node = NodeFactory.create()
+        response = test_client.post(
+            "/api/events/batch/",
+            json={
+                "node_events": [
+                    {"node_id": node.id, "updated_status": NodeStatus.FAILED.value},
+                    {"node_id": node.id, "updated_status": NodeStatus.DELETED.value},
+                ]
+            },
+        )
+
+        assert response.status_code == 422
+        assert NodeModel.get(id=node.id).status == NodeStatus.ACTIVE.value
+
+    def test_write_lock_is_taken_before_objects_are_loaded(self, test_client, mocker):
+        node = NodeFactory.create()
+        atomic = mocker.spy(db, "atomic")
+        response = test_client.post(
+            "/api/events/batch/", json={"node_events": [{"node_id": node.id, "updated_status": "failed"}]}
+        )
+
+        assert response.status_code == 200
+        atomic.assert_called_once_with(lock_type="IMMEDIATE")
+
+
+class TestChangeLogAPI:
+    def test_node_changes_are_recorded(self, test_client):
+        response = test_client.post(
+            "/api/nodes/",
+            json={"node_resources": {"cpu_cores": 4.0, "ram": "16GiB", "disk": "1TiB"}},
+        )
+        test_client.delete(f"/api/nodes/{response.json()['data']['id']}/")
+
+        assert _retrieve_changes() == [(ChangedObjectType.NODE.value, response.json()["data"]["id"])] * 2
+
+    def test_service_changes_are_recorded(self, test_client):
+        service = ServiceFactory.create()
+        test_client.patch(f"/api/services/{service.id}/", json={"priority": 1})
+
+        assert _retrieve_changes() == [(ChangedObjectType.SERVICE.value, service.id)]
+
+    def test_service_instance_event_is_recorded(self, test_client):
+        service_instance = ServiceInstanceFactory.create()
+        test_client.post(
+            "/api/events/service-instances/",
+            json={"instance_id": service_instance.id, "execution_status": ExecutionStatus.RUNNING},
+        )
+
+        assert _retrieve_changes() == [(ChangedObjectType.SERVICE_INSTANCE.value, service_instance.id)]
+
+    def test_rejected_event_is_not_recorded(self, test_client):
+        node = NodeFactory.create(status=NodeStatus.DELETED.value, cpu_cores=None, ram=None, disk=None)
+        response = test_client.post(
+            "/api/events/nodes/", json={"node_id": node.id, "updated_status": NodeStatus.ACTIVE.value}
+        )
+
+        assert response.status_code == 403
+        assert _retrieve_changes() == []
+
+
+def _retrieve_changes():
+    query = ChangeLogModel.select(ChangeLogModel.object_type, ChangeLogModel.object_id).order_by(ChangeLogModel.seq)
+    return [(object_type, str(object_id)) for object_type, object_id in query.tuples()]
+
 
 def _serialize_node_model(node_model, **kwargs):
     return {
@@ -303,3 +694,16 @@ def _serialize_service_instance_model(service_instance_model, **kwargs):
         "node_id": None,
         "service_id": None,
     } | kwargs
+
+
+class TestSchedulingTrigger:
+    def test_successful_write_triggers_scheduling(self, test_client, mocker):
+        trigger = mocker.patch("app.api.dependencies.scheduling_loop.trigger")
+        test_client.post("/api/nodes/", json={"node_resources": {"cpu_cores": 4.0, "ram": "16GiB", "disk": "1TiB"}})
+        trigger.assert_called_once()
+
+    def test_reads_and_failed_writes_do_not_trigger_scheduling(self, test_client, mocker):
+        trigger = mocker.patch("app.api.dependencies.scheduling_loop.trigger")
+        test_client.get("/api/nodes/")
+        test_client.delete(f"/api/nodes/{uuid4()}/")
+        trigger.assert_not_called()
@@ -1,4 +1,15 @@
-from app.models import ServiceInstanceModel
+from datetime import datetime
+
+import pytest
+from peewee import OperationalError, SqliteDatabase, fn
+from pydantic import ValidationError
+from playhouse.migrate import SqliteMigrator, migrate
+
+from app.database import db
+from app.migrations import apply_migrations, migrations
+from app.models import ChangeLogModel, MigrationModel, NodeModel, SchedulerLogModel, ServiceInstanceModel, ServiceModel
+from app.schemas.nodes import NodeStatus
+from app.settings import settings
 
 from .factories import NodeFactory, ServiceFactory, ServiceInstanceFactory
 
@@ -16,3 +27,140 @@ class TestForeignKeys:
         assert service_instances_s
         assert str(service_instances_s[0].service_id) == service_1.id and str(service_instances_s[0].node_id) == node.id
         assert str(service_instances_s[1].service_id) == service_2.id and str(service_instances_s[1].node_id) == node.id
+
+
+class TestChangesSynchronization:
+    def test_only_changed_columns_are_written(self):
+        node_model = NodeFactory.create()
+        node = NodeModel.retrieve_schema(node_model.id)
+        NodeModel.update(cpu_cores=1.0).where(NodeModel.id == node_model.id).execute()  # Concurrent write
+
+        node.status = NodeStatus.FAILED
+        NodeModel.synchronize_changes([node])
+
+        updated_node = NodeModel.get(id=node_model.id)
+        assert updated_node.status == NodeStatus.FAILED.value
+        assert updated_node.cpu_cores == 1.0  # Not changed column is not overwritten
+        assert not node.changed_fields()
+
+    def test_schemas_without_changes_are_not_written(self, mocker):
+        node = NodeModel.retrieve_schema(NodeFactory.create().id)
+        bulk_update = mocker.spy(NodeModel, "bulk_update")
+
+        assert NodeModel.synchronize_changes([node]) == 0
+        assert bulk_update.call_count == 0
+
+    def test_concurrently_updated_schemas_are_detected(self):
+        updated, not_updated, not_changed = (NodeModel.retrieve_schema(NodeFactory.create().id) for _ in range(3))
+        for node in (updated, not_changed):
+            NodeModel.update_columns_where(str(node.id), {"cpu_cores": 1.0})  # Concurrent write
+
+        for node in (updated, not_updated):
+            node.status = NodeStatus.FAILED
+
+        assert NodeModel.retrieve_updated_ids([updated, not_updated, not_changed]) == {updated.id}
+
+
+class TestSchemaLoading:
+    @pytest.mark.parametrize("model", [NodeModel, ServiceModel, ServiceInstanceModel])
+    def test_loaded_schemas_match_validated_ones(self, model, mocker):
+        ServiceInstanceFactory.create(service=ServiceFactory.create(), host_node=NodeFactory.create())
+        NodeFactory.create(status=NodeStatus.DELETED.value, cpu_cores=None, ram=None, disk=None)
+
+        schemas = model.retrieve_schemas()
+        mocker.patch.object(settings, "validate_loaded_schemas", True)
+        validated_schemas = model.retrieve_schemas()
+
+        assert [obj.dict() for obj in schemas] == [obj.dict() for obj in validated_schemas]
+
+    def test_invalid_rows_are_detected_only_when_validation_is_enabled(self, mocker):
+        NodeFactory.create(cpu_cores=None)  # Resources of active node must be complete
+        NodeModel.retrieve_schemas()
+
+        mocker.patch.object(settings, "validate_loaded_schemas", True)
+        with pytest.raises(ValidationError):
+            NodeModel.retrieve_schemas()
+
+
+class TestDatabaseConnections:
+    def test_pragmas_are_set_on_connection(self):
+        assert db.execute_sql("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert db.execute_sql("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+    def test_read_only_connection_scope_does_not_allow_writes(self):
+        node = NodeFactory.create()
+
+        with db.connection_scope(read_only=True):
+            assert str(NodeModel.retrieve_schema(node.id).id) == node.id
+            with pytest.raises(OperationalError):
+                NodeFactory.create()
+
+        assert db.is_closed()
+        NodeFactory.create()  # Connection opened afterwards is writable again
+
+
+class TestMigrations:
+    def test_migrations_are_applied_once(self):
+        assert [obj.name for obj in MigrationModel.select()] == [name for name, _ in migrations]
+        assert apply_migrations(db) == []
+
+    def test_columns_are_added_to_tables_created_before_migrations(self):
+        migrate(SqliteMigrator(db).drop_column("nodemodel", "version"))
+        MigrationModel.delete().execute()
+
+        assert apply_migrations(db) == [name for name, _ in migrations]
+        assert "version" in {obj.name for obj in db.get_columns("nodemodel")}
+
+    def test_migrated_schema_matches_models(self):
+        models = [NodeModel, ServiceModel, ServiceInstanceModel, SchedulerLogModel, ChangeLogModel]
+        models_db = SqliteDatabase(":memory:")
+        with models_db.bind_ctx(models):
+            models_db.create_tables(models)
+
+        for model in models:
+            table = model._meta.table_name
+            assert {
+                (obj.name, obj.data_type, obj.null, obj.primary_key) for obj in db.get_columns(table)
+            } == {(obj.name, obj.data_type, obj.null, obj.primary_key) for obj in models_db.get_columns(table)}
+            assert {obj.name for obj in models_db.get_indexes(table)} <= {obj.name for obj in db.get_indexes(table)}
+
+
+class TestQueryPlans:
+    @staticmethod
+    def _get_query_plan(query) -> str:
+        sql, params = query.sql()
+        return " ".join(row[-1] for row in db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params))
+
+    @pytest.mark.parametrize(
+        "get_query, index_name",
+        [
+            (
+                lambda: SchedulerLogModel.select().where(SchedulerLogModel.timestamp > datetime.now()),
+                "schedulerlogmodel_timestamp",
+            ),
+            (lambda: SchedulerLogModel.select(fn.MAX(SchedulerLogModel.change_seq)), "schedulerlogmodel_change_seq"),
+            (
+                lambda: ServiceInstanceModel.select().where(ServiceInstanceModel.host_node == "node_id"),
+                "serviceinstancemodel_host_node_id",
+            ),
+            (
+                lambda: ServiceInstanceModel.select().where(
+                    ServiceInstanceModel.host_node == "node_id", ServiceInstanceModel.status == "placed"
+                ),
+                "serviceinstancemodel_placed_host_node_id",
+            ),
+            (
+                lambda: NodeModel.select()
+                .where(NodeModel.status == "active", NodeModel.id > "node_id")
+                .order_by(NodeModel.id)
+                .limit(10),
+                "nodemodel_status_id",
+            ),
+            (
+                lambda: ChangeLogModel.select().where(ChangeLogModel.seq > 0, ChangeLogModel.source == "api"),
+                "changelogmodel_source",
+            ),
+        ],
+    )
+    def test_queries_use_indexes(self, get_query, index_name):
+        assert index_name in self._get_query_plan(get_query())
@@ -1,10 +1,27 @@
+import asyncio
+from datetime import timedelta
+from uuid import UUID, uuid4
+
+import pytest
 from funcy import first
 
-from app.models import NodeModel, ServiceInstanceModel, ServiceModel
+from app.models import ChangeLogModel, NodeModel, SchedulerLogModel, ServiceInstanceModel, ServiceModel
 from app.scheduler import Scheduler
+from app.scheduler.capacity import BestFitIndex, CapacityMatrix
+from app.scheduler.eviction import EvictionCandidates
+from app.scheduler.lock import SchedulerLock
+from app.scheduler.loop import SchedulingLoop
+from app.scheduler.optimizer import PlacementOptimizer
+from app.scheduler.packing import PendingInstance, first_fit_decreasing_order
+from app.scheduler.resources import ResourceVector
+from app.scheduler.steps import NodeUpdatesResolver, ServiceInstanceUpdatesResolver
+from app.scheduler.worker import ChangeLogWatcher, WorkerSupervisor
+from app.schemas.changes import ChangedObjectType, ChangeSource
 from app.schemas.helpers import ResourceData, base_allocated_resources, increase_resource_step_kwargs
+from app.schemas.monitoring import TrackedAction, TrackedObjects
 from app.schemas.nodes import NodeStatus
-from app.schemas.services import ResourceStatus, ServiceInstanceStatus, ServiceType
+from app.schemas.services import ExecutionStatus, ResourceStatus, Service, ServiceInstance, ServiceInstanceStatus, ServiceType
+from app.utils.exceptions import SchedulingError
 
 from .factories import NodeFactory, ServiceFactory, ServiceInstanceFactory
 
@@ -294,3 +311,750 @@ class TestServiceCreation:
         assert preempted_instance.node_id is None
         assert str(important_instance.node_id) == str(node.id)
         assert important_instance.allocated_resources == expected_resources
+
+    def test_instance_exceeding_lowered_limit_is_shrunk(self, test_client):
+        """
+        If there is an active service with running instance which allocation exceeds service limit,
+        when allocation will be shrunk to comply with limit on the same node.
+        """
+        node = NodeFactory.create(was_updated=False)
+        service = ServiceFactory.create(was_updated=False)  # 1 cpu core limit by default
+        ServiceInstanceFactory.create(
+            was_updated=True,
+            service=service,
+            host_node=node,
+            **(base_allocated_resources.dict() | {"cpu_cores": 2.0}),
+        )
+
+        Scheduler.run_scheduling()
+
+        instance = first(ServiceInstanceModel.retrieve_schemas())
+        assert str(instance.node_id) == str(node.id)
+        assert instance.allocated_resources == base_allocated_resources
+
+
+class TestResourceVector:
+    def test_conversion_to_and_from_resource_data(self):
+        data = ResourceData(cpu_cores=1.5, ram="3GiB", disk="1TiB")
+        vector = ResourceVector.from_data(data)
+
+        assert (vector.cpu, vector.ram, vector.disk) == (15, 3 * 1024**3, 1024**4)
+        assert vector.to_data() == data
+
+    def test_in_place_operations_keep_object(self):
+        vector, other = ResourceVector(cpu=10, ram=20, disk=30), ResourceVector(cpu=1, ram=2, disk=3)
+        result = vector
+        result += other
+        result -= other
+        result -= other
+
+        assert result is vector
+        assert vector == ResourceVector(cpu=9, ram=18, disk=27)
+
+    def test_fits(self):
+        assert ResourceVector(cpu=2, ram=2, disk=2).fits(ResourceVector(cpu=2, ram=1, disk=0))
+        assert not ResourceVector(cpu=2, ram=2, disk=2).fits(ResourceVector(cpu=3, ram=1, disk=0))
+
+    def test_get_compliant_matches_resource_data(self):
+        allocated = ResourceData(cpu_cores=4.0, ram="8GiB", disk="10GiB")
+        limit = ResourceData(cpu_cores=2.0, ram=None, disk="5GiB")
+        floor = ResourceData(cpu_cores=1.0, ram="1GiB", disk="20GiB")
+
+        compliant = ResourceVector.from_data(allocated).get_compliant(
+            ResourceVector.from_data(limit), ResourceVector.from_data(floor)
+        )
+
+        assert compliant.to_data() == allocated.get_compliant(limit, floor)
+
+
+class TestCapacityMatrix:
+    def test_only_enabled_nodes_with_enough_resources_fit(self):
+        capacity = CapacityMatrix()
+        small, big, disabled = uuid4(), uuid4(), uuid4()
+        capacity.set(small, ResourceVector(cpu=10, ram=10, disk=10))
+        capacity.set(big, ResourceVector(cpu=20, ram=20, disk=20))
+        capacity.set(disabled, ResourceVector(cpu=20, ram=20, disk=20), enabled=False)
+
+        assert capacity.fitting_nodes_ids(ResourceVector(cpu=5, ram=5, disk=5)) == [small, big]
+        assert capacity.fitting_nodes_ids(ResourceVector(cpu=15, ram=5, disk=5)) == [big]
+
+    def test_free_resources_are_updated_in_place(self):
+        capacity = CapacityMatrix()
+        node_id = uuid4()
+        capacity.set(node_id, ResourceVector(cpu=10, ram=10, disk=10))
+
+        capacity.subtract(node_id, ResourceVector(cpu=5, ram=0, disk=0))
+        assert capacity.fitting_nodes_ids(ResourceVector(cpu=6, ram=0, disk=0)) == []
+
+        capacity.add(node_id, ResourceVector(cpu=1, ram=0, disk=0))
+        assert capacity.fitting_nodes_ids(ResourceVector(cpu=6, ram=0, disk=0)) == [node_id]
+
+    def test_storage_grows_with_nodes(self):
+        capacity = CapacityMatrix()
+        nodes_ids = [uuid4() for _ in range(CapacityMatrix.initial_capacity * 2 + 1)]
+        for node_id in nodes_ids:
+            capacity.set(node_id, ResourceVector(cpu=1, ram=1, disk=1))
+
+        assert capacity.fitting_nodes_ids(ResourceVector()) == nodes_ids
+
+
+class TestBestFitIndex:
+    def test_tightest_fitting_node_is_chosen(self):
+        index = BestFitIndex()
+        big, tight, too_small = uuid4(), uuid4(), uuid4()
+        index.set(big, ResourceVector(cpu=100, ram=100, disk=100))
+        index.set(tight, ResourceVector(cpu=20, ram=100, disk=100))
+        index.set(too_small, ResourceVector(cpu=5, ram=100, disk=100))
+
+        assert index.best_fit(ResourceVector(cpu=10, ram=10, disk=10)) == tight
+
+    def test_other_resource_types_are_checked(self):
+        index = BestFitIndex()
+        big, no_disk = uuid4(), uuid4()
+        index.set(big, ResourceVector(cpu=100, ram=100, disk=100))
+        index.set(no_disk, ResourceVector(cpu=20, ram=100, disk=0))
+
+        assert index.best_fit(ResourceVector(cpu=10, ram=10, disk=10)) == big
+
+    def test_index_is_updated_incrementally(self):
+        index = BestFitIndex()
+        node_id = uuid4()
+        index.set(node_id, ResourceVector(cpu=20, ram=20, disk=20))
+
+        index.update(node_id, ResourceVector(cpu=5, ram=20, disk=20))
+        assert index.best_fit(ResourceVector(cpu=10, ram=10, disk=10)) is None
+
+        index.remove(node_id)
+        index.update(node_id, ResourceVector(cpu=20, ram=20, disk=20))  # Removed nodes are not updated
+        assert index.best_fit(ResourceVector(cpu=10, ram=10, disk=10)) is None
+
+    def test_fitting_nodes_are_filtered_at_once_if_scan_is_exceeded(self, mocker):
+        index, capacity = BestFitIndex(), CapacityMatrix()
+        nodes_resources = {}
+        for _ in range(BestFitIndex.max_checked_nodes):  # Enough of the scarcest resource, but no disk
+            nodes_resources[uuid4()] = ResourceVector(cpu=20, ram=100, disk=0)
+        for _ in range(BestFitIndex.max_checked_nodes + 1):  # Not enough cpu, so cpu is the scarcest
+            nodes_resources[uuid4()] = ResourceVector(cpu=5, ram=100, disk=100)
+        big, bigger = uuid4(), uuid4()
+        nodes_resources[big] = ResourceVector(cpu=30, ram=100, disk=100)
+        nodes_resources[bigger] = ResourceVector(cpu=40, ram=100, disk=100)
+        for node_id, free in nodes_resources.items():
+            index.set(node_id, free)
+            capacity.set(node_id, free)
+        fitting_nodes_ids = mocker.spy(capacity, "fitting_nodes_ids")
+
+        required = ResourceVector(cpu=10, ram=100, disk=10)
+        assert index.best_fit(required, capacity.fitting_nodes_ids) == big == index.best_fit(required)
+        assert fitting_nodes_ids.call_count == 1
+
+    def test_instance_is_placed_on_tightest_node(self):
+        NodeFactory.create(was_updated=False)  # Enough resources for many instances
+        tight = NodeFactory.create(was_updated=False, **(base_allocated_resources.dict()))
+        ServiceFactory.create(was_updated=True)
+
+        Scheduler.run_scheduling()
+
+        instance = first(ServiceInstanceModel.retrieve_schemas())
+        assert str(instance.node_id) == str(tight.id)
+
+
+class TestEvictionCandidates:
+    def test_minimal_set_of_lowest_priority_candidates_is_evicted(self):
+        candidates = EvictionCandidates()
+        lowest, low, high = uuid4(), uuid4(), uuid4()
+        candidates.add(high, 50, ResourceVector(cpu=10, ram=10, disk=10))
+        candidates.add(low, 20, ResourceVector(cpu=10, ram=10, disk=10))
+        candidates.add(lowest, 10, ResourceVector(cpu=10, ram=0, disk=10))
+
+        count = candidates.count_below(50)
+        assert count == 2
+        assert candidates.minimal_eviction_size(count, ResourceVector(cpu=5, ram=0, disk=-5)) == 1
+        assert candidates.minimal_eviction_size(count, ResourceVector(cpu=5, ram=5, disk=0)) == 2
+        assert candidates.minimal_eviction_size(count, ResourceVector(cpu=25, ram=0, disk=0)) is None
+        assert candidates.instance_ids(2) == [lowest, low]
+
+    def test_removed_candidates_are_not_evicted(self):
+        candidates = EvictionCandidates()
+        removed, kept = uuid4(), uuid4()
+        candidates.add(removed, 10, ResourceVector(cpu=10, ram=10, disk=10))
+        candidates.add(kept, 20, ResourceVector(cpu=5, ram=5, disk=5))
+        candidates.prefix_sums()
+
+        candidates.remove(removed)
+
+        assert candidates.minimal_eviction_size(len(candidates), ResourceVector(cpu=10, ram=0, disk=0)) is None
+        assert candidates.instance_ids() == [kept]
+
+    def test_cheapest_set_of_candidates_is_evicted(self):
+        candidates = EvictionCandidates()
+        large, small, other_small = uuid4(), uuid4(), uuid4()
+        candidates.add(large, 10, ResourceVector(cpu=20, ram=20, disk=20), cost=16.0)
+        candidates.add(small, 20, ResourceVector(cpu=10, ram=10, disk=10), cost=1.0)
+        candidates.add(other_small, 30, ResourceVector(cpu=10, ram=10, disk=10), cost=1.0)
+
+        cost, instance_ids = candidates.cheapest_eviction(3, ResourceVector(cpu=20, ram=5, disk=0))
+
+        assert cost == 2.0
+        assert set(instance_ids) == {small, other_small}
+        assert candidates.cheapest_eviction(1, ResourceVector(cpu=20, ram=5, disk=0)) == (16.0, [large])
+        assert candidates.cheapest_eviction(3, ResourceVector(cpu=50, ram=0, disk=0)) is None
+
+    def test_node_with_least_disruptive_eviction_is_chosen(self):
+        fragile_node, stateless_node = (
+            NodeFactory.create(was_updated=False, **(base_allocated_resources.dict())) for _ in range(2)
+        )
+        fragile = ServiceFactory.create(was_updated=False, type=ServiceType.FRAGILE.value, priority=10)
+        stateless = ServiceFactory.create(was_updated=False, priority=10)
+        ServiceInstanceFactory.create(was_updated=False, service=fragile, host_node=fragile_node)
+        ServiceInstanceFactory.create(was_updated=False, service=stateless, host_node=stateless_node)
+        ServiceFactory.create(was_updated=True, type=ServiceType.STATEFUL.value)
+
+        Scheduler.run_scheduling()
+
+        fragile_instance = first(
+            ServiceInstanceModel.retrieve_schemas_where(ServiceInstanceModel.service_id == fragile.id)
+        )
+        assert str(fragile_instance.node_id) == str(fragile_node.id)
+        metrics = first(SchedulerLogModel.retrieve_schemas()).metrics
+        assert TrackedAction.FRAGILE_EVICTION not in metrics.actions_counter
+
+    def test_instance_with_lowest_priority_is_preempted(self):
+        node = NodeFactory.create(  # Enough resources for two instances
+            was_updated=False, **(base_allocated_resources + base_allocated_resources).dict()
+        )
+        low = ServiceFactory.create(was_updated=False, priority=20)
+        lowest = ServiceFactory.create(was_updated=False, priority=10)
+        ServiceInstanceFactory.create(was_updated=False, service=low, host_node=node)
+        ServiceInstanceFactory.create(was_updated=False, service=lowest, host_node=node)
+        ServiceFactory.create(was_updated=True, priority=99)
+
+        Scheduler.run_scheduling()
+
+        low_instance, lowest_instance = (
+            first(ServiceInstanceModel.retrieve_schemas_where(ServiceInstanceModel.service_id == service.id))
+            for service in (low, lowest)
+        )
+        assert str(low_instance.node_id) == str(node.id)
+        assert lowest_instance.node_id is None
+
+
+class TestBatchPacking:
+    def test_pending_instances_are_ordered_by_dominant_share(self):
+        total = ResourceVector(cpu=100, ram=100, disk=100)
+        resources = ResourceData(**increase_resource_step_kwargs)
+        services = [
+            Service(type=service_type, priority=priority, resource_limit=resources, resource_floor=resources)
+            for service_type, priority in (
+                (ServiceType.STATELESS, 10), (ServiceType.STATELESS, 50), (ServiceType.STATEFUL, 10)
+            )
+        ]
+        small, large_low, large_high, large_stateful = (
+            PendingInstance(ServiceInstance(), services[0], ResourceVector(cpu=10, ram=10, disk=10)),
+            PendingInstance(ServiceInstance(), services[0], ResourceVector(cpu=10, ram=50, disk=10)),
+            PendingInstance(ServiceInstance(), services[1], ResourceVector(cpu=50, ram=10, disk=10)),
+            PendingInstance(ServiceInstance(), services[2], ResourceVector(cpu=10, ram=10, disk=50)),
+        )
+
+        ordered = first_fit_decreasing_order([small, large_low, large_stateful, large_high], total)
+
+        assert ordered == [large_high, large_stateful, large_low, small]
+
+    def test_evicted_instances_are_packed_largest_first(self):
+        NodeFactory.create(was_updated=False, cpu_cores=3.0)
+        NodeFactory.create(was_updated=False, cpu_cores=2.0)
+        ServiceFactory.create(was_updated=True, cpu_cores_limit=1.0, cpu_cores_floor=1.0)
+        for _ in range(2):
+            ServiceFactory.create(was_updated=True, cpu_cores_limit=2.0, cpu_cores_floor=2.0)
+
+        Scheduler.run_scheduling()
+
+        assert all(instance.node_id for instance in ServiceInstanceModel.retrieve_schemas())
+        assert first(SchedulerLogModel.retrieve_schemas()).metrics.packing_ratio == 1.0
+
+    def test_packing_ratio_counts_not_placed_instances(self):
+        NodeFactory.create(was_updated=False, cpu_cores=2.0)
+        for _ in range(2):
+            ServiceFactory.create(was_updated=True, cpu_cores_limit=2.0, cpu_cores_floor=2.0)
+
+        Scheduler.run_scheduling()
+
+        assert first(SchedulerLogModel.retrieve_schemas()).metrics.packing_ratio == 0.5
+
+
+class TestPlacementOptimizer:
+    @pytest.fixture
+    def time_budget(self, mocker):
+        mocker.patch("app.scheduler.settings.optimizer_time_budget", timedelta(seconds=1))
+
+    def test_unplaced_instance_is_placed_by_moving_other_instance(self, time_budget):
+        nodes = [NodeFactory.create(was_updated=False, cpu_cores=2.0) for _ in range(2)]
+        for node in nodes:
+            service = ServiceFactory.create(was_updated=False)
+            ServiceInstanceFactory.create(was_updated=False, service=service, host_node=node)
+        ServiceFactory.create(was_updated=True, priority=0, cpu_cores_limit=2.0, cpu_cores_floor=2.0)
+
+        Scheduler.run_scheduling()
+
+        assert all(instance.node_id for instance in ServiceInstanceModel.retrieve_schemas())
+        metrics = first(SchedulerLogModel.retrieve_schemas()).metrics
+        assert metrics.objects_counter[TrackedObjects.EVICTED] == 0
+        assert metrics.actions_counter[TrackedAction.MIGRATION] == 1
+
+    def test_stranded_resources_are_consolidated(self, time_budget):
+        stranded = NodeFactory.create(was_updated=False, cpu_cores=1.5)
+        spacious = NodeFactory.create(was_updated=False, cpu_cores=3.0)
+        for node in (stranded, spacious):
+            service = ServiceFactory.create(was_updated=False)
+            ServiceInstanceFactory.create(was_updated=False, service=service, host_node=node)
+        ServiceFactory.create(was_updated=False)  # Trigger run
+
+        Scheduler.run_scheduling()
+
+        assert all(str(instance.node_id) == str(spacious.id) for instance in ServiceInstanceModel.retrieve_schemas())
+
+    def test_stateful_instances_are_not_moved(self, time_budget):
+        stranded = NodeFactory.create(was_updated=False, cpu_cores=1.5)
+        NodeFactory.create(was_updated=False, cpu_cores=3.0)
+        service = ServiceFactory.create(was_updated=False, type=ServiceType.STATEFUL.value)
+        ServiceInstanceFactory.create(was_updated=False, service=service, host_node=stranded)
+
+        Scheduler.run_scheduling()
+
+        assert str(first(ServiceInstanceModel.retrieve_schemas()).node_id) == str(stranded.id)
+
+    def test_nothing_is_changed_when_time_budget_is_exhausted(self):
+        stranded = NodeFactory.create(was_updated=False, cpu_cores=1.5)
+        NodeFactory.create(was_updated=False, cpu_cores=3.0)
+        service = ServiceFactory.create(was_updated=False)
+        ServiceInstanceFactory.create(was_updated=False, service=service, host_node=stranded)
+        state = Scheduler.get_state()
+        state.calculate_available_resources()
+
+        PlacementOptimizer.run(state, timedelta(0))
+
+        assert str(first(state.service_instances).node_id) == str(stranded.id)
+
+    def test_nothing_is_changed_when_relocation_does_not_fit(self):
+        nodes = [NodeFactory.create(was_updated=False, cpu_cores=cpu_cores) for cpu_cores in (1.0, 2.0, 1.0)]
+        for node in nodes[:2]:
+            ServiceInstanceFactory.create(was_updated=False, service=ServiceFactory.create(), host_node=node)
+        state = Scheduler.get_state()
+        state.calculate_available_resources()
+        first_instance, second_instance = (first(state.get_node_instances(node)) for node in state.nodes[:2])
+        available_resources = {node_id: resources.copy() for node_id, resources in state.available_resources.items()}
+
+        with pytest.raises(SchedulingError):  # First move fits, but second does not
+            state.relocate_instances([(first_instance, state.nodes[2]), (second_instance, state.nodes[2])])
+
+        assert state.available_resources == available_resources
+        assert first_instance.node_id == state.nodes[0].id and second_instance.node_id == state.nodes[1].id
+
+
+class TestCascadingReplacement:
+    @pytest.fixture
+    def preempting_service(self):
+        node = NodeFactory.create(was_updated=False, cpu_cores=2.0)
+        NodeFactory.create(was_updated=False, cpu_cores=1.0)
+        victim = ServiceFactory.create(was_updated=False, priority=10)
+        ServiceInstanceFactory.create(was_updated=False, service=victim, host_node=node)
+        ServiceFactory.create(was_updated=True, cpu_cores_limit=2.0, cpu_cores_floor=2.0)
+        return victim
+
+    def test_evicted_instances_are_placed_in_same_run(self, preempting_service):
+        Scheduler.run_scheduling()
+
+        assert all(instance.node_id for instance in ServiceInstanceModel.retrieve_schemas())
+        metrics = first(SchedulerLogModel.retrieve_schemas()).metrics
+        assert metrics.actions_counter[TrackedAction.EVICTION] == 1
+        assert metrics.packing_ratio == 1.0
+
+    def test_evicted_instances_are_left_for_next_run_beyond_cascade_depth(self, mocker, preempting_service):
+        mocker.patch.object(ServiceInstanceUpdatesResolver, "max_cascade_depth", 0)
+
+        Scheduler.run_scheduling()
+
+        victim_instance = first(
+            ServiceInstanceModel.retrieve_schemas_where(ServiceInstanceModel.service_id == preempting_service.id)
+        )
+        assert victim_instance.node_id is None
+        assert first(SchedulerLogModel.retrieve_schemas()).metrics.objects_counter[TrackedObjects.EVICTED] == 1
+
+        Scheduler.run_scheduling()
+
+        assert all(instance.node_id for instance in ServiceInstanceModel.retrieve_schemas())
+
+
+class TestConstrainedInstances:
+    @staticmethod
+    def _create_constrained_instance(node: NodeModel) -> ServiceInstanceModel:
+        service = ServiceFactory.create(was_updated=False, cpu_cores_limit=2.0)
+        return ServiceInstanceFactory.create(
+            was_updated=True, service=service, host_node=node, resource_status=ResourceStatus.CONSTRAINT_BY_CPU.value
+        )
+
+    def test_constrained_instance_is_moved_with_the_least_disruptive_evictions(self):
+        constrained_node = NodeFactory.create(was_updated=False, cpu_cores=1.0)
+        occupied_node = NodeFactory.create(was_updated=False, cpu_cores=2.0)
+        low_priority_service = ServiceFactory.create(was_updated=False, priority=0)
+        ServiceInstanceFactory.create(was_updated=False, service=low_priority_service, host_node=occupied_node)
+        NodeFactory.create(was_updated=False, cpu_cores=4.0)
+        instance = self._create_constrained_instance(constrained_node)
+
+        Scheduler.run_scheduling()
+
+        moved_instance = ServiceInstanceModel.retrieve_schema(instance.id)
+        assert moved_instance.node_id not in (UUID(constrained_node.id), UUID(occupied_node.id))
+        assert moved_instance.resource_status == ResourceStatus.OK
+        assert SchedulerLogModel.retrieve_schemas()[-1].metrics.actions_counter[TrackedAction.EVICTION] == 1
+
+    def test_instance_stays_constrained_if_it_cannot_be_moved(self):
+        constrained_node = NodeFactory.create(was_updated=False, cpu_cores=1.0)
+        NodeFactory.create(was_updated=False, cpu_cores=1.0)
+        instance = self._create_constrained_instance(constrained_node)
+
+        Scheduler.run_scheduling()
+
+        instance = ServiceInstanceModel.retrieve_schema(instance.id)
+        assert instance.node_id == UUID(constrained_node.id)
+        assert instance.resource_status == ResourceStatus.CONSTRAINT_BY_CPU
+
+
+class TestUnplaceableRequests:
+    def test_failed_request_is_not_retried_until_capacity_changes(self, mocker):
+        node = NodeFactory.create(was_updated=False, **(base_allocated_resources.dict()))
+        service = ServiceFactory.create(was_updated=False)
+        ServiceInstanceFactory.create(was_updated=False, service=service, host_node=node)
+        for _ in range(2):
+            ServiceFactory.create(was_updated=True, priority=0)
+        place_instance_somewhere = mocker.spy(ServiceInstanceUpdatesResolver, "place_instance_somewhere")
+
+        Scheduler.run_scheduling()
+        Scheduler.run_scheduling()
+
+        assert place_instance_somewhere.call_count == 1  # Same request failed at the same capacity version
+
+        NodeFactory.create(was_updated=True, **(base_allocated_resources.dict()))
+        Scheduler.run_scheduling()
+
+        assert place_instance_somewhere.call_count == 3
+        assert len([instance for instance in ServiceInstanceModel.retrieve_schemas() if instance.node_id]) == 2
+
+    def test_failed_request_is_not_retried_after_execution_status_event(self, mocker):
+        node = NodeFactory.create(was_updated=False, **(base_allocated_resources.dict()))
+        service = ServiceFactory.create(was_updated=False)
+        instance = ServiceInstanceFactory.create(was_updated=False, service=service, host_node=node)
+        ServiceFactory.create(was_updated=True, priority=0)
+        place_instance_somewhere = mocker.spy(ServiceInstanceUpdatesResolver, "place_instance_somewhere")
+
+        Scheduler.run_scheduling()
+        capacity_version = Scheduler.get_state().capacity_version
+        ServiceInstanceModel.update_columns_where(instance.id, {"execution_status": ExecutionStatus.CRASH_LOOP.value})
+        ChangeLogModel.record(ChangedObjectType.SERVICE_INSTANCE, [UUID(instance.id)])
+        Scheduler.run_scheduling()
+
+        assert place_instance_somewhere.call_count == 1  # Nothing is released by event, so capacity is the same
+        assert Scheduler.get_state().capacity_version == capacity_version
+
+
+class TestResidentClusterState:
+    def test_state_is_kept_between_runs(self):
+        NodeFactory.create(was_updated=False)
+
+        Scheduler.run_scheduling()
+        state = Scheduler._state
+        Scheduler.run_scheduling()
+
+        assert state is not None and Scheduler._state is state
+
+    def test_only_changed_rows_are_loaded_on_next_run(self, mocker):
+        node = NodeFactory.create(was_updated=False)
+        Scheduler.run_scheduling()
+
+        to_node_schema = mocker.spy(NodeModel, "_to_schema")
+        service = ServiceFactory.create(was_updated=True)
+        Scheduler.run_scheduling()
+
+        instance = first(ServiceInstanceModel.retrieve_schemas())
+        assert to_node_schema.call_count == 0  # Unchanged node is not reloaded
+        assert str(instance.service_id) == str(service.id)
+        assert str(instance.node_id) == str(node.id)
+
+    def test_nothing_is_written_if_nothing_changed(self, mocker):
+        node = NodeFactory.create(was_updated=False)
+        service = ServiceFactory.create(was_updated=False)
+        ServiceInstanceFactory.create(was_updated=False, service=service, host_node=node)
+        Scheduler.run_scheduling()
+
+        bulk_updates = [mocker.spy(model, "bulk_update") for model in (NodeModel, ServiceModel, ServiceInstanceModel)]
+        Scheduler.run_scheduling()
+
+        assert all(bulk_update.call_count == 0 for bulk_update in bulk_updates)
+
+    def test_state_is_dropped_if_scheduling_fails(self, mocker):
+        NodeFactory.create(was_updated=False)
+        mocker.patch("app.scheduler.NodeUpdatesResolver.run", side_effect=SchedulingError())
+
+        with pytest.raises(SchedulingError):
+            Scheduler.run_scheduling()
+
+        assert Scheduler._state is None
+
+
+class TestOptimisticCommit:
+    def test_concurrently_updated_instance_is_not_overwritten_and_resolved_on_next_run(self, mocker):
+        failed_node = NodeFactory.create(was_updated=True, status=NodeStatus.FAILED.value)
+        node = NodeFactory.create(was_updated=False)
+        instance = ServiceInstanceFactory.create(
+            was_updated=False, service=ServiceFactory.create(was_updated=False), host_node=failed_node
+        )
+
+        run = NodeUpdatesResolver.run
+
+        def run_with_concurrent_event(state):
+            ServiceInstanceModel.update_columns_where(instance.id, {"execution_status": ExecutionStatus.RUNNING.value})
+            ChangeLogModel.record(ChangedObjectType.SERVICE_INSTANCE, [UUID(instance.id)])
+            return run(state)
+
+        mocker.patch.object(NodeUpdatesResolver, "run", side_effect=run_with_concurrent_event)
+        Scheduler.run_scheduling()
+
+        stored = ServiceInstanceModel.get(id=instance.id)
+        assert str(stored.host_node_id) == str(failed_node.id)  # Placement is not written over the event
+        assert stored.execution_status == ExecutionStatus.RUNNING.value
+        metrics = first(SchedulerLogModel.retrieve_schemas()).metrics
+        assert metrics.objects_counter[TrackedObjects.CONFLICTING] == 1
+
+        mocker.patch.object(NodeUpdatesResolver, "run", side_effect=run)
+        Scheduler.run_scheduling()
+
+        assert str(ServiceInstanceModel.get(id=instance.id).host_node_id) == str(node.id)
+
+    def test_preemption_is_not_committed_partially_when_evicted_instance_conflicts(self, mocker):
+        node = NodeFactory.create(  # Enough resources for single instance
+            was_updated=False, **(base_allocated_resources.dict())
+        )
+        victim = ServiceInstanceFactory.create(
+            was_updated=False, service=ServiceFactory.create(was_updated=False, priority=0), host_node=node
+        )
+        other_node = NodeFactory.create(was_updated=False, **(base_allocated_resources.dict()))
+        ServiceInstanceFactory.create(
+            was_updated=False, service=ServiceFactory.create(was_updated=False, priority=0), host_node=other_node
+        )
+        Scheduler.run_scheduling()
+        state = Scheduler._state
+
+        important, other = ServiceFactory.create_batch(size=2, was_updated=True, priority=99)
+
+        run = NodeUpdatesResolver.run
+
+        def run_with_concurrent_event(state):
+            ServiceInstanceModel.update_columns_where(victim.id, {"execution_status": ExecutionStatus.RUNNING.value})
+            ChangeLogModel.record(ChangedObjectType.SERVICE_INSTANCE, [UUID(victim.id)])
+            return run(state)
+
+        mocker.patch.object(NodeUpdatesResolver, "run", side_effect=run_with_concurrent_event)
+        Scheduler.run_scheduling()
+
+        # Neither placement of preempting instance nor eviction of conflicting one is written,
+        # preemption on other node does not depend on conflicting instance, so it is written
+        host_node_ids = {obj.id: ServiceInstanceModel.get(service=obj.id).host_node_id for obj in (important, other)}
+        assert sorted(map(str, host_node_ids.values())) == sorted(["None", str(other_node.id)])
+        assert str(ServiceInstanceModel.get(id=victim.id).host_node_id) == str(node.id)
+        assert Scheduler._state is state  # Resident state is kept
+        metrics = SchedulerLogModel.retrieve_schemas()[-1].metrics
+        assert metrics.objects_counter[TrackedObjects.CONFLICTING] == 1
+
+        mocker.patch.object(NodeUpdatesResolver, "run", side_effect=run)
+        Scheduler.run_scheduling()  # Node is not overcommitted, so preemption is retried
+
+        for service_id, host_node_id in host_node_ids.items():
+            expected_node_id = host_node_id or UUID(node.id)
+            assert str(ServiceInstanceModel.get(service=service_id).host_node_id) == str(expected_node_id)
+        assert ServiceInstanceModel.get(id=victim.id).host_node_id is None
+
+    def test_instances_created_by_scheduler_are_inserted_on_commit(self):
+        NodeFactory.create(was_updated=False)
+        service = ServiceFactory.create(was_updated=True)
+
+        Scheduler.run_scheduling()
+
+        instance = first(ServiceInstanceModel.retrieve_schemas())
+        assert str(instance.service_id) == str(service.id)
+        assert instance.status == ServiceInstanceStatus.PLACED
+        assert ServiceInstanceModel.get(id=instance.id).version == 0
+
+
+class TestChangeLog:
+    def test_scheduler_writes_do_not_create_work_for_next_run(self):
+        NodeFactory.create()
+        ServiceFactory.create(was_updated=True)
+        Scheduler.run_scheduling()
+
+        state = Scheduler.get_state()
+
+        assert not (state.updated_nodes_ids or state.updated_services_ids or state.updated_service_instances_ids)
+
+    def test_changes_before_checkpoint_are_not_resolved_after_restart(self):
+        NodeFactory.create(was_updated=True)
+        ServiceFactory.create(was_updated=True)
+        Scheduler.run_scheduling()
+
+        Scheduler.reset_state()
+        state = Scheduler.get_state()
+
+        assert state.checkpoint == ChangeLogModel.last_seq(ChangeSource.API)
+        assert not (state.updated_nodes_ids or state.updated_services_ids or state.updated_service_instances_ids)
+
+    def test_not_placed_instances_are_resolved_after_restart(self):
+        service = ServiceFactory.create(was_updated=True)
+        Scheduler.run_scheduling()  # There are no nodes to place instance on
+
+        Scheduler.reset_state()
+        state = Scheduler.get_state()
+
+        assert state.updated_service_instances_ids == {state.ids_to_services_mapping[UUID(service.id)].instance_id}
+
+    def test_deleted_instances_of_active_services_are_resolved_after_restart(self):
+        node = NodeFactory.create(was_updated=False)
+        service = ServiceFactory.create(was_updated=False)
+        instance = ServiceInstanceFactory.create(
+            was_updated=False,
+            service=service,
+            host_node=None,
+            status=ServiceInstanceStatus.DELETED.value,
+            execution_status=None,
+            resource_status=None,
+        )
+
+        Scheduler.run_scheduling()
+
+        stored = ServiceInstanceModel.get(id=instance.id)
+        assert stored.status == ServiceInstanceStatus.PLACED.value
+        assert str(stored.host_node_id) == str(node.id)
+
+
+class TestSchedulingLoop:
+    @staticmethod
+    def _run_loop(loop: SchedulingLoop, triggers: int, seconds: float):
+        async def run():
+            await loop.start()
+            for _ in range(triggers):
+                loop.trigger()
+            await asyncio.sleep(seconds)
+            await loop.stop()
+
+        asyncio.run(run())
+
+    def test_burst_of_triggers_is_coalesced_into_one_run(self, mocker):
+        run_scheduling = mocker.patch.object(Scheduler, "run_scheduling")
+        loop = SchedulingLoop(debounce=timedelta(milliseconds=50), max_staleness=timedelta(seconds=10))
+
+        self._run_loop(loop, triggers=10, seconds=0.2)
+
+        assert run_scheduling.call_count == 1
+        assert not loop.is_running
+
+    def test_scheduling_is_run_when_max_staleness_passes(self, mocker):
+        run_scheduling = mocker.patch.object(Scheduler, "run_scheduling")
+        loop = SchedulingLoop(debounce=timedelta(0), max_staleness=timedelta(milliseconds=50))
+
+        self._run_loop(loop, triggers=0, seconds=0.2)
+
+        assert run_scheduling.call_count >= 2
+
+    def test_failed_run_does_not_stop_loop(self, mocker):
+        run_scheduling = mocker.patch.object(Scheduler, "run_scheduling", side_effect=SchedulingError())
+        loop = SchedulingLoop(debounce=timedelta(0), max_staleness=timedelta(milliseconds=50))
+
+        self._run_loop(loop, triggers=1, seconds=0.2)
+
+        assert run_scheduling.call_count >= 2
+
+    def test_scheduling_is_not_run_while_scheduler_lock_is_held_elsewhere(self, mocker, tmp_path):
+        run_scheduling = mocker.patch.object(Scheduler, "run_scheduling")
+        lock, other_scheduler_lock = SchedulerLock(str(tmp_path / "lock")), SchedulerLock(str(tmp_path / "lock"))
+        assert other_scheduler_lock.acquire()
+        loop = SchedulingLoop(debounce=timedelta(0), max_staleness=timedelta(milliseconds=20), lock=lock)
+
+        self._run_loop(loop, triggers=1, seconds=0.1)
+        assert run_scheduling.call_count == 0
+
+        other_scheduler_lock.release()  # Other scheduler exits, this loop takes over
+        self._run_loop(loop, triggers=1, seconds=0.1)
+        assert run_scheduling.call_count >= 1
+        assert not lock.is_acquired  # Lock is released once loop is stopped
+
+    def test_trigger_does_nothing_if_loop_is_not_running(self):
+        SchedulingLoop(debounce=timedelta(0), max_staleness=timedelta(0)).trigger()
+
+
+class TestChangeLogWatcher:
+    def test_changes_appended_to_log_trigger_scheduling(self, mocker):
+        scheduling_loop = mocker.Mock(spec=SchedulingLoop)
+        watcher = ChangeLogWatcher(scheduling_loop, poll_interval=timedelta(milliseconds=10))
+
+        async def run() -> tuple[int, int]:
+            task = asyncio.create_task(watcher.run())
+            await asyncio.sleep(0.1)
+            on_start = scheduling_loop.trigger.call_count
+            ChangeLogModel.record(ChangedObjectType.NODE, [uuid4()])
+            await asyncio.sleep(0.1)
+            task.cancel()
+            return on_start, scheduling_loop.trigger.call_count
+
+        on_start, after_change = asyncio.run(run())
+
+        assert on_start == 1  # Changes made before start are resolved
+        assert after_change == 2
+
+
+class TestWorkerSupervisor:
+    def test_exited_worker_process_is_restarted_and_stopped_on_stop(self, mocker, tmp_path):
+        processes = [mocker.Mock(is_alive=mocker.Mock(return_value=alive), exitcode=None) for alive in (False, True)]
+        mocker.patch("app.scheduler.worker.start_worker_process", side_effect=processes)
+        stop_worker_process = mocker.patch("app.scheduler.worker.stop_worker_process")
+        mocker.patch("app.scheduler.worker.get_scheduler_lock", return_value=SchedulerLock(str(tmp_path / "lock")))
+        supervisor = WorkerSupervisor(check_interval=timedelta(milliseconds=10))
+
+        async def run():
+            await supervisor.start()
+            await asyncio.sleep(0.1)
+            await supervisor.stop()
+
+        asyncio.run(run())
+
+        assert supervisor.restarts == 1  # Only exited process is restarted
+        stop_worker_process.assert_called_once_with(processes[1])
+
+    def test_worker_process_is_not_started_while_scheduler_lock_is_held_elsewhere(self, mocker, tmp_path):
+        start_worker_process = mocker.patch("app.scheduler.worker.start_worker_process")
+        mocker.patch("app.scheduler.worker.get_scheduler_lock", return_value=SchedulerLock(str(tmp_path / "lock")))
+        other_scheduler_lock = SchedulerLock(str(tmp_path / "lock"))
+        assert other_scheduler_lock.acquire()
+        supervisor = WorkerSupervisor(check_interval=timedelta(milliseconds=10))
+
+        async def run(duration: float):
+            await supervisor.start()
+            await asyncio.sleep(duration)
+            await supervisor.stop()
+
+        asyncio.run(run(0.05))
+        start_worker_process.assert_not_called()
+
+        other_scheduler_lock.release()  # Other scheduler exits, worker takes over
+        asyncio.run(run(0.05))
+        start_worker_process.assert_called_once()
+
+
+class TestSchedulerLock:
+    def test_lock_is_held_by_single_object(self, tmp_path):
+        lock, other_lock = SchedulerLock(str(tmp_path / "lock")), SchedulerLock(str(tmp_path / "lock"))
+
+        assert lock.acquire()
+        assert not other_lock.acquire()
+        assert other_lock.is_held_elsewhere()
+        assert not lock.is_held_elsewhere()
+
+        lock.release()
+        assert not other_lock.is_held_elsewhere()
+        assert other_lock.acquire()
@@ -4,3 +4,4 @@ class SchedulingError(Exception):
 
 class EvictionError(Exception):
     pass
+